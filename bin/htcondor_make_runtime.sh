@@ -61,7 +61,7 @@ zip -rq $STARTDIR/CRAB3.zip WMCore PSetTweaks -x \*.pyc || exit 3
 popd
 
 pushd $ORIGDIR/build/lib
-zip -rq $STARTDIR/CRAB3.zip RESTInteractions.py HTCondorUtils.py TaskWorker CRABInterface  -x \*.pyc || exit 3
+zip -rq $STARTDIR/CRAB3.zip RESTInteractions.py HTCondorUtils.py HTCondorTaskStatus.py TaskWorker CRABInterface  -x \*.pyc || exit 3
 popd
 
 pushd $VO_CMS_SW_DIR/$SCRAM_ARCH/external/py2-httplib2/*/lib/python2.6/site-packages
@@ -141,7 +141,7 @@ zip -rq $STARTDIR/CRAB3.zip WMCore PSetTweaks -x \*.pyc || exit 3
 popd
 
 pushd $CRABSERVER_PATH/src/python
-zip -rq $STARTDIR/CRAB3.zip RESTInteractions.py HTCondorUtils.py TaskWorker CRABInterface  -x \*.pyc || exit 3
+zip -rq $STARTDIR/CRAB3.zip RESTInteractions.py HTCondorUtils.py HTCondorTaskStatus.py TaskWorker CRABInterface  -x \*.pyc || exit 3
 popd
 
 
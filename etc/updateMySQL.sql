@@ -1,2 +1,5 @@
 --https://github.com/dmwm/CRABServer/issues/4154
 ALTER TABLE TASKS ADD (tm_maxjobruntime BIGINT, tm_numcores BIGINT, tm_maxmemory BIGINT, tm_priority BIGINT);
+CREATE INDEX fmd_taskname_jobid_idx ON filemetadata (tm_taskname, panda_job_id);
+CREATE INDEX fmd_taskname_time_idx ON filemetadata (tm_taskname, fmd_creation_time);
+ALTER TABLE filemetadata ADD (fmd_lumis LONGTEXT);
@@ -1,2 +1,5 @@
 ALTER TABLE FILEMETADATA ADD (fmd_direct_stageout VARCHAR(1));
 ALTER TABLE TASKS ADD(tm_output_dataset CLOB);
+CREATE INDEX fmd_taskname_jobid_idx ON filemetadata (tm_taskname, panda_job_id);
+CREATE INDEX fmd_taskname_time_idx ON filemetadata (tm_taskname, fmd_creation_time);
+ALTER TABLE filemetadata ADD (fmd_lumis CLOB);
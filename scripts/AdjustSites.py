@@ -21,6 +21,7 @@ terminator_re = re.compile(r"^\.\.\.$")
 event_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+/\d+ \d+:\d+:\d+ POST Script terminated.")
 term_re = re.compile(r"Normal termination \(return value 2\)")
 node_re = re.compile(r"DAG Node: Job(\d+)")
+new_term = "Normal termination (return value 1)"
 def adjustPost(resubmit):
     """
     ...
@@ -28,67 +29,72 @@ def adjustPost(resubmit):
         (1) Normal termination (return value 1)
         DAG Node: Job105
     ...
+
+    The nodes log of a large task can be hundreds of MB, so we stream through it
+    one event at a time and only remember the offsets of the termination lines
+    that need to change.  The replacement has exactly the same length as the
+    original line; hence the file is patched in place and unchanged regions are
+    never rewritten.
+
+    Note we can't write into a temp file and do an atomic rename because the
+    running shadows keep their event log file descriptors open.  Patching in
+    place keeps the inode and doesn't need any extra quota.  We don't race with
+    the shadow as we have a write lock on the file itself.
     """
     if not resubmit:
         return
     resubmit_all = resubmit == True
+    patches = findPostPatches("RunJobs.dag.nodes.log", resubmit, resubmit_all)
+    if not patches:
+        return
+    print "Adjusting %d POST script terminations in RunJobs.dag.nodes.log" % len(patches)
+    output_fd = open("RunJobs.dag.nodes.log", "r+b")
+    try:
+        for offset, line in patches:
+            output_fd.seek(offset)
+            output_fd.write(line)
+    finally:
+        output_fd.close()
+
+def findPostPatches(filename, resubmit, resubmit_all):
+    """
+    Scan the nodes log and return a list of (offset, new line) for every
+    'POST Script terminated' event with return value 2 belonging to a node
+    that needs to be resubmitted.
+    """
+    patches = []
     ra_buffer = []
-    alt = None
-    output = ''
-    for line in open("RunJobs.dag.nodes.log").readlines():
-        if len(ra_buffer) == 0:
-            m = terminator_re.search(line)
-            if m:
-                ra_buffer.append(line)
-            else:
-                output += line
-        elif len(ra_buffer) == 1:
-            m = event_re.search(line)
-            if m:
-                ra_buffer.append(line)
-            else:
-                for l in ra_buffer: output += l
-                output += line
-                ra_buffer = []
-        elif len(ra_buffer) == 2:
-            m = term_re.search(line)
-            if m:
-                ra_buffer.append("        (1) Normal termination (return value 1)\n")
-                alt = line
-            else:
-                for l in ra_buffer: output += l
-                output += line
+    term_offset = 0
+    term_line = None
+    offset = 0
+    fd = open(filename, "rb")
+    try:
+        for line in fd:
+            # Cheap prefix checks first; the regexps only run on candidate lines.
+            if len(ra_buffer) == 0:
+                if line.startswith("...") and terminator_re.search(line):
+                    ra_buffer.append(line)
+            elif len(ra_buffer) == 1:
+                if line.startswith("016 ") and event_re.search(line):
+                    ra_buffer.append(line)
+                else:
+                    ra_buffer = []
+            elif len(ra_buffer) == 2:
+                if term_re.search(line):
+                    ra_buffer.append(line)
+                    term_offset = offset
+                    term_line = line
+                else:
+                    ra_buffer = []
+            elif len(ra_buffer) == 3:
+                m = node_re.search(line)
+                if m and (resubmit_all or (m.groups()[0] in resubmit)):
+                    patches.append((term_offset, term_re.sub(new_term, term_line)))
                 ra_buffer = []
-        elif len(ra_buffer) == 3:
-            m = node_re.search(line)
-            print line, m, m.groups(), resubmit
-            if m and (resubmit_all or (m.groups()[0] in resubmit)):
-                print m.groups()[0], resubmit
-                for l in ra_buffer: output += l
-            else:
-                for l in ra_buffer[:-1]: output += l
-                output += alt
-            output += line
-            ra_buffer = []
-        else:
-            output += line
-    if ra_buffer:
-        for l in ra_buffer: output += l
-    # This is a curious dance!  If the user is out of quota, we don't want
-    # to fail halfway into writing the file.  OTOH, we can't write into a temp
-    # file and an atomic rename because the running shadows keep their event log
-    # file descriptors open.  Accordingly, we write the file once (to see if we)
-    # have enough quota space, then rewrite "the real file" after deleting the
-    # temporary one.  There's a huge race condition here, but it seems to be the
-    # best we can do giveen the constraints.  Note that we don't race with the
-    # shadow as we have a write lock on the file itself.
-    output_fd = open("RunJobs.dag.nodes.log.tmp", "w")
-    output_fd.write(output)
-    output_fd.close()
-    os.unlink("RunJobs.dag.nodes.log.tmp")
-    output_fd = open("RunJobs.dag.nodes.log", "w")
-    output_fd.write(output)
-    output_fd.close()
+            offset += len(line)
+    finally:
+        fd.close()
+    return patches
 
 def resubmitDag(filename, resubmit):
     if not os.path.exists(filename):
@@ -135,6 +141,14 @@ def make_webdir(ad):
             os.symlink(os.path.abspath(os.path.join(".", "aso_status.json")), os.path.join(path, "aso_status.json"))
         except:
             pass
+        try:
+            os.symlink(os.path.abspath(os.path.join(".", "status_summary.json")), os.path.join(path, "status_summary.json"))
+        except:
+            pass
+        try:
+            os.symlink(os.path.abspath(os.path.join(".", "status_states.json")), os.path.join(path, "status_states.json"))
+        except:
+            pass
     except OSError:
         pass
     try:
@@ -157,9 +171,30 @@ def make_webdir(ad):
         print traceback.format_exc()
 
 def make_job_submit(ad):
+    """
+    DAGMan wants a submit file for every node, but the per-job content is only
+    written by the PreJob right before the node is submitted (Job.submit plus
+    a small per-job overlay).  Until then, hard link the shared template instead
+    of copying it: links cost neither data blocks nor inodes.  This only saves
+    the copies made at start-up: every node the PreJob has submitted still has
+    its own full Job.N.submit, so in the end the disk used by the submit files
+    still grows with the number of jobs.
+    """
     count = ad['CRAB_JobCount']
+    base = os.stat("Job.submit")
     for i in range(1, count+1):
-        shutil.copy("Job.submit", "Job.%d.submit" % i)
+        fname = "Job.%d.submit" % i
+        try:
+            st = os.stat(fname)
+            if (st.st_ino == base.st_ino) and (st.st_dev == base.st_dev):
+                continue
+            os.unlink(fname)
+        except OSError:
+            pass
+        try:
+            os.link("Job.submit", fname)
+        except OSError:
+            shutil.copy("Job.submit", fname)
 
 def clear_automatic_blacklist(ad):
     for file in glob.glob("task_statistics.*"):
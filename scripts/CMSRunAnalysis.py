@@ -4,6 +4,8 @@ CMSRunAnalysis.py - the runtime python portions to launch a CRAB3 / cmsRun job.
 """
 
 import os
+import zlib
+import Queue
 import shutil
 import socket
 import os.path
@@ -14,7 +16,10 @@ import re
 import json
 import traceback
 import pickle
+import hashlib
+import tarfile
 import logging
+import threading
 import subprocess
 from ast import literal_eval
 from optparse import OptionParser, BadOptionError, AmbiguousOptionError
@@ -30,6 +35,13 @@ EC_ReportHandlingErr =  50115
 EC_WGET =               99998 #TODO define an error code
 EC_PsetHash           = 60453
 
+# Large, page-aligned reads for the output file checksums
+CHECKSUM_BUFFER_SIZE = 4*1024*1024
+
+# Provenance dump of the EDM output files, used to find their PSet hash
+EDMPROVDUMP = os.environ.get('CRAB3_EDMPROVDUMP', 'edmProvDump')
+PROV_MARKER = '==== CRAB3 edmProvDump: '
+
 def mintime():
     mymin = 20*60
     tottime = time.time()-starttime
@@ -416,30 +428,81 @@ def parseArgs():
     return opts
 
 
+def sandboxListingHash(archive):
+    """
+    The crabcache hashkey of the sandbox archive: the sha256 of the (name,
+    size, mtime, uname) of its members, as computed by the client and checked
+    by the crabcache on upload.  Reading the member headers doesn't extract
+    anything.
+    """
+    tar = tarfile.open(archive, mode='r')
+    try:
+        lsl = [(x.name, int(x.size), int(x.mtime), x.uname) for x in tar.getmembers()]
+    finally:
+        tar.close()
+    return hashlib.sha256(str(lsl)).hexdigest()
+
+
+def expectedSandboxHash(archive):
+    """
+    The crabcache hashkey the sandbox must have, from its name in the cache
+    (<hashkey>.tar.gz), or None if the name is not a hashkey.
+    """
+    hashkey = os.path.basename(archive).split(".")[0]
+    if re.match(r'^[a-f0-9]{64}$', hashkey):
+        return hashkey
+    return None
+
+
+def extractSandbox(archive):
+    """
+    Extract the sandbox in the current directory, failing the job with EC_WGET
+    if the archive is truncated or otherwise unreadable.
+    """
+    status, output = commands.getstatusoutput('tar xfzm %s' % archive)
+    print output
+    if status:
+        print "ERROR: Unable to extract the sandbox %s (exit status %s)" % (archive, status)
+        handleException("FAILED", EC_WGET, 'CMSRunAnalysisERROR: could not extract the sandbox %s' % archive)
+        sys.exit(EC_WGET)
+
+
 def prepSandbox(opts):
     print "==== Sandbox preparation STARTING at %s ====" % time.asctime(time.gmtime())
     os.environ['WMAGENTJOBDIR'] = os.getcwd()
     if opts.archiveJob and not "CRAB3_RUNTIME_DEBUG" in os.environ:
         if os.path.exists(opts.archiveJob):
-            print "Sandbox %s already exists, skipping" % opts.archiveJob
+            print "Sandbox %s already exists, skipping download" % opts.archiveJob
+            extractSandbox(opts.archiveJob)
         elif opts.sourceURL == 'LOCAL' and not os.path.exists(opts.archiveJob):
             print "ERROR: Requested for condor to transfer the tarball, but it didn't show up"
             handleException("FAILED", EC_WGET, 'CMSRunAnalysisERROR: cound not get jobO files from panda server')
             sys.exit(EC_WGET)
         else:
+            url = '%s/cache/%s' % (opts.sourceURL, opts.archiveJob)
+            expectedHash = expectedSandboxHash(opts.archiveJob)
             print "--- wget for jobO ---"
             output = commands.getoutput('wget -h')
-            wgetCommand = 'wget'
+            wgetCommand = 'wget -nv'
             for line in output.split('\n'):
                 if re.search('--no-check-certificate', line) != None:
-                    wgetCommand = 'wget --no-check-certificate'
+                    wgetCommand = 'wget -nv --no-check-certificate'
                     break
-            com = '%s %s/cache/%s' % (wgetCommand, opts.sourceURL, opts.archiveJob)
+            com = '%s -O %s %s' % (wgetCommand, opts.archiveJob, url)
             nTry = 3
             for iTry in range(nTry):
                 print 'Try : %s' % iTry
                 status, output = commands.getstatusoutput(com)
                 print output
+                if status == 0 and expectedHash:
+                    # Checked before anything is extracted.
+                    try:
+                        sandboxHash = sandboxListingHash(opts.archiveJob)
+                    except (tarfile.TarError, IOError), ex:
+                        sandboxHash = "unreadable (%s)" % str(ex)
+                    if sandboxHash != expectedHash:
+                        print "ERROR: The downloaded sandbox has hashkey %s instead of %s" % (sandboxHash, expectedHash)
+                        status = 1
                 if status == 0:
                     break
                 if iTry+1 == nTry:
@@ -447,7 +510,7 @@ def prepSandbox(opts):
                     handleException("FAILED", EC_WGET, 'CMSRunAnalysisERROR: cound not get jobO files from panda server')
                     sys.exit(EC_WGET)
                 time.sleep(30)
-        print commands.getoutput('tar xvfzm %s' % opts.archiveJob)
+            extractSandbox(opts.archiveJob)
     print "==== Sandbox preparation FINISHING at %s ====" % time.asctime(time.gmtime())
 
     #move the pset in the right place
@@ -466,7 +529,11 @@ def prepSandbox(opts):
     print "==== WMCore filesystem preparation FINISHING at %s ====" % time.asctime(time.gmtime())
 
 
-def getProv(filename, opts):
+def getProvs(filenames, opts):
+    """
+    Run edmProvDump on all the given files with a single CMSSW environment
+    setup and return a dictionary with the dump of each file.
+    """
     scram = Scram(
         version = opts.cmsswVersion,
         directory = os.getcwd(),
@@ -477,16 +544,30 @@ def getProv(filename, opts):
         handleException("FAILED", EC_CMSMissingSoftware, 'Error setting CMSSW environment: %s' % msg)
         mintime()
         sys.exit(EC_CMSMissingSoftware)
-    ret = scram("edmProvDump %s" % filename, runtimeDir=os.getcwd(), logName="edmProvDumpOutput.log")
+    command = " && ".join(["echo '%s%s' && %s %s" % (PROV_MARKER, filename, EDMPROVDUMP, filename) for filename in filenames])
+    ret = scram(command, runtimeDir=os.getcwd(), logName="edmProvDumpOutput.log")
     if ret > 0:
         msg = scram.diagnostic()
-        handleException("FAILED", EC_CMSRunWrapper, 'Error getting pset hash from file.\n\tScram Env %s\n\tCommand:edmProvDump %s' % (msg, filename))
+        handleException("FAILED", EC_CMSRunWrapper, 'Error getting pset hash from file.\n\tScram Env %s\n\tCommand:%s' % (msg, command))
         mintime()
         sys.exit(EC_CMSRunWrapper)
-    output = ''
     with open("edmProvDumpOutput.log", "r") as fd:
-        output = fd.read()
-    return output
+        return splitProvs(fd.read())
+
+
+def splitProvs(output):
+    """
+    Split the concatenated output of getProvs into the dump of each file.
+    """
+    provs = {}
+    filename = None
+    for line in output.splitlines(True):
+        if line.startswith(PROV_MARKER):
+            filename = line[len(PROV_MARKER):].strip()
+            provs[filename] = ''
+        elif filename:
+            provs[filename] += line
+    return provs
 
 
 def executeCMSSWStack(opts):
@@ -572,7 +653,52 @@ def executeCMSSWStack(opts):
     return cmssw
 
 
-def AddChecksums(report):
+def calculateChecksums(filename, md5=False):
+    """
+    Compute the adler32 and cksum (and optionally md5) checksums of a file
+    with a single read of its content.
+
+    The POSIX CRC printed by 'cksum' is not available from the python library,
+    so the data is streamed to a 'cksum' subprocess while adler32 and md5 are
+    computed here on the same buffers.  The values are identical to the ones
+    of FileInfo.readAdler32 and FileInfo.readCksum.
+    """
+    adler32 = 1L
+    md5sum = None
+    if md5:
+        md5sum = hashlib.md5()
+    p = subprocess.Popen(["cksum"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        fd = open(filename, 'rb')
+        try:
+            while True:
+                data = fd.read(CHECKSUM_BUFFER_SIZE)
+                if not data:
+                    break
+                p.stdin.write(data)
+                adler32 = zlib.adler32(data, adler32)
+                if md5sum:
+                    md5sum.update(data)
+        finally:
+            fd.close()
+    except:
+        p.stdin.close()
+        p.wait()
+        raise
+    output = p.communicate()[0]
+    if p.returncode:
+        raise Exception("cksum exited with status %d" % p.returncode)
+    checksums = {'adler32': '%x' % (adler32 & 0xffffffffL), 'cksum': output.split()[0]}
+    if md5sum:
+        checksums['md5'] = md5sum.hexdigest()
+    return checksums
+
+
+def AddChecksums(report, threads=1, md5=False):
+    """
+    Add the checksums and size of the output files missing them in the report.
+    With threads > 1, the checksums of several files are computed at once.
+    """
     if 'steps' not in report:
         return
     if 'cmsRun' not in report['steps']:
@@ -580,6 +706,7 @@ def AddChecksums(report):
     if 'output' not in report['steps']['cmsRun']:
         return
 
+    fileInfos = []
     for outputMod in report['steps']['cmsRun']['output'].values():
         for fileInfo in outputMod:
             if 'checksums' in fileInfo:
@@ -589,15 +716,41 @@ def AddChecksums(report):
                     fileInfo['pfn'] = fileInfo['fileName']
                 else:
                     continue
-            print "==== Checksum cksum STARTING at %s ====" % time.asctime(time.gmtime())
-            print "== Filename: %s" % fileInfo['pfn']
-            cksum = FileInfo.readCksum(fileInfo['pfn'])
-            print "==== Checksum finishing FINISHING at %s ====" % time.asctime(time.gmtime())
-            print "==== Checksum adler32 STARTING at %s ====" % time.asctime(time.gmtime())
-            adler32 = FileInfo.readAdler32(fileInfo['pfn'])
-            print "==== Checksum adler32 FINISHING at %s ====" % time.asctime(time.gmtime())
-            fileInfo['checksums'] = {'adler32': adler32, 'cksum': cksum}
-            fileInfo['size'] = os.stat(fileInfo['pfn']).st_size
+            fileInfos.append(fileInfo)
+
+    def addChecksum(fileInfo):
+        print "==== Checksum STARTING at %s ====" % time.asctime(time.gmtime())
+        print "== Filename: %s" % fileInfo['pfn']
+        fileInfo['checksums'] = calculateChecksums(fileInfo['pfn'], md5)
+        fileInfo['size'] = os.stat(fileInfo['pfn']).st_size
+        print "==== Checksum FINISHING at %s ====" % time.asctime(time.gmtime())
+
+    if threads <= 1 or len(fileInfos) <= 1:
+        for fileInfo in fileInfos:
+            addChecksum(fileInfo)
+        return
+
+    queue = Queue.Queue()
+    for fileInfo in fileInfos:
+        queue.put(fileInfo)
+    errors = []
+    def worker():
+        while True:
+            try:
+                fileInfo = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                addChecksum(fileInfo)
+            except Exception, ex:
+                errors.append(ex)
+    workers = [threading.Thread(target=worker) for _ in range(min(threads, len(fileInfos)))]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    if errors:
+        raise errors[0]
 
 
 def AddPsetHash(report, opts):
@@ -627,6 +780,7 @@ def AddPsetHash(report, opts):
 
     pset_re = re.compile("(\s+).*\(([a-f0-9]{32,32})\)$")
     processing_history_re = re.compile("^Processing History:$")
+    fileInfos = []
     for outputMod in report['steps']['cmsRun']['output'].values():
         for fileInfo in outputMod:
             if fileInfo.get('ouput_module_class') != 'PoolOutputModule':
@@ -642,33 +796,41 @@ def AddPsetHash(report, opts):
             if not m:
                 print "== EDM output filename (%s) must match RE ^[A-Za-z0-9\\-._]+$" % filename
                 continue
-            print "==== PSet Hash lookup STARTING at %s ====" % time.asctime(time.gmtime())
-            lines = getProv(filename, opts)
-            found_history = False
-            matches = {}
-            for line in lines.splitlines():
-                 if not found_history:
-                     if processing_history_re.match(line):
-                         found_history = True
-                     continue
-                 m = pset_re.match(line)
-                 if m:
-                     # Note we want the deepest entry in the hierarchy
-                     depth, pset_hash = m.groups()
-                     depth = len(depth)
-                     matches[depth] = pset_hash
-                 else:
-                     break
-            print "==== PSet Hash lookup FINISHED at %s ====" % time.asctime(time.gmtime())
-            if matches:
-                max_depth = max(matches.keys())
-                pset_hash = matches[max_depth]
-                print "== edmProvDump pset hash %s" % pset_hash
-                fileInfo['pset_hash'] = pset_hash
-            else:
-                print "ERROR: PSet Hash missing from edmProvDump output.  Full dump below."
-                print lines
-                raise Exception("PSet hash missing from edmProvDump output.")
+            fileInfos.append(fileInfo)
+    if not fileInfos:
+        return
+
+    print "==== PSet Hash lookup STARTING at %s ====" % time.asctime(time.gmtime())
+    provs = getProvs(sorted(set([fileInfo['pfn'] for fileInfo in fileInfos])), opts)
+    print "==== PSet Hash lookup FINISHED at %s ====" % time.asctime(time.gmtime())
+    for fileInfo in fileInfos:
+        filename = fileInfo['pfn']
+        print "== Filename: %s" % filename
+        lines = provs.get(filename, '')
+        found_history = False
+        matches = {}
+        for line in lines.splitlines():
+             if not found_history:
+                 if processing_history_re.match(line):
+                     found_history = True
+                 continue
+             m = pset_re.match(line)
+             if m:
+                 # Note we want the deepest entry in the hierarchy
+                 depth, pset_hash = m.groups()
+                 depth = len(depth)
+                 matches[depth] = pset_hash
+             else:
+                 break
+        if matches:
+            max_depth = max(matches.keys())
+            pset_hash = matches[max_depth]
+            print "== edmProvDump pset hash %s" % pset_hash
+            fileInfo['pset_hash'] = pset_hash
+        else:
+            print "ERROR: PSet Hash missing from edmProvDump output.  Full dump below."
+            print lines
+            raise Exception("PSet hash missing from edmProvDump output.")
 
 
 if __name__ == "__main__":
@@ -697,7 +859,6 @@ if __name__ == "__main__":
         from WMCore.FwkJobReport.Report import Report
         from WMCore.FwkJobReport.Report import FwkJobReportException
         from WMCore.WMSpec.Steps.WMExecutionFailure import WMExecutionFailure
-        import WMCore.FwkJobReport.FileInfo as FileInfo
         from WMCore.WMSpec.Steps.Executors.CMSSW import CMSSW
         from WMCore.Configuration import Configuration
         from WMCore.WMSpec.WMStep import WMStep
@@ -788,7 +949,7 @@ if __name__ == "__main__":
         # cmsRun failures from stageout failures.  The initial use case of this is to
         # allow us to use a different LFN on job failure.
         report['jobExitCode'] = jobExitCode
-        AddChecksums(report)
+        AddChecksums(report, threads=int(os.environ.get('CRAB_CHECKSUM_THREADS', 1)))
         try:
             AddPsetHash(report, opts)
         except:
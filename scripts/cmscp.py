@@ -15,8 +15,11 @@ import signal
 import hashlib
 import logging
 import tarfile
+import tempfile
+import subprocess
 import datetime
 import traceback
+from distutils.spawn import find_executable
 
 # Bootstrap the CMS_PATH variable; the StageOutMgr will need it
 if 'CMS_PATH' not in os.environ:
@@ -51,11 +54,22 @@ with open("wmcore_initialized", "w") as fd:
 waitTime = 60*60
 numberOfRetries = 2
 retryPauseTime = 60
+## Number of files staged out at the same time when the job ad doesn't say
+## (CRAB_StageoutParallel, from the stageoutParallel TaskWorker parameter).
+maxParallelStageouts = 1
+## Compression of the log tarball; see compress().
+logCompressionLevel = 6
+logMaxSizeMB = 0
 g_now = None
 g_now_epoch = None
 g_job_exit_code = 0
 g_job_report_name = None
+g_job_report = None
 g_job_id = None
+g_job_ad = None
+g_node_map = None
+g_couch_database = None
+g_aso_queue = []
 
 
 def parseAd():
@@ -78,6 +92,16 @@ def parseAd():
     return jobad
 
 
+def getJobAd():
+    """
+    Parse the job ad once per job and return the cached result afterwards.
+    """
+    global g_job_ad
+    if g_job_ad is None:
+        g_job_ad = parseAd()
+    return g_job_ad
+
+
 def reportFailureToDashboard(exitCode):
     try:
         ad = parseAd()
@@ -100,29 +124,143 @@ def reportFailureToDashboard(exitCode):
     DashboardAPI.apmonFree()
 
 
+def getIntFromEnv(name, default):
+    """
+    Return the integer value of the environment variable 'name', or
+    'default' if it is not set or not an integer.
+    """
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print "== WARNING: Ignoring invalid value '%s' of %s." % (os.environ[name], name)
+        return default
+
+
+def getStageoutParallel(value):
+    """
+    Return the number of files to stage out at the same time given by the
+    value 'value' of the CRAB_StageoutParallel job ad attribute, or
+    maxParallelStageouts if it is not a positive integer.
+    """
+    try:
+        max_parallel = int(value)
+    except ValueError:
+        max_parallel = 0
+    if max_parallel < 1:
+        print "== WARNING: Ignoring invalid value '%s' of CRAB_StageoutParallel." % value
+        return maxParallelStageouts
+    return max_parallel
+
+
+class TruncatedLog(object):
+    """
+    Read-only file object giving the first and the last 'keep' / 2 bytes of
+    a file, with a note in between saying how much was left out. Used to
+    archive only the head and the tail of huge text logs.
+    """
+
+    def __init__(self, name, keep):
+        self.fd = open(name, 'rb')
+        size = os.fstat(self.fd.fileno()).st_size
+        head = keep / 2
+        tail = keep - head
+        note = "\n==== CRAB: %d bytes were removed from the middle of this log (original size %d bytes). ====\n" % \
+               (size - head - tail, size)
+        self.segments = [(0, head), note, (size - tail, tail)]
+        self.size = head + len(note) + tail
+        self.removed = size - head - tail
+
+    def read(self, size = -1):
+        chunks = []
+        while self.segments and size != 0:
+            segment = self.segments.pop(0)
+            if isinstance(segment, str):
+                data = segment if size < 0 else segment[:size]
+                if len(data) < len(segment):
+                    self.segments.insert(0, segment[len(data):])
+            else:
+                offset, length = segment
+                self.fd.seek(offset)
+                data = self.fd.read(length if size < 0 else min(size, length))
+                if data and len(data) < length:
+                    self.segments.insert(0, (offset + len(data), length - len(data)))
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return ''.join(chunks)
+
+    def close(self):
+        self.fd.close()
+
+
+def addLogToTarball(tf, name, arcname, max_size = 0):
+    """
+    Add the given text log to the tarball. If 'max_size' is positive and the
+    log is bigger than that, only its head and tail are archived.
+    """
+    if max_size <= 0 or os.stat(name).st_size <= max_size:
+        tf.add(name, arcname = arcname)
+        return
+    log = TruncatedLog(name, max_size)
+    try:
+        print "Keeping only the first and last %d bytes of %s (%d bytes removed)" % (max_size / 2, name, log.removed)
+        tarinfo = tf.gettarinfo(name, arcname = arcname)
+        tarinfo.size = log.size
+        tf.addfile(tarinfo, log)
+    finally:
+        log.close()
+
+
 def compress(id):
+    """
+    Create the log tarball cmsRun_<id>.log.tar.gz. How it is compressed can be
+    tuned with environment variables:
+      CRAB_LOG_COMPRESSION_LEVEL   - gzip level, 1 (fastest) to 9 (default: logCompressionLevel);
+      CRAB_LOG_COMPRESSION_THREADS - if more than 1 and pigz is available, use
+                                     it to compress with that many threads;
+      CRAB_LOG_MAX_SIZE_MB         - if positive, only keep the head and the tail
+                                     of the text logs bigger than that.
+    The output is a regular .tar.gz in all cases.
+    """
     retval = 0
     output = "cmsRun_%d.log.tar.gz" % id
-    tf = tarfile.open(output, "w:gz")
-    if os.path.exists("cmsRun-stdout.log"):
-        print "Adding cmsRun-stdout.log to tarball %s" % output
-        tf.add("cmsRun-stdout.log", arcname="cmsRun-stdout-%d.log" % id)
+    level = min(max(getIntFromEnv('CRAB_LOG_COMPRESSION_LEVEL', logCompressionLevel), 1), 9)
+    threads = getIntFromEnv('CRAB_LOG_COMPRESSION_THREADS', 1)
+    max_size = getIntFromEnv('CRAB_LOG_MAX_SIZE_MB', logMaxSizeMB) * 1024 * 1024
+
+    pigz = None
+    if threads > 1:
+        pigz = find_executable("pigz")
+        if not pigz:
+            print "pigz is not available; compressing the logs with a single thread."
+    if pigz:
+        print "Compressing %s with pigz (level %d, %d threads)" % (output, level, threads)
+        output_fd = open(output, "wb")
+        pigz_proc = subprocess.Popen([pigz, "-%d" % level, "-p", str(threads)], stdin = subprocess.PIPE, stdout = output_fd)
+        output_fd.close()
+        tf = tarfile.open(mode = "w|", fileobj = pigz_proc.stdin)
     else:
-        print "== ERROR: cmsRun-stdout.log is missing.  Will fail stageout."
-        retval = 80000
-    if os.path.exists("cmsRun-stderr.log"):
-        print "Adding cmsRun-stderr.log to tarball %s" % output
-        tf.add("cmsRun-stderr.log", arcname="cmsRun-stderr-%d.log" % id)
-    else:
-        print "== ERROR: cmsRun-stderr.log is missing.  Will fail stageout."
-        retval = 80000
-    if os.path.exists("FrameworkJobReport.xml"):
-        print "Adding FrameworkJobReport.xml to tarball %s" % output
-        tf.add("FrameworkJobReport.xml", arcname="FrameworkJobReport-%d.xml" % id)
-    else:
-        print "== ERROR: FrameworkJobReport.xml is missing.  Will fail stageout."
-        retval = 80000
-    tf.close()
+        print "Compressing %s with gzip level %d" % (output, level)
+        pigz_proc = None
+        tf = tarfile.open(output, "w:gz", compresslevel = level)
+    try:
+        for name, arcname, is_text in [("cmsRun-stdout.log", "cmsRun-stdout-%d.log" % id, True),
+                                       ("cmsRun-stderr.log", "cmsRun-stderr-%d.log" % id, True),
+                                       ("FrameworkJobReport.xml", "FrameworkJobReport-%d.xml" % id, False)]:
+            if os.path.exists(name):
+                print "Adding %s to tarball %s" % (name, output)
+                addLogToTarball(tf, name, arcname, max_size if is_text else 0)
+            else:
+                print "== ERROR: %s is missing.  Will fail stageout." % name
+                retval = 80000
+    finally:
+        tf.close()
+        if pigz_proc:
+            pigz_proc.stdin.close()
+            if pigz_proc.wait():
+                print "== ERROR: pigz exited with status %d.  Will fail stageout." % pigz_proc.returncode
+                retval = 80000
+    print "Log tarball %s is %d bytes" % (output, os.stat(output).st_size)
     return retval
 
 
@@ -138,6 +276,36 @@ def getJobId(source):
     return orig_file_name, job_id
 
 
+def loadJR():
+    """
+    ------------------------------------------------------------------------------------------
+    Read the JR into memory. All the getters and setters below work on the in-memory copy;
+    call flushJR() to write it back to disk.
+    ------------------------------------------------------------------------------------------
+    """
+
+    global g_job_report
+    with open(g_job_report_name) as fd:
+        g_job_report = json.load(fd)
+    return g_job_report
+
+
+def flushJR():
+    """
+    ------------------------------------------------------------------------------------------
+    Write the in-memory JR back to disk. The JR is written to a temporary file which is then
+    renamed, so a reader never sees a partially written JR.
+    ------------------------------------------------------------------------------------------
+    """
+
+    if g_job_report is None:
+        return
+    tmp_name = "%s.tmp" % g_job_report_name
+    with open(tmp_name, "w") as fd:
+        json.dump(g_job_report, fd)
+    os.rename(tmp_name, g_job_report_name)
+
+
 def getFromJR(key, default = None, location = []):
     """
     ------------------------------------------------------------------------------------------
@@ -147,10 +315,7 @@ def getFromJR(key, default = None, location = []):
     ------------------------------------------------------------------------------------------
     """
 
-    with open(g_job_report_name) as fd:
-        job_report = json.load(fd)
-
-    subreport = job_report
+    subreport = g_job_report
     subreport_name = ''
 
     for loc in location:
@@ -180,8 +345,7 @@ def getOutputFileFromJR(file_name, job_report = None):
     """
 
     if job_report is None:
-        with open(g_job_report_name) as fd:
-            job_report = json.load(fd)
+        job_report = g_job_report
 
     job_report_output = job_report['steps']['cmsRun']['output']
     for output_module in job_report_output.values():
@@ -209,10 +373,7 @@ def addToJR(key_value_pairs, location = [], mode = 'new'):
     ------------------------------------------------------------------------------------------
     """
 
-    with open(g_job_report_name) as fd:
-        job_report = json.load(fd)
-
-    subreport = job_report
+    subreport = g_job_report
     subreport_name = ''
 
     for loc in location:
@@ -243,9 +404,6 @@ def addToJR(key_value_pairs, location = [], mode = 'new'):
         print "WARNING: Unknown mode '%s'." % mode
         return False
 
-    with open(g_job_report_name, "w") as fd:
-        json.dump(job_report, fd)
-
     return True
 
 
@@ -296,16 +454,13 @@ def addSEToJR(file_name, se_name, direct_stageout, is_log):
         is_ok = addToJR(pairs_to_add_to_job_report)
     else:
         orig_file_name, _ = getJobId(file_name)
-        with open(g_job_report_name) as fd:
-            job_report = json.load(fd)
-        output_file_info = getOutputFileFromJR(orig_file_name, job_report)
+        output_file_info = getOutputFileFromJR(orig_file_name)
         if not output_file_info:
             print "WARNING: Metadata for file %s not found in job report." % file_name
             is_ok = False
-        output_file_info['SEName'] = se_name
-        output_file_info['direct_stageout'] = direct_stageout
-        with open(g_job_report_name, "w") as fd:
-            json.dump(job_report, fd)
+        else:
+            output_file_info['SEName'] = se_name
+            output_file_info['direct_stageout'] = direct_stageout
 
     if not is_ok:
         print "== Failed to set SE name for file %s in job report. ==" % file_name
@@ -315,42 +470,194 @@ def addSEToJR(file_name, se_name, direct_stageout, is_log):
     return is_ok
 
 
-def performTransfer(manager, stageout_policy, source_file, dest_temp_lfn, dest_pfn, dest_se, is_log, inject = True):
-
-    result = -1
+def transferFile(manager, stageout_policy, source_file, dest_temp_lfn, dest_pfn, dest_se):
+    """
+    Stage out a single file, trying each policy in turn until one succeeds.
+    Only does the transfers: the outcome (a dictionary with the exit code,
+    where the file went and the timing of every attempt) is recorded in the
+    JR by recordTransfer(), so that this can also run in a child process.
+    """
+    signal.signal(signal.SIGALRM, alarmHandler)
+    outcome = {'result': -1, 'SEName': None, 'direct_stageout': None, 'attempts': []}
     for policy in stageout_policy:
+        start_time = time.time()
         if policy == "local":
             print "== Attempting local stageout at %s. ==" % time.ctime()
-            result = performLocalTransfer(manager, source_file, dest_temp_lfn, is_log, inject)
+            result, se_name = performLocalTransfer(manager, source_file, dest_temp_lfn)
             if result:
                 print "== ERROR: Local stageout resulted in status %d at %s. ==" % (result, time.ctime())
             else:
                 print "== Local stageout succeeded at %s. ==" % time.ctime()
-                break
+                outcome['SEName'] = se_name
+                outcome['direct_stageout'] = False
         elif policy == "remote":
             print "== Attempting remote stageout at %s. ==" % time.ctime()
-            result = performDirectTransfer(source_file, dest_pfn, dest_se, is_log)
+            result = performDirectTransfer(source_file, dest_pfn, dest_se)
             if result:
                 print "== ERROR: Remote stageout resulted in status %d at %s. ==" % (result, time.ctime())
             else:
                 print "== Remote stageout succeeded at %s. ==" % time.ctime()
-                break
+                outcome['SEName'] = dest_se
+                outcome['direct_stageout'] = True
         else:
             print "== ERROR: Skipping unknown policy named '%s'. ==" % policy
+            continue
+        outcome['result'] = result
+        outcome['attempts'].append({'policy': policy, 'result': result, \
+                                    'start_time': start_time, 'end_time': time.time()})
+        if not result:
+            break
 
-    if result == -1:
+    if outcome['result'] == -1:
         print "== FATAL ERROR: No stageout policy was attempted. =="
-        result = 80000
+        outcome['result'] = 80000
 
-    return result
+    return outcome
 
 
-def performLocalTransfer(manager, source_file, dest_temp_lfn, is_log, inject = True):
+def recordTransfer(outcome, dest_temp_lfn, dest_pfn, is_log, inject = True):
+    """
+    Record the outcome of transferFile() in the JR and, for successful local
+    stageouts, queue the file for injection into ASO.
+    """
+    if outcome['direct_stageout'] is None:
+        dest_file_name = os.path.split(dest_temp_lfn)[-1]
+    elif outcome['direct_stageout']:
+        dest_file_name = os.path.split(dest_pfn)[-1]
+        addSEToJR(dest_file_name, outcome['SEName'], direct_stageout = True, is_log = is_log)
+    else:
+        dest_file_name = os.path.split(dest_temp_lfn)[-1]
+        addSEToJR(dest_file_name, outcome['SEName'], direct_stageout = False, is_log = is_log)
+        if inject:
+            injectToASO(dest_temp_lfn, outcome['SEName'], is_log)
+
+    ## Keep the timing of every attempt, next to where the SE name is recorded.
+    if is_log:
+        addToJR([('stageout_attempts', outcome['attempts'])], mode = 'override')
+    else:
+        output_file_info = getOutputFileFromJR(getJobId(dest_file_name)[0])
+        if output_file_info:
+            output_file_info['stageout_attempts'] = outcome['attempts']
+
+    return outcome['result']
+
+
+def performTransfer(manager, stageout_policy, source_file, dest_temp_lfn, dest_pfn, dest_se, is_log, inject = True):
+
+    outcome = transferFile(manager, stageout_policy, source_file, dest_temp_lfn, dest_pfn, dest_se)
+    return recordTransfer(outcome, dest_temp_lfn, dest_pfn, is_log, inject)
+
+
+def startTransferProcess(manager, transfer, dest_se):
+    """
+    Fork a child process running transferFile() for the given transfer.
+    The child gets its own copy of the stageout manager and can use its own
+    SIGALRM timeouts. Its output goes to a temporary log file, which the
+    parent prints as one block when the child is done; the outcome is sent
+    back through a pipe. Return (pid, pipe, log file name).
+    """
+    read_fd, write_fd = os.pipe()
+    log_fd, log_name = tempfile.mkstemp(prefix = "cmscp_", suffix = ".log", dir = ".")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        os.close(write_fd)
+        os.close(log_fd)
+        return pid, read_fd, log_name
+    try:
+        try:
+            os.close(read_fd)
+            os.dup2(log_fd, 1)
+            os.dup2(log_fd, 2)
+            outcome = transferFile(manager, transfer['stageout_policy'], transfer['source_file'], \
+                                   transfer['dest_temp_lfn'], transfer['dest_pfn'], dest_se)
+            os.write(write_fd, json.dumps(outcome))
+        except:
+            print "== ERROR: Unhandled exception when performing stageout of %s." % transfer['source_file']
+            traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+def finishTransferProcess(read_fd, log_name):
+    """
+    Collect the output and the outcome of a child started by
+    startTransferProcess(); the child must have already exited.
+    """
+    with open(log_name) as fd:
+        sys.stdout.write(fd.read())
+    os.unlink(log_name)
+    with os.fdopen(read_fd) as fd:
+        data = fd.read()
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def performTransfers(manager, transfers, dest_se, max_parallel = 1):
+    """
+    Stage out all the given transfers, running up to 'max_parallel' of them
+    at once. Every transfer goes through its own stageout policy as in
+    performTransfer(). Return the list of exit codes, in the order of the
+    transfers.
+    """
+    results = [None] * len(transfers)
+    if max_parallel <= 1 or len(transfers) <= 1:
+        for i, transfer in enumerate(transfers):
+            print "==== Starting stageout of %s at %s ====" % (transfer['source_file'], time.ctime())
+            try:
+                results[i] = performTransfer(manager, transfer['stageout_policy'], transfer['source_file'], \
+                                             transfer['dest_temp_lfn'], transfer['dest_pfn'], dest_se, \
+                                             transfer['is_log'], transfer['inject'])
+            except Exception, ex:
+                print "== ERROR: Unhandled exception when performing stageout of %s." % transfer['source_file']
+                traceback.print_exc()
+                results[i] = 60318
+            print "==== Finished stageout of %s at %s (status %d) ====" % (transfer['source_file'], time.ctime(), results[i])
+        return results
+
+    print "==== Staging out %d files, up to %d at a time ====" % (len(transfers), max_parallel)
+    pending = list(enumerate(transfers))
+    running = {}
+    while pending or running:
+        while pending and len(running) < max_parallel:
+            i, transfer = pending.pop(0)
+            print "==== Starting stageout of %s at %s ====" % (transfer['source_file'], time.ctime())
+            pid, read_fd, log_name = startTransferProcess(manager, transfer, dest_se)
+            running[pid] = (i, read_fd, log_name)
+        pid, _ = os.waitpid(-1, 0)
+        if pid not in running:
+            continue
+        i, read_fd, log_name = running.pop(pid)
+        transfer = transfers[i]
+        print "==== Output of the stageout of %s follows ====" % transfer['source_file']
+        outcome = finishTransferProcess(read_fd, log_name)
+        try:
+            if outcome is None:
+                print "== ERROR: No stageout outcome received for %s." % transfer['source_file']
+                results[i] = 60318
+            else:
+                results[i] = recordTransfer(outcome, transfer['dest_temp_lfn'], transfer['dest_pfn'], \
+                                            transfer['is_log'], transfer['inject'])
+        except Exception, ex:
+            print "== ERROR: Unhandled exception when recording stageout of %s." % transfer['source_file']
+            traceback.print_exc()
+            results[i] = 60318
+        print "==== Finished stageout of %s at %s (status %d) ====" % (transfer['source_file'], time.ctime(), results[i])
+
+    return results
+
+
+def performLocalTransfer(manager, source_file, dest_temp_lfn):
 
     fileForTransfer = {'LFN': dest_temp_lfn, 'PFN': source_file}
-    signal.signal(signal.SIGALRM, alarmHandler)
     signal.alarm(waitTime)
     result = 0
+    se_name = None
 
     try:
         # Throws on any failure
@@ -373,17 +680,44 @@ def performLocalTransfer(manager, source_file, dest_temp_lfn, is_log, inject = T
         signal.alarm(0)
 
     if not result:
-        dest_temp_file_name = os.path.split(dest_temp_lfn)[-1]
         se_name = stageout_info['SEName']
-        addSEToJR(dest_temp_file_name, se_name, direct_stageout = False, is_log = is_log)
-        if inject:
-            injectToASO(dest_temp_lfn, stageout_info['SEName'], is_log)
 
-    return result
+    return result, se_name
+
+
+def getNodeName(se_name):
+    """
+    Map an SE name to its PhEDEx node name. The PhEDEx node map is only
+    retrieved once per job; the first node found for an SE wins.
+    """
+    global g_node_map
+    if g_node_map is None:
+        p = PhEDEx.PhEDEx()
+        node_map = {}
+        for node in p.getNodeMap()['phedex']['node']:
+            node_map.setdefault(str(node[u'se']), str(node[u'name']))
+        g_node_map = node_map
+    return g_node_map.get(str(se_name))
+
+
+def getCouchDatabase(ad):
+    """
+    Return the ASO database; the connection is opened once per job.
+    """
+    global g_couch_database
+    if g_couch_database is None:
+        couchServer = CMSCouch.CouchServer(dburl = ad['CRAB_ASOURL'], ckey = os.environ['X509_USER_PROXY'], cert = os.environ['X509_USER_PROXY'])
+        g_couch_database = couchServer.connectDatabase("asynctransfer", create = False)
+    return g_couch_database
 
 
 def injectToASO(source_lfn, se_name, is_log):
-    ad = parseAd()
+    """
+    Prepare the ASO document for a file that was staged out locally.
+    The document is only queued here; commitToASO() uploads all the
+    queued documents of the job at once.
+    """
+    ad = getJobAd()
     for attr in ["CRAB_ASOURL", "CRAB_AsyncDest", "CRAB_InputData", "CRAB_UserGroup", "CRAB_UserRole", "CRAB_DBSURL",\
                  "CRAB_PublishDBSURL", "CRAB_ReqName", "CRAB_UserHN", "CRAB_Publish"]:
         if attr not in ad:
@@ -417,13 +751,7 @@ def injectToASO(source_lfn, se_name, is_log):
             size = 0
             isEDM = False
 
-    p = PhEDEx.PhEDEx()
-    nodes = p.getNodeMap()['phedex']['node']
-    node_name = None
-    for node in nodes:
-        if str(node[u'se']) == str(se_name):
-            node_name = str(node[u'name'])
-            break
+    node_name = getNodeName(se_name)
     if not node_name:
         print "==== ERROR: Unable to determine local node name. Cannot inject to ASO. ===="
         return False
@@ -467,20 +795,10 @@ def injectToASO(source_lfn, se_name, is_log):
             "failure_reason": [],
             "job_retry_count": ad.get("CRAB_Retry", -1)
            }
-    print "ASO info so far:"
-    print info
-
-    couchServer = CMSCouch.CouchServer(dburl = ad['CRAB_ASOURL'], ckey = os.environ['X509_USER_PROXY'], cert = os.environ['X509_USER_PROXY'])
-    couchDatabase = couchServer.connectDatabase("asynctransfer", create = False)
     print "Stageout job description: %s" % pprint.pformat(info)
 
-    try:
-        doc = couchDatabase.document(doc_id)
-        doc.update(info)
-        print ("Will retry LFN %s (id %s)" % (source_lfn, doc_id))
-    except CMSCouch.CouchNotFoundError:
-        print "LFN %s (id %s) is not yet known to ASO; uploading new stageout job." % (source_lfn, doc_id)
-        doc = {"_id": doc_id,
+    ## Used only if ASO doesn't know about this LFN yet.
+    new_doc = {"_id": doc_id,
                "inputdataset": ad["CRAB_InputData"],
                "group": group,
                "lfn": source_lfn,
@@ -496,28 +814,75 @@ def injectToASO(source_lfn, se_name, is_log):
                "type": file_type,
                "publish": publish,
               }
-        doc.update(info)
+    g_aso_queue.append((doc_id, source_lfn, info, new_doc))
+    print "Queued LFN %s (id %s) for injection into ASO." % (source_lfn, doc_id)
+
+    return True
+
+
+def commitToASO():
+    """
+    Upload all the documents queued by injectToASO() with a single bulk
+    lookup of the existing documents and a single bulk commit.
+    """
+    if not g_aso_queue:
+        return True
+    ad = getJobAd()
+    doc_ids = [doc_id for doc_id, _, _, _ in g_aso_queue]
+    try:
+        couchDatabase = getCouchDatabase(ad)
+        rows = couchDatabase.allDocs(options = {'include_docs': True}, keys = doc_ids).get('rows', [])
     except Exception, ex:
-        msg = "Error loading document from couch. Transfer submission failed."
+        msg = "Error loading documents from couch. Transfer submission failed."
         msg += str(ex)
         msg += str(traceback.format_exc())
         print (msg)
         return False
-    commit_result = couchDatabase.commitOne(doc)[0]
-    if 'error' in commit_result:
-        print("Couldn't add to ASO database; error follows")
-        print(commit_result)
+
+    existing_docs = {}
+    for row in rows:
+        ## Unknown ids come back with an 'error' and deleted ones with a null 'doc'.
+        if row.get('doc'):
+            existing_docs[row['key']] = row['doc']
+    for doc_id, source_lfn, info, new_doc in g_aso_queue:
+        if doc_id in existing_docs:
+            doc = existing_docs[doc_id]
+            print ("Will retry LFN %s (id %s)" % (source_lfn, doc_id))
+        else:
+            doc = new_doc
+            print "LFN %s (id %s) is not yet known to ASO; uploading new stageout job." % (source_lfn, doc_id)
+        doc.update(info)
+        couchDatabase.queue(doc)
+        print "Final stageout job description: %s" % pprint.pformat(doc)
+
+    try:
+        commit_results = couchDatabase.commit()
+    except Exception, ex:
+        msg = "Error committing documents to couch. Transfer submission failed."
+        msg += str(ex)
+        msg += str(traceback.format_exc())
+        print (msg)
         return False
-    print "Final stageout job description: %s" % pprint.pformat(doc)
+    is_ok = True
+    num_committed = 0
+    for commit_result in commit_results:
+        if 'error' in commit_result:
+            print("Couldn't add to ASO database; error follows")
+            print(commit_result)
+            is_ok = False
+        else:
+            num_committed += 1
+    del g_aso_queue[:]
 
-    addToJR([('aso_start_time', g_now), ('aso_start_timestamp', g_now_epoch)], location = [], mode = 'override')
+    if num_committed:
+        addToJR([('aso_start_time', g_now), ('aso_start_timestamp', g_now_epoch)], location = [], mode = 'override')
 
-    return True
+    return is_ok
 
 
-def performDirectTransfer(source_file, dest_pfn, dest_se, is_log):
+def performDirectTransfer(source_file, dest_pfn, dest_se):
     try:
-        return performDirectTransferImpl(source_file, dest_pfn, dest_se, is_log)
+        return performDirectTransferImpl(source_file, dest_pfn, dest_se)
     except WMException.WMException, ex:
         print "="*79
         print "==== START DUMP OF TRANSFER ERROR INFO ===="
@@ -529,7 +894,7 @@ def performDirectTransfer(source_file, dest_pfn, dest_se, is_log):
         return ex.data.get("ErrorCode", 60307)
 
 
-def performDirectTransferImpl(source_file, dest_pfn, dest_se, is_log):
+def performDirectTransferImpl(source_file, dest_pfn, dest_se):
     command = "srmv2-lcg"
     protocol = "srmv2"
     
@@ -561,10 +926,6 @@ def performDirectTransferImpl(source_file, dest_pfn, dest_se, is_log):
     finally:
         signal.alarm(0)
 
-    if not result:
-        dest_file_name = os.path.split(dest_pfn)[-1]
-        addSEToJR(dest_file_name, dest_se, direct_stageout = True, is_log = is_log)
-
     return result
 
 
@@ -578,6 +939,7 @@ def main():
     stageout_policy = None
     transfer_logs = None
     transfer_outputs = None
+    max_parallel = maxParallelStageouts
     if '_CONDOR_JOB_AD' not in os.environ:
         print "== ERROR: _CONDOR_JOB_AD not in environment =="
         print "No stageout will be performed."
@@ -613,6 +975,8 @@ def main():
                     transfer_logs = int(val)
                 elif name == "CRAB_TransferOutputs":
                     transfer_outputs = int(val)
+                elif name == "CRAB_StageoutParallel":
+                    max_parallel = getStageoutParallel(val)
         if g_job_id == None:
             print "== ERROR: Unable to determine CRAB Job ID."
             print "No stageout will be performed."
@@ -654,8 +1018,7 @@ def main():
 
     ## Retrive the JR.
     try:
-        with open(g_job_report_name) as fd:
-            job_report = json.load(fd)
+        job_report = loadJR()
     except Exception, ex:
         print "== ERROR: Unable to retrieve %s." % g_job_report_name
         traceback.print_exc()
@@ -699,32 +1062,35 @@ def main():
     if g_job_exit_code:
         dest_temp_dir = os.path.join(dest_temp_dir, "failed")
 
-    ## Transfer of log tarball.
+    ## Transfers to perform; the log tarball (if any) goes first.
+    transfers = []
+
+    ## Log tarball.
     logfile_name = 'cmsRun_%d.log.tar.gz' % g_job_id
     dest_temp_lfn = os.path.join(dest_temp_dir, "log", logfile_name)
+    ## The first remote destination is always the one of the log tarball.
+    dest_pfn = dest_files.pop(0)
+    std_retval = 0
     try:
         print "==== Starting compression of user logs at %s ====" % time.ctime()
         std_retval = compress(g_job_id)
         print "==== Finished compression of user logs at %s (status %d) ====" % (time.ctime(), std_retval)
-        if not std_retval:
-            print "==== Starting stageout of user logs at %s ====" % time.ctime()
-            if not transfer_logs:
-                print "Performing only local stageout of user logs since the user did not specify General.saveLogs = True"
-            dest_pfn = dest_files.pop(0)
-            std_retval = performTransfer(manager, stageout_policy if transfer_logs else ["local"], \
-                                         logfile_name, dest_temp_lfn, dest_pfn, dest_se, is_log = True, inject = transfer_logs)
     except Exception, ex:
-        print "== ERROR: Unhandled exception when performing stageout of user logs."
+        print "== ERROR: Unhandled exception when compressing user logs."
         traceback.print_exc()
-        if not std_retval:
-            std_retval = 60318
-    finally:
-        print "==== Finished stageout of user logs at %s (status %d) ====" % (time.ctime(), std_retval)
-    if not transfer_logs and std_retval:
-        print "Ignoring stageout failure of user logs, because the user did not request the logs to be staged out."
-        std_retval = 0
-
-    ## Transfer of output files.
+        std_retval = 60318
+    if not std_retval:
+        if not transfer_logs:
+            print "Performing only local stageout of user logs since the user did not specify General.saveLogs = True"
+        transfers.append({'source_file': logfile_name,
+                          'stageout_policy': stageout_policy if transfer_logs else ["local"],
+                          'dest_temp_lfn': dest_temp_lfn,
+                          'dest_pfn': dest_pfn,
+                          'is_log': True,
+                          'inject': transfer_logs,
+                         })
+
+    ## Output files.
     out_retval = 0
     for outfile_name_info, dest_pfn in zip(output_files, dest_files):
         if len(outfile_name_info.split("=")) != 2:
@@ -740,22 +1106,32 @@ def main():
         is_file_in_job_report = bool(getOutputFileFromJR(outfile_name))
         if not is_file_in_job_report:
             addOutputFileToJR(outfile_name)
-        ## Try to do the transfer.
-        dest_temp_lfn = os.path.join(dest_temp_dir, dest_outfile_name)
-        try:
-            print "==== Starting stageout of %s at %s ====" % (outfile_name, time.ctime())
-            if not transfer_outputs:
-                print "Performing only local stageout of output files since the user specified General.transferOutput = False"
-            cur_out_retval = performTransfer(manager, stageout_policy if transfer_outputs else ["local"], \
-                                             outfile_name, dest_temp_lfn, dest_pfn, dest_se, is_log = False, inject = transfer_outputs)
-        except Exception, ex:
-            print "== ERROR: Unhandled exception when performing stageout of user outputs."
-            traceback.print_exc()
-            cur_out_retval = 60318
-        finally:
-            print "==== Finished stageout of %s at %s (status %d) ====" % (outfile_name, time.ctime(), out_retval)
-        if cur_out_retval and not out_retval:
-            out_retval = cur_out_retval
+        if not transfer_outputs:
+            print "Performing only local stageout of output file %s since the user specified General.transferOutput = False" % outfile_name
+        transfers.append({'source_file': outfile_name,
+                          'stageout_policy': stageout_policy if transfer_outputs else ["local"],
+                          'dest_temp_lfn': os.path.join(dest_temp_dir, dest_outfile_name),
+                          'dest_pfn': dest_pfn,
+                          'is_log': False,
+                          'inject': transfer_outputs,
+                         })
+
+    ## Do the transfers.
+    results = performTransfers(manager, transfers, dest_se, max_parallel)
+    for transfer, cur_retval in zip(transfers, results):
+        if transfer['is_log']:
+            std_retval = cur_retval
+        elif cur_retval and not out_retval:
+            out_retval = cur_retval
+    if not transfer_logs and std_retval:
+        print "Ignoring stageout failure of user logs, because the user did not request the logs to be staged out."
+        std_retval = 0
+
+    ## Inject all the locally staged out files into ASO at once.
+    if g_aso_queue:
+        print "==== Starting injection of %d file(s) into ASO at %s ====" % (len(g_aso_queue), time.ctime())
+        is_ok = commitToASO()
+        print "==== Finished injection into ASO at %s (%s) ====" % (time.ctime(), "success" if is_ok else "failure")
 
     if std_retval:
         return std_retval
@@ -771,6 +1147,11 @@ if __name__ == '__main__':
         print "==== ERROR: Unhandled exception."
         traceback.print_exc()
         retval = 60307
+    try:
+        flushJR()
+    except:
+        print "==== ERROR: Unable to write job report %s. ====" % g_job_report_name
+        traceback.print_exc()
     if g_job_exit_code:
         retval = g_job_exit_code
     if retval:
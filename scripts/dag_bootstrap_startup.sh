@@ -133,6 +133,9 @@ elif [ ! -r $X509_USER_PROXY ]; then
     echo "The proxy is unreadable for some reason"
     EXIT_STATUS=6
 else
+    # Keep status_summary.json up to date while DAGMan runs; once exec'd, DAGMan
+    # has the PID of this shell and the updater exits with it.
+    ./dag_bootstrap.sh SUMMARY $$ > task_summary.txt 2>&1 &
     # Re-nice the process so, even when we churn through lots of processes, we never starve the schedd or shadows for cycles.
     exec nice -n 19 condor_dagman -f -l . -Lockfile $PWD/$1.lock -AutoRescue 1 -DoRescueFrom 0 -MaxPre 20 -MaxIdle 200 -MaxPost $MAX_POST -Dag $PWD/$1 -Dagman `which condor_dagman` -CsdVersion "$CONDOR_VERSION" -debug 4 -verbose
     EXIT_STATUS=$?
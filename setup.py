@@ -20,7 +20,7 @@ systems = \
   },
   'CRABInterface':
   {
-    'py_modules' : ['PandaServerInterface','CRABQuality', 'HTCondorUtils', 'HTCondorLocator'],
+    'py_modules' : ['PandaServerInterface','CRABQuality', 'HTCondorUtils', 'HTCondorLocator', 'HTCondorTaskStatus'],
     'python': ['CRABInterface','CRABInterface/Pages',
                'Databases',
                  'Databases/FileMetaDataDB', 'Databases/FileMetaDataDB/Oracle',
@@ -32,7 +32,7 @@ systems = \
   {
     'py_modules' : ['PandaServerInterface', 'RESTInteractions', 'ApmonIf',
                     'apmon', 'DashboardAPI', 'Logger', 'ProcInfo',
-                    'CRABQuality', 'HTCondorUtils', 'HTCondorLocator'],
+                    'CRABQuality', 'HTCondorUtils', 'HTCondorLocator', 'HTCondorTaskStatus'],
     'python': ['TaskWorker', 'TaskWorker/Actions', 'TaskWorker/DataObjects',
                 'TaskWorker/Actions/Recurring', 'taskbuffer']
   },
@@ -8,6 +8,7 @@ from ast import literal_eval
 from WMCore.REST.Error import InvalidParameter, ExecutionError, MissingObject
 
 from CRABInterface.Utils import getDBinstance
+from CRABInterface.LumiRanges import compactLumis, encodeLumis, decodeLumis, expandLumis, formatLumis, readParents
 
 class DataFileMetadata(object):
     @staticmethod
@@ -24,6 +25,10 @@ class DataFileMetadata(object):
         binds = {'taskname': taskname, 'filetype': filetype}
         rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndType_sql, **binds)
         for row in rows:
+            if row[18] is not None:
+                runlumi = expandLumis(decodeLumis(row[18].read()))
+            else:
+                runlumi = literal_eval(row[9].read())
             yield {'taskname': taskname,
                    'filetype': filetype,
                    'pandajobid': row[0],
@@ -35,24 +40,29 @@ class DataFileMetadata(object):
                    'publishname': row[6],
                    'location': row[7],
                    'tmplocation': row[8],
-                   'runlumi': literal_eval(row[9].read()),
+                   'runlumi': runlumi,
                    'adler32': row[10],
                    'cksum': row[11],
                    'md5': row[12],
                    'lfn': row[13],
                    'filesize': row[14],
-                   'parents': literal_eval(row[15].read()),
+                   'parents': readParents(row[15]),
                    'state': row[16],
                    'created': str(row[17]),}
 
     def inject(self, *args, **kwargs):
         self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
 
-        bindnames = set(kwargs.keys()) - set(['outfileruns', 'outfilelumis'])
+        bindnames = set(kwargs.keys()) - set(['outfileruns', 'outfilelumis', 'inparentlfns'])
         binds = {}
         for name in bindnames:
             binds[name] = [str(kwargs[name])]
-        binds['runlumi'] = [str(dict(zip(map(str, kwargs['outfileruns']), [map(str, lumilist.split(',')) for lumilist in kwargs['outfilelumis']])))]
+        # The lumis are stored as ranges in fmd_lumis; see CRABInterface.LumiRanges.
+        # fmd_runlumi is still written for the frontends which only read it.
+        compact = compactLumis(kwargs['outfileruns'], kwargs['outfilelumis'])
+        binds['runlumi'] = [formatLumis(compact)]
+        binds['lumis'] = [encodeLumis(compact)]
+        binds['inparentlfns'] = [json.dumps(kwargs['inparentlfns'])]
 
         self.api.modify(self.FileMetaData.New_sql, **binds)
         return []
@@ -126,15 +126,16 @@ class DataUserWorkflow(object):
            :arg int force: force to delete the workflows in any case; 0 no, everything else yes"""
         return self.workflow.resubmit(workflow, siteblacklist, sitewhitelist, jobids, maxjobruntime, numcores, maxmemory, priority, userdn, userproxy)
 
-    def status(self, workflow, userdn, userproxy=None, verbose=False):
+    def status(self, workflow, userdn, userproxy=None, verbose=False, jobsformat=None):
         """Retrieve the status of the workflow
 
            :arg str workflow: a valid workflow name
            :arg str userdn: the user dn makind the request
            :arg str userproxy: the user proxy retrieved by `retrieveUserCert`
+           :arg str jobsformat: 'columnar' for a columnar representation of the jobs
            :return: a generator of workflow states
         """
-        return self.workflow.status(workflow, userdn, userproxy, verbose=verbose)
+        return self.workflow.status(workflow, userdn, userproxy, verbose=verbose, jobsformat=jobsformat)
 
     def kill(self, workflow, force, jobids, userdn, userproxy=None):
         """Request to Abort a workflow.
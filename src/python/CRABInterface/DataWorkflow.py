@@ -1,6 +1,7 @@
 import time
 import logging
 import cherrypy
+import threading
 from datetime import datetime
 
 from CRABInterface.Utils import getDBinstance
@@ -8,8 +9,16 @@ from CRABInterface.Utils import getDBinstance
 from WMCore.REST.Error import ExecutionError
 
 #CRAB dependencies
-from CRABInterface.Utils import CMSSitesCache, conn_handler
-
+from CRABInterface.Utils import CMSSitesCache, SiteIndex, conn_handler
+from Databases.FileMetaDataDB.Oracle.FileMetaData.FileMetaData import GetFromTaskAndType
+
+# PFN of the directories of the output files, by (site, directory LFN), with
+# the time they expire (see DataWorkflow.getPFNs). None if the PFNs of the
+# files cannot be derived from the PFN of their directory.
+PFN_DIR_CACHE_TIME = 3600
+PFN_DIR_CACHE_MAX = 10000
+pfn_dir_cache = {}
+pfn_dir_lock = threading.Lock()
 class DataWorkflow(object):
     """Entity that allows to operate on workflow resources.
        No aggregation of workflows provided here."""
@@ -26,7 +35,7 @@ class DataWorkflow(object):
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger("CRABLogger.DataWorkflow")
-        self.allCMSNames = CMSSitesCache(cachetime=0, sites={})
+        self.allCMSNames = CMSSitesCache(cachetime=0, sites={}, index=SiteIndex([]))
 
         self.splitArgMap = { "LumiBased" : "lumis_per_job",
                         "FileBased" : "files_per_job",
@@ -101,6 +110,116 @@ class DataWorkflow(object):
            :return: a generator of list of outputs"""
         raise NotImplementedError
 
+    # Most job ids bound in GetFromTaskAndTypeJobs_sql: the comma separated list
+    # must fit a VARCHAR2 bind (4000 characters).
+    JOBIDS_PER_QUERY = 500
+    # Minimum number of rows read per GetFromTaskAndTypePage_sql query.
+    FILES_PER_PAGE = 100
+    # Sorts before the creation time of any file; starts the first page.
+    FIRST_PAGE_TIME = '9999-12-31 23:59:59.999999'
+
+    def getFileRows(self, workflow, filetype, jobids, howmany):
+        """
+        Retrieves the metadata of the files of type 'filetype' produced by the
+        jobs 'jobids', the most recent first; at most 'howmany' files unless it is -1.
+        The job ids and the limit are applied by the database, which reads only
+        the requested files through the (taskname, job id) and (taskname,
+        creation time) indexes.
+
+        :arg str workflow: the unique workflow name
+        :arg list filetype: the file types, e.g. ['EDM', 'TFILE']
+        :arg list jobids: the job ids
+        :arg int howmany: the limit on the number of files to return
+        :return: a list of rows indexed by GetFromTaskAndType"""
+        filetype = ','.join(filetype)
+        wanted = set(jobids)
+        if howmany == -1:
+            jobids = sorted(wanted)
+            if len(jobids) > self.JOBIDS_PER_QUERY:
+                # Most likely all the jobs of the task: a single query is cheaper.
+                rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndType_sql, filetype=filetype, taskname=workflow)
+                return [row for row in rows if row[GetFromTaskAndType.PANDAID] in wanted]
+            return list(self.api.query(None, None, self.FileMetaData.GetFromTaskAndTypeJobs_sql, filetype=filetype, taskname=workflow,
+                                       jobids=','.join([str(jobid) for jobid in jobids])))
+
+        # Keyset pagination on (creation time descending, LFN): each page
+        # starts after the last file of the previous one.
+        rows = []
+        lasttime, lastlfn = self.FIRST_PAGE_TIME, ''
+        while len(rows) < howmany:
+            limit = max(howmany - len(rows), self.FILES_PER_PAGE)
+            page = list(self.api.query(None, None, self.FileMetaData.GetFromTaskAndTypePage_sql, filetype=filetype, taskname=workflow,
+                                       lasttime=lasttime, lastlfn=lastlfn, limit=limit))
+            for row in page:
+                if row[GetFromTaskAndType.PANDAID] in wanted:
+                    rows.append(row)
+            if len(page) < limit:
+                break
+            lasttime = page[-1][GetFromTaskAndType.CREATED].strftime('%Y-%m-%d %H:%M:%S.%f')
+            lastlfn = page[-1][GetFromTaskAndType.LFN]
+        return rows[:howmany]
+
+    def getPFNs(self, files):
+        """
+        Resolves the PFN of many files at once.
+
+        The trivial file catalogues of the sites map the directories and keep
+        the file names, so the PFN of a file is the PFN of its directory
+        followed by its name. One file per (site, directory) is resolved,
+        with one PhEDEx call per site, and the PFN of the directory is kept
+        for PFN_DIR_CACHE_TIME seconds for the following requests. The files
+        of a directory whose PFN does not end with the file name are resolved
+        one by one (still one PhEDEx call per site).
+
+        :arg list files: (site, lfn) tuples
+        :return: a dictionary of the PFNs by (site, lfn)"""
+        pfns = {}
+        now = time.time()
+        probes = {}
+        unmapped = {}
+        with pfn_dir_lock:
+            for site, lfn in files:
+                dirname, filename = lfn.rsplit('/', 1)
+                entry = pfn_dir_cache.get((site, dirname))
+                if entry is None or entry[0] <= now:
+                    probes.setdefault(site, {}).setdefault(dirname, lfn)
+                    unmapped.setdefault((site, dirname), []).append(lfn)
+                elif entry[1] is None:
+                    unmapped.setdefault((site, dirname), []).append(lfn)
+                else:
+                    pfns[(site, lfn)] = entry[1] + filename
+
+        resolved = {}
+        for site, dirs in probes.items():
+            resolved.update(self.phedex.getPFN(nodes=[site], lfns=dirs.values()))
+        dirpfns = {}
+        for site, dirs in probes.items():
+            for dirname, lfn in dirs.items():
+                pfn = resolved.get((site, lfn))
+                filename = lfn.rsplit('/', 1)[1]
+                dirpfns[(site, dirname)] = None
+                if pfn and pfn.endswith('/' + filename):
+                    dirpfns[(site, dirname)] = pfn[:-len(filename)]
+        with pfn_dir_lock:
+            if len(pfn_dir_cache) + len(dirpfns) > PFN_DIR_CACHE_MAX:
+                pfn_dir_cache.clear()
+            for key, dirpfn in dirpfns.items():
+                pfn_dir_cache[key] = (now + PFN_DIR_CACHE_TIME, dirpfn)
+
+        direct = {}
+        for (site, dirname), lfns in unmapped.items():
+            dirpfn = dirpfns.get((site, dirname))
+            for lfn in lfns:
+                if dirpfn is not None:
+                    pfns[(site, lfn)] = dirpfn + lfn.rsplit('/', 1)[1]
+                elif (site, lfn) in resolved:
+                    pfns[(site, lfn)] = resolved[(site, lfn)]
+                else:
+                    direct.setdefault(site, []).append(lfn)
+        for site, lfns in direct.items():
+            pfns.update(self.phedex.getPFN(nodes=[site], lfns=lfns))
+        return pfns
+
     def schema(self, workflow):
         """Returns the workflow schema parameters.
 
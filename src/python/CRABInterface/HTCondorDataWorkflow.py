@@ -1,9 +1,9 @@
-import re
 import json
 import time
 import hashlib
 import StringIO
 import tempfile
+import threading
 import traceback
 from ast import literal_eval
 
@@ -15,17 +15,49 @@ from WMCore.REST.Error import ExecutionError, InvalidParameter
 from WMCore.WMSpec.WMTask import buildLumiMask
 from WMCore.Services.DBS.DBSReader import DBSReader
 from CRABInterface.DataWorkflow import DataWorkflow
-from CRABInterface.Utils import conn_handler, global_user_throttle
+from CRABInterface.Utils import conn_handler, global_user_throttle, SingleFlightCache, monitored
+from CRABInterface.LumiRanges import readRunLumi, toRanges, listLumis, unionLumis
 from Databases.FileMetaDataDB.Oracle.FileMetaData.FileMetaData import GetFromTaskAndType
 from WMCore.Services.pycurl_manager import ResponseHeader
-from WMCore.DataStructs.LumiList import LumiList
 import WMCore.Database.CMSCouch as CMSCouch
 
 import HTCondorUtils
 import HTCondorLocator
+from HTCondorTaskStatus import TaskStatusParser, copyNodeInfo, jobsToColumns, runsToStates
 
 JOB_KILLED_HOLD_REASON = "Python-initiated action."
 
+# Status results are shared by all the requests served by this process for
+# (by default) STATUS_CACHE_TIME seconds; see HTCondorDataWorkflow.status.
+STATUS_CACHE_TIME = 30
+status_cache = monitored("task status", SingleFlightCache())
+
+# Parse state of the jobs_log.txt of the tasks recently asked for in verbose
+# mode, by URL: how many bytes were already parsed and the resulting per-node
+# information (see HTCondorDataWorkflow.updateJobLog).
+JOB_LOG_STATES_MAX = 200
+job_log_states = {}
+job_log_lock = threading.Lock()
+
+# Parsed content of the other task web files (and the pool info), by URL,
+# with the HTTP validators it was received with (see fetchWebFile).
+WEB_FILE_CACHE_MAX = 1000
+web_file_cache = {}
+web_file_lock = threading.Lock()
+
+# One curl handle per server thread (see prepareCurl).
+curl_handles = threading.local()
+
+# Job states not rewritten by the schedd for this long while the DAG runs are
+# not used (see getTaskStates and TaskWorker.Actions.TaskSummary).
+SUMMARY_MAX_AGE = 900
+
+# Lumis, events and parent files of the DBS datasets in the recent reports, by
+# (DBS URL, dataset), for (by default) DBS_LUMIS_CACHE_TIME seconds; see
+# HTCondorDataWorkflow.datasetLumis.
+DBS_LUMIS_CACHE_TIME = 300
+dbs_lumis_cache = monitored("DBS lumis", SingleFlightCache(maxsize=200))
+
 def lfn_to_temp(lfn, userdn, username, role, group):
     lfn_parts = lfn[1:].split("/")
     if lfn_parts[1] == "temp":
@@ -52,11 +84,20 @@ def temp_to_lfn(lfn, username):
     return "/" + "/".join(lfn_parts)
 
 
+def getResponseHeader(header, name):
+    """Value of the HTTP response header 'name' (case insensitive), or None."""
+    name = name.lower()
+    for key, value in header.header.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
 class MissingNodeStatus(ExecutionError):
     pass
 
 
-class HTCondorDataWorkflow(DataWorkflow):
+class HTCondorDataWorkflow(DataWorkflow, TaskStatusParser):
     """ HTCondor implementation of the status command.
     """
 
@@ -90,35 +131,37 @@ class HTCondorDataWorkflow(DataWorkflow):
         return results
 
 
+    @global_user_throttle.make_throttled(weight=2)
     def logs(self, workflow, howmany, exitcode, jobids, userdn, userproxy=None):
-        self.logger.info("About to get log of workflow: %s. Getting status first." % workflow)
+        self.logger.info("About to get log of workflow: %s. Getting job states first." % workflow)
 
         row = self.api.query(None, None, self.Task.ID_sql, taskname = workflow)
-        _, _, _, tm_user_role, tm_user_group, _, _, _, tm_save_logs, tm_username, tm_user_dn, _, _, _ = row.next()
+        _, _, tm_task_status, tm_user_role, tm_user_group, _, _, _, tm_save_logs, tm_username, tm_user_dn, _, _, _ = row.next()
 
-        statusRes = self.status(workflow, userdn, userproxy)[0]
+        jobStates = self.jobStates(workflow, tm_task_status).items()
 
-        transferingIds = [x[1] for x in statusRes['jobList'] if x[0] in ['transferring', 'cooloff', 'held']]
-        finishedIds = [x[1] for x in statusRes['jobList'] if x[0] in ['finished', 'failed']]
+        transferingIds = [job for job, state in jobStates if state in ['transferring', 'cooloff', 'held']]
+        finishedIds = [job for job, state in jobStates if state in ['finished', 'failed']]
         return self.getFiles(workflow, howmany, jobids, ['LOG'], transferingIds, finishedIds, tm_user_dn, tm_username, tm_user_role, tm_user_group, saveLogs=tm_save_logs, userproxy=userproxy)
 
 
+    @global_user_throttle.make_throttled(weight=2)
     def output(self, workflow, howmany, jobids, userdn, userproxy=None):
-        self.logger.info("About to get output of workflow: %s. Getting status first." % workflow)
+        self.logger.info("About to get output of workflow: %s. Getting job states first." % workflow)
 
         row = self.api.query(None, None, self.Task.ID_sql, taskname = workflow)
-        _, _, _, tm_user_role, tm_user_group, _, _, _, tm_save_logs, tm_username, tm_user_dn, tm_arguments, _, _ = row.next()
+        _, _, tm_task_status, tm_user_role, tm_user_group, _, _, _, tm_save_logs, tm_username, tm_user_dn, tm_arguments, _, _ = row.next()
         arguments = literal_eval(tm_arguments.read())
         saveoutput = True if arguments.get("saveoutput", "T") == 'T' else False
 
-        statusRes = self.status(workflow, userdn, userproxy)[0]
+        jobStates = self.jobStates(workflow, tm_task_status).items()
 
         if saveoutput:
-            transferingIds = [x[1] for x in statusRes['jobList'] if x[0] in ['transferring', 'cooloff', 'held']]
-            finishedIds = [x[1] for x in statusRes['jobList'] if x[0] in ['finished', 'failed']]
+            transferingIds = [job for job, state in jobStates if state in ['transferring', 'cooloff', 'held']]
+            finishedIds = [job for job, state in jobStates if state in ['finished', 'failed']]
         else:
             transferingIds = []
-            finishedIds = [x[1] for x in statusRes['jobList'] if x[0] in ['finished', 'failed', 'transferring', 'cooloff', 'held']]
+            finishedIds = [job for job, state in jobStates if state in ['finished', 'failed', 'transferring', 'cooloff', 'held']]
         return self.getFiles(workflow, howmany, jobids, ['EDM', 'TFILE'], transferingIds, finishedIds, tm_user_dn, tm_username, tm_user_role, tm_user_group, userproxy=userproxy)
 
 
@@ -132,8 +175,9 @@ class HTCondorDataWorkflow(DataWorkflow):
         :return: a generator of list of outputs"""
 
         #check that the jobids passed by the user are finished
+        doneIds = set(transferingIds + finishedIds)
         for jobid in jobids:
-            if not jobid in transferingIds + finishedIds:
+            if not jobid in doneIds:
                 raise InvalidParameter("The job with id %s is not finished" % jobid)
 
         #If the user do not give us jobids set them to all possible ids
@@ -148,30 +192,33 @@ class HTCondorDataWorkflow(DataWorkflow):
             return
 
         self.logger.debug("Retrieving %s output of jobs: %s" % (','.join(filetype), jobids))
-        rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndType_sql, filetype=','.join(filetype), taskname=workflow)
-        rows = filter(lambda row: row[GetFromTaskAndType.PANDAID] in jobids, rows)
-        if howmany!=-1:
-            rows=rows[:howmany]
-        #jobids=','.join(map(str,jobids)), limit=str(howmany) if howmany!=-1 else str(len(jobids)*100))
+        rows = self.getFileRows(workflow, filetype, jobids, howmany)
+        finishedIds = set(finishedIds)
+        transferingIds = set(transferingIds)
 
+        files = []
         for row in rows:
-            try:
-                if filetype == ['LOG'] and saveLogs == 'F':
-                    lfn = lfn_to_temp(row[GetFromTaskAndType.LFN], userdn, username, role, group)
-                    pfn = self.phedex.getPFN(row[GetFromTaskAndType.TMPLOCATION], lfn)[(row[GetFromTaskAndType.TMPLOCATION], lfn)]
-                else:
-                    if row[GetFromTaskAndType.PANDAID] in finishedIds:
-                        lfn = temp_to_lfn(row[GetFromTaskAndType.LFN], username)
-                        pfn = self.phedex.getPFN(row[GetFromTaskAndType.LOCATION], lfn)[(row[GetFromTaskAndType.LOCATION], lfn)]
-                    elif row[GetFromTaskAndType.PANDAID] in transferingIds:
-                        lfn = lfn_to_temp(row[GetFromTaskAndType.LFN], userdn, username, role, group)
-                        pfn = self.phedex.getPFN(row[GetFromTaskAndType.TMPLOCATION], lfn)[(row[GetFromTaskAndType.TMPLOCATION], lfn)]
-                    else:
-                        continue
-            except Exception, err:
-                    self.logger.exception(err)
-                    raise ExecutionError("Exception while contacting DBS. Cannot get the input/output lumi lists. You can try to execute 'crab report' with --dbs=no")
+            if filetype == ['LOG'] and saveLogs == 'F':
+                lfn = lfn_to_temp(row[GetFromTaskAndType.LFN], userdn, username, role, group)
+                site = row[GetFromTaskAndType.TMPLOCATION]
+            elif row[GetFromTaskAndType.PANDAID] in finishedIds:
+                lfn = temp_to_lfn(row[GetFromTaskAndType.LFN], username)
+                site = row[GetFromTaskAndType.LOCATION]
+            elif row[GetFromTaskAndType.PANDAID] in transferingIds:
+                lfn = lfn_to_temp(row[GetFromTaskAndType.LFN], userdn, username, role, group)
+                site = row[GetFromTaskAndType.TMPLOCATION]
+            else:
+                continue
+            files.append((row, site, lfn))
 
+        try:
+            pfns = self.getPFNs([(site, lfn) for _, site, lfn in files])
+            pfns = [pfns[(site, lfn)] for _, site, lfn in files]
+        except Exception, err:
+            self.logger.exception(err)
+            raise ExecutionError("Exception while contacting PhEDEx. Cannot get the PFN of the files.")
+
+        for (row, _, lfn), pfn in zip(files, pfns):
             yield { 'pfn' : pfn,
         		    'lfn' : lfn,
                     'size' : row[GetFromTaskAndType.SIZE],
@@ -179,20 +226,11 @@ class HTCondorDataWorkflow(DataWorkflow):
             }
 
 
+    @global_user_throttle.make_throttled(weight=2)
     def report(self, workflow, userdn, usedbs):
         """ Computes the report for workflow. If usedbs is used also query DBS and return information about the input and output datasets
         """
 
-        def _compactLumis(datasetInfo):
-            """ Help function that allow to convert from runLumis divided per file (result of listDatasetFileDetails)
-                to an aggregated result.
-            """
-            lumilist = {}
-            for file, info in datasetInfo.iteritems():
-                for run,lumis in info['Lumis'].iteritems():
-                    lumilist.setdefault(str(run), []).extend(lumis)
-            return lumilist
-
         res = {}
         self.logger.info("About to compute report of workflow: %s with usedbs=%s. Getting status first." % (workflow,usedbs))
         statusRes = self.status(workflow, userdn)[0]
@@ -209,7 +247,7 @@ class HTCondorDataWorkflow(DataWorkflow):
         self.logger.info("Lumi mask was: %s" % res['lumiMask'])
 
         #extract the finished jobs from filemetadata
-        jobids = [x[1] for x in statusRes['jobList'] if x[0] in ['finished']]
+        jobids = set([x[1] for x in statusRes['jobList'] if x[0] in ['finished']])
         rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndType_sql, filetype='EDM', taskname=workflow)
 
         res['runsAndLumis'] = {}
@@ -217,7 +255,7 @@ class HTCondorDataWorkflow(DataWorkflow):
             self.logger.debug("Got lumi info for job %d." % row[GetFromTaskAndType.PANDAID])
             if row[GetFromTaskAndType.PANDAID] in jobids:
                 res['runsAndLumis'][str(row[GetFromTaskAndType.PANDAID])] = { 'parents' : row[GetFromTaskAndType.PARENTS].read(),
-                        'runlumi' : row[GetFromTaskAndType.RUNLUMI].read(),
+                        'runlumi' : readRunLumi(row[GetFromTaskAndType.RUNLUMI], row[GetFromTaskAndType.LUMIS]),
                         'events'  : row[GetFromTaskAndType.INEVENTS],
                 }
         self.logger.info("Got %s edm files for workflow %s" % (len(res['runsAndLumis']), workflow))
@@ -227,25 +265,19 @@ class HTCondorDataWorkflow(DataWorkflow):
                 raise ExecutionError("Cannot find any information about the output datasets names. You can try to execute 'crab report' with --dbs=no")
             try:
                 #load the input dataset's lumilist
-                dbs = DBSReader(dbsUrl)
-                inputDetails = dbs.listDatasetFileDetails(inputDataset)
-                res['dbsInLumilist'] = _compactLumis(inputDetails)
+                res['dbsInLumilist'] = listLumis(self.datasetLumis(dbsUrl, inputDataset)['lumis'])
                 self.logger.info("Aggregated input lumilist: %s" % res['dbsInLumilist'])
                 #load the output datasets' lumilist
                 res['dbsNumEvents'] = 0
                 res['dbsNumFiles'] = 0
-                res['dbsOutLumilist'] = {}
-                dbs = DBSReader("https://cmsweb.cern.ch/dbs/prod/phys03/DBSReader") #We can only publish here with DBS3
                 outLumis = []
                 for outputDataset in outputDatasets:
-                    outputDetails = dbs.listDatasetFileDetails(outputDataset)
-                    outLumis.append(_compactLumis(outputDetails))
-                    res['dbsNumEvents'] += sum(x['NumberOfEvents'] for x in outputDetails.values())
-                    res['dbsNumFiles'] += sum(len(x['Parents']) for x in outputDetails.values())
-
-                outLumis = LumiList(runsAndLumis = outLumis).compactList
-                for run,lumis in outLumis.iteritems():
-                    res['dbsOutLumilist'][run] = reduce(lambda x1,x2: x1+x2, map(lambda x: range(x[0], x[1]+1), lumis))
+                    #We can only publish here with DBS3
+                    outputSummary = self.datasetLumis("https://cmsweb.cern.ch/dbs/prod/phys03/DBSReader", outputDataset)
+                    outLumis.append(outputSummary['lumis'])
+                    res['dbsNumEvents'] += outputSummary['numEvents']
+                    res['dbsNumFiles'] += outputSummary['numParents']
+                res['dbsOutLumilist'] = listLumis(unionLumis(*outLumis))
                 self.logger.info("Aggregated output lumilist: %s" % res['dbsOutLumilist'])
             except Exception, ex:
                 msg = "Failed to contact DBS: %s" % str(ex)
@@ -255,14 +287,152 @@ class HTCondorDataWorkflow(DataWorkflow):
         yield res
 
 
+    def datasetLumis(self, dbsurl, dataset):
+        """
+        Summary of the files of 'dataset' in the DBS instance 'dbsurl': the
+        ranges of lumis of each run (see CRABInterface.LumiRanges), the number
+        of events and the number of parent files. The summary is cached for
+        dbsLumisCacheTime seconds (configuration; DBS_LUMIS_CACHE_TIME by
+        default, 0 disables the cache) and must not be modified.
+        """
+        def compute():
+            details = DBSReader(dbsurl).listDatasetFileDetails(dataset)
+            runlumis = {}
+            numEvents = numParents = 0
+            for info in details.itervalues():
+                for run, lumis in info['Lumis'].iteritems():
+                    runlumis.setdefault(str(run), []).extend(lumis)
+                numEvents += info['NumberOfEvents']
+                numParents += len(info['Parents'])
+            lumis = {}
+            for run, lumilist in runlumis.iteritems():
+                lumis[run] = toRanges(lumilist)
+            return {'lumis': lumis, 'numEvents': numEvents, 'numParents': numParents}
+
+        cachetime = getattr(self.config, 'dbsLumisCacheTime', DBS_LUMIS_CACHE_TIME)
+        if cachetime <= 0:
+            return compute()
+        return dbs_lumis_cache.get((dbsurl, dataset), compute, cachetime)
+
+
+    def resubmit(self, workflow, *args, **kwargs):
+        # Make sure the decision is taken on a fresh status, and that the next
+        # status request shows the effect of the resubmission.
+        self.invalidateStatus(workflow)
+        try:
+            return DataWorkflow.resubmit(self, workflow, *args, **kwargs)
+        finally:
+            self.invalidateStatus(workflow)
+
+
+    def kill(self, workflow, *args, **kwargs):
+        self.invalidateStatus(workflow)
+        try:
+            return DataWorkflow.kill(self, workflow, *args, **kwargs)
+        finally:
+            self.invalidateStatus(workflow)
+
+
+    def invalidateStatus(self, workflow):
+        for verbose in [0, 1, 2]:
+            status_cache.invalidate((workflow, verbose))
+            status_cache.invalidate((workflow, verbose, 'columnar'))
+        status_cache.invalidate((workflow, 'jobstates'))
+
+
     @global_user_throttle.make_throttled()
-    @conn_handler(services=['centralconfig', 'servercert'])
-    def status(self, workflow, userdn, userproxy=None, verbose=0):
+    def status(self, workflow, userdn, userproxy=None, verbose=0, jobsformat=None):
         """Retrieve the status of the workflow.
 
+           The result is cached by (workflow, verbose) for statusCacheTime
+           seconds (configuration; STATUS_CACHE_TIME by default, 0 disables
+           the cache), and concurrent identical requests share one computation.
+           The status does not depend on the user asking for it.
+
+           With jobsformat 'columnar', the jobs are returned in columnar format
+           (see HTCondorTaskStatus.jobsToColumns) and there is no 'jobList',
+           which can be derived from them. The columnar result is cached as
+           well; as it is made from a cached status, it can be up to twice
+           statusCacheTime old.
+
            :arg str workflow: a valid workflow name
+           :arg str jobsformat: representation of the jobs; 'columnar' or the default one
            :return: a workflow status summary document"""
 
+        if not verbose:
+            verbose = 0
+        cachetime = getattr(self.config, 'statusCacheTime', STATUS_CACHE_TIME)
+        if cachetime <= 0:
+            result = self._status(workflow, userdn, userproxy, verbose)
+            if jobsformat == 'columnar':
+                result = self.columnarStatus(result)
+            return result
+        compute = lambda: self._status(workflow, userdn, userproxy, verbose)
+        if jobsformat == 'columnar':
+            # The conversion is cached too, and made from the cached status.
+            return status_cache.get((workflow, verbose, 'columnar'),
+                                    lambda: self.columnarStatus(status_cache.get((workflow, verbose), compute, cachetime)), cachetime)
+        return status_cache.get((workflow, verbose), compute, cachetime)
+
+
+    def jobStates(self, workflow, taskstatus):
+        """
+        The state of each job of the task, {jobid: state}, as in the jobList
+        of the status, for the commands that only need to know which jobs are
+        done (logs, output). Only the root task ad and the job states (or
+        the node state) of the task are read; there is none of the rest of the
+        status (database, publication information, ...). Cached as the status.
+
+        :arg str workflow: a valid workflow name
+        :arg str taskstatus: the status of the task in the database
+        :return: a dictionary of the job states by job id"""
+        if taskstatus not in ['SUBMITTED', 'KILLFAILED', 'KILLED']:
+            return {}
+        cachetime = getattr(self.config, 'statusCacheTime', STATUS_CACHE_TIME)
+        if cachetime <= 0:
+            return self._jobStates(workflow)
+        return status_cache.get((workflow, 'jobstates'), lambda: self._jobStates(workflow), cachetime)
+
+
+    @conn_handler(services=['centralconfig', 'servercert'])
+    def _jobStates(self, workflow):
+        locator = HTCondorLocator.HTCondorLocator(self.centralcfg.centralconfig["backend-urls"])
+        try:
+            schedd, _ = locator.getScheddObj(workflow)
+            results = self.getRootTasks(workflow, schedd)
+        except Exception, exp:
+            self.logger.exception("%s: Failed to contact Schedd: %s" % (workflow, str(exp)))
+            return {}
+        if not results or 'CRAB_UserWebDir' not in results[-1]:
+            return {}
+        try:
+            nodes, _ = self.taskWebStatus(results[0], verbose=0)
+        except MissingNodeStatus:
+            return {}
+        states = {}
+        for job, info in nodes.items():
+            states[int(job)] = info['State']
+        return states
+
+
+    def columnarStatus(self, result):
+        """
+        Copy of the status 'result' with the jobs in columnar format; the
+        (possibly cached) result itself is not modified.
+        """
+        columnar = []
+        for retval in result:
+            retval = dict(retval)
+            if 'jobs' in retval:
+                retval['jobs'] = jobsToColumns(retval['jobs'])
+                retval.pop('jobList', None)
+            retval['jobsFormat'] = 'columnar'
+            columnar.append(retval)
+        return columnar
+
+
+    @conn_handler(services=['centralconfig', 'servercert'])
+    def _status(self, workflow, userdn, userproxy, verbose):
         # First, verify the task has been submitted by the backend.
         self.logger.info("Got status request for workflow %s" % workflow)
         row = self.api.query(None, None, self.Task.ID_sql, taskname = workflow)
@@ -276,8 +446,6 @@ class HTCondorDataWorkflow(DataWorkflow):
 #        if db_userdn != userdn:
 #            raise ExecutionError("Your DN, %s, is not the same as the original DN used for task submission" % userdn)
 
-        if verbose == None:
-            verbose = 0
         self.logger.info("Status result for workflow %s: %s (detail level %d)" % (workflow, status, verbose))
         if status not in ['SUBMITTED', 'KILLFAILED', 'KILLED']:
             if isinstance(taskFailure, str):
@@ -421,34 +589,76 @@ class HTCondorDataWorkflow(DataWorkflow):
         return [retval]
 
 
-    cpu_re = re.compile(r"Usr \d+ (\d+):(\d+):(\d+), Sys \d+ (\d+):(\d+):(\d+)")
-    def insertCpu(self, event, info):
-        if 'TotalRemoteUsage' in event:
-            m = self.cpu_re.match(event['TotalRemoteUsage'])
-            if m:
-                g = [int(i) for i in m.groups()]
-                user = g[0]*3600 + g[1]*60 + g[2]
-                sys = g[3]*3600 + g[4]*60 + g[5]
-                info['TotalUserCpuTimeHistory'][-1] = user
-                info['TotalSysCpuTimeHistory'][-1] = sys
-        else:
-            if 'RemoteSysCpu' in event:
-                info['TotalSysCpuTimeHistory'][-1] = float(event['RemoteSysCpu'])
-            if 'RemoteUserCpu' in event:
-                info['TotalUserCpuTimeHistory'][-1] = float(event['RemoteUserCpu'])
-
-
     def prepareCurl(self):
-        curl = pycurl.Curl()
-        curl.setopt(pycurl.NOSIGNAL, 0)
-        curl.setopt(pycurl.TIMEOUT, 30)
-        curl.setopt(pycurl.CONNECTTIMEOUT, 30)
-        curl.setopt(pycurl.FOLLOWLOCATION, 0)
-        curl.setopt(pycurl.MAXREDIRS, 0)
-        #curl.setopt(pycurl.ENCODING, 'gzip, deflate')
+        """
+        Return the curl handle of the current thread. Handles are kept between
+        requests so that the connections to the schedds are reused; each
+        request sets the options that are specific to it.
+        """
+        curl = getattr(curl_handles, 'curl', None)
+        if curl is None:
+            curl = pycurl.Curl()
+            curl.setopt(pycurl.NOSIGNAL, 0)
+            curl.setopt(pycurl.TIMEOUT, 30)
+            curl.setopt(pycurl.CONNECTTIMEOUT, 30)
+            curl.setopt(pycurl.FOLLOWLOCATION, 0)
+            curl.setopt(pycurl.MAXREDIRS, 0)
+            curl_handles.curl = curl
         return curl
 
 
+    def fetchWebFile(self, curl, url, parse):
+        """
+        Download 'url' and return the HTTP status and parse(fp) of the content.
+
+        The content is asked for gzip-compressed. The parsed content is cached
+        together with the ETag and Last-Modified of the response, which are
+        sent back as validators on the next request: if the file did not
+        change, the server answers 304 and the cached result is returned with
+        a 200 status. Cached results are shared and must not be modified.
+        """
+        with web_file_lock:
+            cached = web_file_cache.get(url)
+        headers = []
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers.append("If-None-Match: %s" % etag)
+            if last_modified:
+                headers.append("If-Modified-Since: %s" % last_modified)
+
+        fp = tempfile.TemporaryFile()
+        hbuf = StringIO.StringIO()
+        curl.setopt(pycurl.URL, url)
+        curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+        curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
+        curl.setopt(pycurl.ENCODING, 'gzip')
+        if headers:
+            curl.setopt(pycurl.HTTPHEADER, headers)
+        try:
+            curl.perform()
+        finally:
+            if headers:
+                curl.unsetopt(pycurl.HTTPHEADER)
+        header = ResponseHeader(hbuf.getvalue())
+
+        if header.status == 304 and cached:
+            self.logger.debug("%s did not change" % url)
+            return 200, cached[2]
+        if header.status != 200:
+            return header.status, None
+        fp.seek(0)
+        result = parse(fp)
+        etag = getResponseHeader(header, 'ETag')
+        last_modified = getResponseHeader(header, 'Last-Modified')
+        if etag or last_modified:
+            with web_file_lock:
+                if len(web_file_cache) >= WEB_FILE_CACHE_MAX:
+                    web_file_cache.clear()
+                web_file_cache[url] = (etag, last_modified, result)
+        return 200, result
+
+
     def taskWebStatus(self, task_ad, verbose):
         nodes = {}
         pool_info = {}
@@ -456,80 +666,68 @@ class HTCondorDataWorkflow(DataWorkflow):
         url = task_ad['CRAB_UserWebDir']
 
         curl = self.prepareCurl()
-        fp = tempfile.TemporaryFile()
-        curl.setopt(pycurl.WRITEFUNCTION, fp.write)
-        hbuf = StringIO.StringIO()
-        curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
         self.logger.debug("Retrieving task status from web with verbosity %d." % verbose)
-        if verbose == 1:
+        if verbose == 0:
+            states = self.getTaskStates(curl, task_ad, url)
+            if states is not None:
+                return runsToStates(states), pool_info
+
+        elif verbose == 1:
             jobs_url = url + "/jobs_log.txt"
-            curl.setopt(pycurl.URL, jobs_url)
-            self.logger.info("Starting download of job log")
-            curl.perform()
-            self.logger.info("Finished download of job log")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
-                self.logger.debug("Starting parse of job log")
-                self.parseJobLog(fp, nodes)
-                self.logger.debug("Finished parse of job log")
-                fp.truncate(0)
-                hbuf.truncate(0)
-            else:
-                raise ExecutionError("Cannot get jobs log file. Retry in a minute if you just submitted the task")
+            self.updateJobLog(curl, jobs_url, nodes)
 
         elif verbose == 2:
             site_url = url + "/site_ad.txt"
-            curl.setopt(pycurl.URL, site_url)
             self.logger.debug("Starting download of site ad")
-            curl.perform()
+            status, site_info = self.fetchWebFile(curl, site_url, self.readSiteAd)
             self.logger.debug("Finished download of site ad")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
-                self.logger.debug("Starting parse of site ad")
-                self.parseSiteAd(fp, task_ad, nodes)
-                self.logger.debug("Finished parse of site ad")
-                fp.truncate(0)
-                hbuf.truncate(0)
+            if status == 200:
+                self.applySiteAd(site_info, task_ad, nodes)
             else:
                 raise ExecutionError("Cannot get site ad. Retry in a minute if you just submitted the task")
             pool_info_url = self.centralcfg.centralconfig["backend-urls"].get("poolInfo")
             if pool_info_url:
-                fp2 = StringIO.StringIO()
-                curl.setopt(pycurl.WRITEFUNCTION, fp2.write)
-                curl.setopt(pycurl.URL, pool_info_url)
                 self.logger.debug("Starting download of pool info from %s" % pool_info_url)
-                curl.perform()
-                curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+                status, pool_info = self.fetchWebFile(curl, pool_info_url, json.load)
                 self.logger.debug("Finished download of pool info")
-                header = ResponseHeader(hbuf.getvalue())
-                if header.status == 200:
-                    fp2.seek(0)
-                    self.logger.debug("Starting parse of pool info")
-                    pool_info = json.load(fp2)
-                    self.logger.debug("Finished parse of pool info")
-                    hbuf.truncate(0)
-                else:
+                if status != 200:
                     raise ExecutionError("Cannot get pool info file. Retry in a minute if you just submitted the task")
 
         nodes_url = url + "/node_state.txt"
-        curl.setopt(pycurl.URL, nodes_url)
-        fp.seek(0)
         self.logger.debug("Starting download of node state")
-        curl.perform()
+        status, node_state = self.fetchWebFile(curl, nodes_url, self.readNodeState)
         self.logger.debug("Finished download of node state")
-        header = ResponseHeader(hbuf.getvalue())
-        if header.status == 200:
-            fp.seek(0)
-            self.logger.debug("Starting parse of node state")
-            self.parseNodeState(fp, nodes)
-            self.logger.debug("Finished parse of node state")
+        if status == 200:
+            self.applyNodeState(node_state, nodes)
         else:
             raise MissingNodeStatus("Cannot get node state log. Retry in a minute if you just submitted the task")
 
         return nodes, pool_info
 
+    def getTaskStates(self, curl, task_ad, url):
+        """
+        Return the job states the schedd keeps for the task, as runs (see
+        TaskWorker.Actions.TaskSummary and HTCondorTaskStatus.runsToStates),
+        or None if there are none (tasks submitted before they existed, node
+        state not available yet) or if they are stale while the DAG runs.
+        The states are those of the node state alone, as when it is parsed
+        here.
+        """
+        states_url = url + "/status_states.json"
+        try:
+            status, states = self.fetchWebFile(curl, states_url, json.load)
+        except ValueError:
+            self.logger.warning("Cannot parse %s" % states_url)
+            return None
+        if status != 200 or states.get('version') != 1:
+            return None
+        age = time.time() - states.get('updated', 0)
+        if task_ad['JobStatus'] == 2 and age > SUMMARY_MAX_AGE:
+            self.logger.info("Ignoring %s, last updated %d seconds ago" % (states_url, age))
+            return None
+        return states
+
+
     def _getOutDatasets(self, workflow):
         """ Get the output datasets of the workflow.
             The current implementation queries the filemetadata. However this rotates, we should take this information from the task database at some point.
@@ -574,251 +772,80 @@ class HTCondorDataWorkflow(DataWorkflow):
         return publication_info, outdatasets
 
 
-    node_name_re = re.compile("DAG Node: Job(\d+)")
-    node_name2_re = re.compile("Job(\d+)")
-    def parseJobLog(self, fp, nodes):
-        node_map = {}
-        count = 0
-        for event in HTCondorUtils.readEvents(fp):
-            count += 1
-            eventtime = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
-            if event['MyType'] == 'SubmitEvent':
-                m = self.node_name_re.match(event['LogNotes'])
-                if m:
-                    node = m.groups()[0]
-                    proc = event['Cluster'], event['Proc']
-                    info = nodes.setdefault(node, {'Retries': 0, 'Restarts': 0, 'SiteHistory': [], 'ResidentSetSize': [], 'SubmitTimes': [], 'StartTimes': [], 'EndTimes': [], 'TotalUserCpuTimeHistory': [], 'TotalSysCpuTimeHistory': [], 'WallDurations': [], 'JobIds': []})
-                    info['State'] = 'idle'
-                    info['JobIds'].append("%d.%d" % proc)
-                    info['RecordedSite'] = False
-                    info['SubmitTimes'].append(eventtime)
-                    info['TotalUserCpuTimeHistory'].append(0)
-                    info['TotalSysCpuTimeHistory'].append(0)
-                    info['WallDurations'].append(0)
-                    info['ResidentSetSize'].append(0)
-                    info['Retries'] = len(info['SubmitTimes'])-1
-                    node_map[proc] = node
-            elif event['MyType'] == 'ExecuteEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                nodes[node]['StartTimes'].append(eventtime)
-                nodes[node]['State'] = 'running'
-                nodes[node]['RecordedSite'] = False
-            elif event['MyType'] == 'JobTerminatedEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                nodes[node]['EndTimes'].append(eventtime)
-                nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
-                self.insertCpu(event, nodes[node])
-                if event['TerminatedNormally']:
-                    if event['ReturnValue'] == 0:
-                            nodes[node]['State'] = 'transferring'
-                    else:
-                            nodes[node]['State'] = 'cooloff'
-                else:
-                    nodes[node]['State']  = 'cooloff'
-            elif event['MyType'] == 'PostScriptTerminatedEvent':
-                m = self.node_name2_re.match(event['DAGNodeName'])
-                if m:
-                    node = m.groups()[0]
-                    if event['TerminatedNormally']:
-                        if event['ReturnValue'] == 0:
-                            nodes[node]['State'] = 'finished'
-                        elif event['ReturnValue'] == 2:
-                            nodes[node]['State'] = 'failed'
-                        else:
-                            nodes[node]['State'] = 'cooloff'
-                    else:
-                        nodes[node]['State']  = 'cooloff'
-            elif event['MyType'] == 'ShadowExceptionEvent' or event["MyType"] == "JobReconnectFailedEvent" or event['MyType'] == 'JobEvictedEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if nodes[node]['State'] != 'idle':
-                    nodes[node]['EndTimes'].append(eventtime)
-                    if nodes[node]['WallDurations'] and nodes[node]['EndTimes'] and nodes[node]['StartTimes']:
-                        nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
-                    nodes[node]['State'] = 'idle'
-                    self.insertCpu(event, nodes[node])
-                    nodes[node]['TotalUserCpuTimeHistory'].append(0)
-                    nodes[node]['TotalSysCpuTimeHistory'].append(0)
-                    nodes[node]['WallDurations'].append(0)
-                    nodes[node]['ResidentSetSize'].append(0)
-                    nodes[node]['SubmitTimes'].append(-1)
-                    nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
-                    nodes[node]['Restarts'] += 1
-            elif event['MyType'] == 'JobAbortedEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if nodes[node]['State'] == "idle" or nodes[node]['State'] == "held":
-                    nodes[node]['StartTimes'].append(-1)
-                    if not nodes[node]['RecordedSite']:
-                        nodes[node]['SiteHistory'].append("Unknown")
-                nodes[node]['State'] = 'killed'
-                self.insertCpu(event, nodes[node])
-            elif event['MyType'] == 'JobHeldEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if nodes[node]['State'] == 'running':
-                    nodes[node]['EndTimes'].append(eventtime)
-                    if nodes[node]['WallDurations'] and nodes[node]['EndTimes'] and nodes[node]['StartTimes']:
-                        nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
-                    self.insertCpu(event, nodes[node])
-                    nodes[node]['TotalUserCpuTimeHistory'].append(0)
-                    nodes[node]['TotalSysCpuTimeHistory'].append(0)
-                    nodes[node]['WallDurations'].append(0)
-                    nodes[node]['ResidentSetSize'].append(0)
-                    nodes[node]['SubmitTimes'].append(-1)
-                    nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
-                    nodes[node]['Restarts'] += 1
-                nodes[node]['State'] = 'held'
-            elif event['MyType'] == 'JobReleaseEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                nodes[node]['State'] = 'idle'
-            elif event['MyType'] == 'JobAdInformationEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if (not nodes[node]['RecordedSite']) and ('JOBGLIDEIN_CMSSite' in event) and not event['JOBGLIDEIN_CMSSite'].startswith("$$"):
-                    nodes[node]['SiteHistory'].append(event['JOBGLIDEIN_CMSSite'])
-                    nodes[node]['RecordedSite'] = True
-                self.insertCpu(event, nodes[node])
-            elif event['MyType'] == 'JobImageSizeEvent':
-                nodes[node]['ResidentSetSize'][-1] = int(event['ResidentSetSize'])
-                if nodes[node]['StartTimes']:
-                    nodes[node]['WallDurations'][-1] = eventtime - nodes[node]['StartTimes'][-1]
-                self.insertCpu(event, nodes[node])
-            elif event["MyType"] == "JobDisconnectedEvent" or event["MyType"] == "JobReconnectedEvent":
-                # These events don't really affect the node status
-                pass
-            else:
-                self.logger.warning("Unknown event type: %s" % event['MyType'])
-
-        self.logger.debug("There were %d events in the job log." % count)
-        now = time.time()
-        for node, info in nodes.items():
-            last_start = now
-            if info['StartTimes']:
-                last_start = info['StartTimes'][-1]
-            while len(info['WallDurations']) < len(info['SiteHistory']):
-                info['WallDurations'].append(now - last_start)
-            while len(info['WallDurations']) > len(info['SiteHistory']):
-                info['SiteHistory'].append("Unknown")
-
-
-    job_re = re.compile(r"JOB Job(\d+)\s+([A-Z_]+)\s+\((.*)\)")
-    post_failure_re = re.compile(r"POST [Ss]cript failed with status (\d+)")
-    def parseNodeState(self, fp, nodes):
-        first_char = fp.read(1)
-        fp.seek(0)
-        if first_char == "[":
-            return self.parseNodeStateV2(fp, nodes)
-        for line in fp.readlines():
-            m = self.job_re.match(line)
-            if not m:
-                continue
-            nodeid, status, msg = m.groups()
-            if status == "STATUS_READY":
-                info = nodes.setdefault(nodeid, {})
-                if info.get("State") == "transferring":
-                    info["State"] = "cooloff"
-                elif info.get('State') != "cooloff":
-                    info['State'] = 'unsubmitted'
-            elif status == "STATUS_PRERUN":
-                info = nodes.setdefault(nodeid, {})
-                info['State'] = 'cooloff'
-            elif status == 'STATUS_SUBMITTED':
-                info = nodes.setdefault(nodeid, {})
-                if msg == 'not_idle':
-                    info.setdefault('State', 'running')
-                else:
-                    info.setdefault('State', 'idle')
-            elif status == 'STATUS_POSTRUN':
-                info = nodes.setdefault(nodeid, {})
-                if info.get("State") != "cooloff":
-                    info['State'] = 'transferring'
-            elif status == 'STATUS_DONE':
-                info = nodes.setdefault(nodeid, {})
-                info['State'] = 'finished'
-            elif status == "STATUS_ERROR":
-                info = nodes.setdefault(nodeid, {})
-                m = self.post_failure_re.match(msg)
-                if m:
-                    if m.groups()[0] == '2':
-                        info['State'] = 'failed'
-                    else:
-                        info['State'] = 'cooloff'
-                else:
-                    info['State'] = 'failed'
-
-
-    def parseNodeStateV2(self, fp, nodes):
+    def updateJobLog(self, curl, jobs_url, nodes):
         """
-        HTCondor 8.1.6 updated the node state file to be classad-based.
-        This is a more flexible format that allows future extensions but, unfortunately,
-        also requires a separate parser.
+        Fill 'nodes' with the information from the task's jobs_log.txt.
+
+        The job log only grows, so the parse state of each task (the number of
+        bytes parsed and the resulting per-node information) is kept between
+        requests, and only the bytes appended since are downloaded (with an
+        HTTP Range request) and parsed. Only complete events are consumed; a
+        partially written one is parsed on the next request. If the server
+        sends the whole file, or the file got shorter, parsing restarts from
+        scratch.
         """
-        for ad in classad.parseAds(fp):
-            if ad['Type'] != "NodeStatus":
-                continue
-            node = ad.get("Node", "")
-            if not node.startswith("Job"):
-                continue
-            nodeid = node[3:]
-            status = ad.get('NodeStatus', -1)
-            retry = ad.get('RetryCount', -1)
-            msg = ad.get("StatusDetails", "")
-            if status == 1: # STATUS_READY
-                info = nodes.setdefault(nodeid, {})
-                if info.get("State") == "transferring":
-                    info["State"] = "cooloff"
-                elif info.get('State') != "cooloff":
-                    info['State'] = 'unsubmitted'
-            elif status == 2: # STATUS_PRERUN
-                info = nodes.setdefault(nodeid, {})
-                if retry == 0:
-                    info['State'] = 'unsubmitted'
-                else:
-                    info['State'] = 'cooloff'
-            elif status == 3: # STATUS_SUBMITTED
-                info = nodes.setdefault(nodeid, {})
-                if msg == 'not_idle':
-                    info.setdefault('State', 'running')
-                else:
-                    info.setdefault('State', 'idle')
-            elif status == 4: # STATUS_POSTRUN 
-                info = nodes.setdefault(nodeid, {})
-                if info.get("State") != "cooloff":
-                    info['State'] = 'transferring'
-            elif status == 5: # STATUS_DONE
-                info = nodes.setdefault(nodeid, {})
-                info['State'] = 'finished'
-            elif status == 6: # STATUS_ERROR
-                info = nodes.setdefault(nodeid, {})
-                # Older versions of HTCondor would put jobs into STATUS_ERROR
-                # for a short time if the job was to be retried.  Hence, we had
-                # some status parsing logic to try and guess whether the job would
-                # be tried again in the near future.  This behavior is no longer
-                # observed; STATUS_ERROR is terminal.
-                info['State'] = 'failed'
-
-
-    job_name_re = re.compile(r"Job(\d+)")
-    def parseSiteAd(self, fp, task_ad, nodes):
-        site_ad = classad.parse(fp)
-
-        blacklist = set(task_ad['CRAB_SiteBlacklist'])
-        whitelist = set(task_ad['CRAB_SiteWhitelist'])
-        if 'CRAB_SiteResubmitWhitelist' in task_ad:
-            whitelist.update(task_ad['CRAB_SiteResubmitWhitelist'])
-        if 'CRAB_SiteResubmitBlacklist' in task_ad:
-            blacklist.update(task_ad['CRAB_SiteResubmitBlacklist'])
-
-        for key, val in site_ad.items():
-            m = self.job_name_re.match(key)
-            if not m:
-                continue
-            nodeid = m.groups()[0]
-            sites = set(val.eval())
-            if whitelist:
-                sites &= whitelist
-            # Never blacklist something on the whitelist
-            sites -= (blacklist-whitelist)
-
-            info = nodes.setdefault(nodeid, {})
-            info['AvailableSites'] = list([i.eval() for i in sites])
+        with job_log_lock:
+            state = job_log_states.pop(jobs_url, None)
+        if state is None:
+            state = {'offset': 0, 'nodes': {}, 'node_map': {}}
+
+        fp = tempfile.TemporaryFile()
+        hbuf = StringIO.StringIO()
+        curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+        curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
+        curl.setopt(pycurl.URL, jobs_url)
+        if state['offset']:
+            # Ranges of a compressed response would not be file offsets.
+            curl.setopt(pycurl.ENCODING, 'identity')
+            curl.setopt(pycurl.HTTPHEADER, ["Range: bytes=%d-" % state['offset']])
+        else:
+            curl.setopt(pycurl.ENCODING, 'gzip')
+        self.logger.info("Starting download of job log from byte %d" % state['offset'])
+        try:
+            curl.perform()
+        except:
+            self._storeJobLogState(jobs_url, state)
+            raise
+        finally:
+            # Setting an empty list does not remove the header.
+            curl.unsetopt(pycurl.HTTPHEADER)
+        self.logger.info("Finished download of job log")
+        header = ResponseHeader(hbuf.getvalue())
+
+        if header.status == 416:
+            # Nothing new since the last request, unless the file got shorter.
+            content_range = getResponseHeader(header, 'Content-Range') or ''
+            if content_range.startswith("bytes */") and int(content_range[8:]) < state['offset']:
+                self.logger.info("Job log %s got shorter; parsing it again" % jobs_url)
+                return self.updateJobLog(curl, jobs_url, nodes)
+            fp.truncate(0)
+        elif header.status == 200 and state['offset']:
+            self.logger.info("Got the whole job log %s; parsing it again" % jobs_url)
+            state = {'offset': 0, 'nodes': {}, 'node_map': {}}
+        elif header.status not in [200, 206]:
+            self._storeJobLogState(jobs_url, state)
+            raise ExecutionError("Cannot get jobs log file. Retry in a minute if you just submitted the task")
+
+        complete = self.completeEventsLength(fp)
+        fp.truncate(complete)
+        fp.seek(0)
+        self.logger.debug("Starting parse of %d bytes of job log" % complete)
+        self.parseJobEvents(fp, state['nodes'], state['node_map'])
+        self.logger.debug("Finished parse of job log")
+        state['offset'] += complete
+        self._storeJobLogState(jobs_url, state)
+
+        # The stored state must not be modified by the rest of the status processing.
+        for node, info in state['nodes'].items():
+            nodes[node] = copyNodeInfo(info)
+        self.completeJobLog(nodes)
+
+
+    def _storeJobLogState(self, jobs_url, state):
+        with job_log_lock:
+            if len(job_log_states) >= JOB_LOG_STATES_MAX:
+                job_log_states.clear()
+            job_log_states[jobs_url] = state
 
 
     def parsePoolAd(self, fp):
@@ -0,0 +1,154 @@
+"""
+Compact representation of the runs and lumis of the output files.
+
+The lumis of a file are kept as ranges per run, in the JSON format of the CMS
+lumi masks ({"1": [[1, 10], [15, 15]], "2": [[3, 8]]}): the lumis processed by
+a job are mostly contiguous, so the ranges are small whatever the number of
+lumis, and they are decoded by the json module instead of literal_eval.
+
+The union of lumi lists works on the sorted ranges of each run (O(n log n) in
+the number of ranges).
+
+Files stored before the fmd_lumis column existed only have fmd_runlumi, the
+string representation of a dictionary of lumi lists by run
+({'1': ['1', '2', ...]}); readers use fmd_lumis when it is set and fall back
+on fmd_runlumi otherwise. New files have both columns, so that the frontends
+not yet upgraded, which only read fmd_runlumi, keep working; fmd_runlumi can
+stop being written once all of them use fmd_lumis.
+"""
+
+import json
+from ast import literal_eval
+
+
+def toRanges(lumis):
+    """
+    Sorted list of the [first, last] ranges of the lumi numbers 'lumis'
+    (any iterable of numbers or strings of digits).
+    """
+    ranges = []
+    for lumi in sorted(set([int(lumi) for lumi in lumis])):
+        if ranges and ranges[-1][1] == lumi - 1:
+            ranges[-1][1] = lumi
+        else:
+            ranges.append([lumi, lumi])
+    return ranges
+
+
+def compactLumis(runs, lumis):
+    """
+    Ranges of the lumis of each run, from the parallel lists 'runs' and
+    'lumis' (the lumis of each run as a comma separated string) uploaded by
+    the post-job.
+    """
+    runlumis = {}
+    for run, lumilist in zip(runs, lumis):
+        runlumis.setdefault(str(int(run)), []).extend(lumilist.split(','))
+    compact = {}
+    for run, lumilist in runlumis.items():
+        compact[run] = toRanges(lumilist)
+    return compact
+
+
+def encodeLumis(compact):
+    return json.dumps(compact, separators=(',', ':'), sort_keys=True)
+
+
+def decodeLumis(text):
+    return json.loads(text)
+
+
+def expandLumis(compact):
+    """
+    The lumis of 'compact' in the format of fmd_runlumi: a list of lumi
+    numbers as strings for each run.
+    """
+    runlumis = {}
+    for run, ranges in compact.items():
+        lumis = []
+        for first, last in ranges:
+            lumis.extend(map(str, xrange(first, last + 1)))
+        runlumis[str(run)] = lumis
+    return runlumis
+
+
+def formatLumis(compact):
+    """
+    The lumis of 'compact' formatted as fmd_runlumi, i.e. as
+    str(expandLumis(compact)), without building the lists.
+    """
+    runs = []
+    for run, ranges in compact.items():
+        lumis = []
+        for first, last in ranges:
+            lumis.append(', '.join(map(repr, map(str, xrange(first, last + 1)))))
+        runs.append('%r: [%s]' % (str(run), ', '.join(lumis)))
+    return '{%s}' % ', '.join(runs)
+
+
+def listLumis(compact):
+    """
+    The lumi numbers of each run of 'compact'.
+    """
+    runlumis = {}
+    for run, ranges in compact.items():
+        lumis = []
+        for first, last in ranges:
+            lumis.extend(xrange(first, last + 1))
+        runlumis[str(run)] = lumis
+    return runlumis
+
+
+def mergeRanges(ranges):
+    """
+    Sorted, disjoint and non adjacent ranges with the lumis of 'ranges'.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def unionLumis(*lumilists):
+    """
+    The lumis of each run in any of the compact lists 'lumilists'.
+    """
+    runs = {}
+    for compact in lumilists:
+        for run, ranges in compact.items():
+            runs.setdefault(str(run), []).extend(ranges)
+    union = {}
+    for run, ranges in runs.items():
+        if ranges:
+            union[run] = mergeRanges(ranges)
+    return union
+
+
+def readRunLumi(runlumi, lumis):
+    """
+    The lumis of a file formatted as fmd_runlumi, from the values of its
+    fmd_runlumi and fmd_lumis columns.
+    """
+    if lumis is not None:
+        return formatLumis(decodeLumis(lumis.read()))
+    if runlumi is None:
+        return '{}'
+    return runlumi.read()
+
+
+def readParents(parents):
+    """
+    The parent LFNs of a file, from its fmd_parent column: a JSON list, or
+    the string representation of a Python list for older files.
+    """
+    if parents is None:
+        return []
+    text = parents.read()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return literal_eval(text)
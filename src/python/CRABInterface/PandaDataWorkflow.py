@@ -5,6 +5,7 @@ from WMCore.REST.Error import ExecutionError, InvalidParameter
 from WMCore.WMSpec.WMTask import buildLumiMask
 from CRABInterface.DataWorkflow import DataWorkflow
 from CRABInterface.Utils import conn_handler
+from CRABInterface.LumiRanges import readRunLumi
 
 class PandaDataWorkflow(DataWorkflow):
     """ Panda implementation of the status command.
@@ -101,8 +102,9 @@ class PandaDataWorkflow(DataWorkflow):
         :return: a generator of list of outputs"""
 
         #check that the jobids passed by the user are finished
+        doneIds = set(transferingIds + finishedIds)
         for jobid in jobids:
-            if not jobid in transferingIds + finishedIds:
+            if not jobid in doneIds:
                 raise InvalidParameter("The job with id %s is not finished" % jobid)
 
         #If the user do not give us jobids set them to all possible ids
@@ -117,24 +119,30 @@ class PandaDataWorkflow(DataWorkflow):
             return
 
         self.logger.debug("Retrieving output of jobs: %s" % jobids)
-        rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndType_sql, filetype=','.join(filetype), taskname=workflow)
-        rows = filter(lambda row: row[GetFromTaskAndType.PANDAID] in jobids, rows)
-        if howmany!=-1:
-            rows=rows[:howmany]
-        #jobids=','.join(map(str,jobids)), limit=str(howmany) if howmany!=-1 else str(len(jobids)*100))
+        rows = self.getFileRows(workflow, filetype, jobids, howmany)
+        finishedIds = set(finishedIds)
+        transferingIds = set(transferingIds)
 
+        files = []
         for row in rows:
             if filetype == ['LOG'] and saveLogs == 'F':
-                pfn = self.phedex.getPFN(row[GetFromTaskAndType.TMPLOCATION], row[GetFromTaskAndType.LFN])[(row[GetFromTaskAndType.TMPLOCATION], row[GetFromTaskAndType.LFN])]
+                files.append((row, row[GetFromTaskAndType.TMPLOCATION], row[GetFromTaskAndType.LFN]))
             else:
                 if row[GetFromTaskAndType.PANDAID] in finishedIds:
                     lfn = re.sub('^/store/temp/', '/store/', row[GetFromTaskAndType.LFN])
-                    pfn = self.phedex.getPFN(row[GetFromTaskAndType.LOCATION], lfn)[(row[GetFromTaskAndType.LOCATION], lfn)]
+                    files.append((row, row[GetFromTaskAndType.LOCATION], lfn))
                 elif row[GetFromTaskAndType.PANDAID] in transferingIds:
-                    pfn = self.phedex.getPFN(row[GetFromTaskAndType.TMPLOCATION], row[GetFromTaskAndType.LFN])[(row[GetFromTaskAndType.TMPLOCATION], row[GetFromTaskAndType.LFN])]
+                    files.append((row, row[GetFromTaskAndType.TMPLOCATION], row[GetFromTaskAndType.LFN]))
                 else:
                     continue
-
+        try:
+            pfns = self.getPFNs([(site, lfn) for _, site, lfn in files])
+            pfns = [pfns[(site, lfn)] for _, site, lfn in files]
+        except Exception, err:
+            self.logger.exception(err)
+            raise ExecutionError("Exception while contacting PhEDEx. Cannot get the PFN of the files.")
+
+        for (row, _, _), pfn in zip(files, pfns):
             yield { 'pfn' : pfn,
                     'size' : row[GetFromTaskAndType.SIZE],
                     'checksum' : {'cksum' : row[GetFromTaskAndType.CKSUM], 'md5' : row[GetFromTaskAndType.ADLER32], 'adler31' : row[GetFromTaskAndType.ADLER32]}
@@ -159,7 +167,7 @@ class PandaDataWorkflow(DataWorkflow):
         for row in rows:
             if row[GetFromTaskAndType.PANDAID] in jobids:
                 res['runsAndLumis'][str(row[GetFromTaskAndType.PANDAID])] = { 'parents' : row[GetFromTaskAndType.PARENTS].read(),
-                        'runlumi' : row[GetFromTaskAndType.RUNLUMI].read(),
+                        'runlumi' : readRunLumi(row[GetFromTaskAndType.RUNLUMI], row[GetFromTaskAndType.LUMIS]),
                         'events'  : row[GetFromTaskAndType.INEVENTS],
                 }
         self.logger.info("Got %s edm files for workflow %s" % (len(res), workflow))
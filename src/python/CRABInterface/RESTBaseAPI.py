@@ -1,7 +1,6 @@
 import logging
 import cherrypy
 from commands import getstatusoutput
-from time import mktime, gmtime
 
 # WMCore dependecies here
 from WMCore.REST.Server import DatabaseRESTApi, rows
@@ -39,15 +38,17 @@ class RESTBaseAPI(DatabaseRESTApi):
         if status is not 0:
             raise ExecutionError("Internal issue when retrieving crabserver service DN.")
 
-        extconfig = Utils.ConfigCache(centralconfig=Utils.getCentralConfig(extconfigurl=config.extconfigurl, mode=config.mode),
-                                      cachetime=mktime(gmtime()))
+        #The central configuration and the SiteDB site list are shared by the whole process
+        #and refreshed in the background; only the central configuration is waited for here.
+        Utils.globalinit(config.serverhostkey, config.serverhostcert, serverdn, config.credpath, config.extconfigurl, config.mode)
+        extconfig = Utils.central_config_cache.get()
+        Utils.cms_sites_cache.prefetch()
 
         #Global initialization of Data objects. Parameters coming from the config should go here
         DataUserWorkflow.globalinit(config)
         DataWorkflow.globalinit(dbapi=self, phedexargs={'endpoint': config.phedexurl},\
                                 credpath=config.credpath, centralcfg=extconfig, config=config)
         DataFileMetadata.globalinit(dbapi=self, config=config)
-        Utils.globalinit(config.serverhostkey, config.serverhostcert, serverdn, config.credpath)
 
         ## TODO need a check to verify the format depending on the resource
         ##      the RESTFileMetadata has the specifc requirement of getting xml reports
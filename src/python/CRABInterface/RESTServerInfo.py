@@ -5,7 +5,7 @@ from WMCore.REST.Error import ExecutionError
 # CRABServer dependecies here
 from CRABInterface.RESTExtensions import authz_login_valid
 from CRABInterface.Regexps import RX_SUBRES_SI , RX_WORKFLOW
-from CRABInterface.Utils import conn_handler
+from CRABInterface.Utils import conn_handler, getStatistics
 from CRABInterface.__init__ import __version__
 import logging
 import HTCondorLocator
@@ -70,3 +70,7 @@ class RESTServerInfo(RESTEntity):
     @conn_handler(services=['centralconfig'])
     def ignlocalityblacklist(self, **kwargs):
         yield self.centralcfg.centralconfig['ign-locality-blacklist']
+
+    def statistics(self, **kwargs):
+        """The counters of the user throttle and of the caches of this process (admitted, queued, rejected, hits, misses, failures ...)"""
+        yield getStatistics()
@@ -9,13 +9,28 @@ from CRABInterface.DataUserWorkflow import DataUserWorkflow
 from CRABInterface.DataUserWorkflow import DataWorkflow
 from CRABInterface.RESTExtensions import authz_owner_match, authz_login_valid
 from CRABInterface.Regexps import *
-from CRABInterface.Utils import CMSSitesCache, conn_handler, getDBinstance
+from CRABInterface.Utils import CMSSitesCache, SiteIndex, RefreshAheadCache, conn_handler, getDBinstance, monitored
 
 # external dependecies here
 import cherrypy
 import time
 import logging
-import re
+
+
+#Refresh period of the list of releases of the tag collector
+RELEASES_REFRESH = 1800
+
+class EmptyReleaseCatalogue(ValueError):
+    pass
+
+def fetchReleases():
+    """The releases of each architecture in the tag collector; an empty list is kept from replacing a good one."""
+    releases = allScramArchsAndVersions()
+    if not releases:
+        raise EmptyReleaseCatalogue("The list of releases at %s is empty" % TAG_COLLECTOR_URL)
+    return releases
+
+release_catalogue = monitored("list of releases", RefreshAheadCache("list of releases", fetchReleases, RELEASES_REFRESH))
 
 
 class RESTUserWorkflow(RESTEntity):
@@ -26,9 +41,10 @@ class RESTUserWorkflow(RESTEntity):
 
         self.logger = logging.getLogger("CRABLogger.RESTUserWorkflow")
         self.userworkflowmgr = DataUserWorkflow()
-        self.allCMSNames = CMSSitesCache(cachetime=0, sites={})
+        self.allCMSNames = CMSSitesCache(cachetime=0, sites={}, index=SiteIndex([]))
         self.centralcfg = centralcfg
         self.Task = getDBinstance(config, 'TaskDB', 'Task')
+        release_catalogue.prefetch()
 
     def _expandSites(self, sites):
         """Check if there are sites cotaining the '*' wildcard and convert them in the corresponding list
@@ -37,8 +53,7 @@ class RESTUserWorkflow(RESTEntity):
         res = set()
         for site in sites:
             if '*' in site:
-                sitere = re.compile(site.replace('*','.*'))
-                expanded = map(str, filter(sitere.match, self.allCMSNames.sites))
+                expanded = self.allCMSNames.index.expand(site)
                 self.logger.debug("Site %s expanded to %s during validate" % (site, expanded))
                 if not expanded:
                     excasync = ValueError("Remote output data site not valid")
@@ -75,7 +90,7 @@ class RESTUserWorkflow(RESTEntity):
             raise invalidp
 
     def _checkSite(self, site):
-        if site not in self.allCMSNames.sites:
+        if site not in self.allCMSNames.index:
             excasync = ValueError("A site name you specified is not valid")
             invalidp = InvalidParameter("The parameter %s is not in the list of known CMS sites %s" % (site, self.allCMSNames.sites), errobj = excasync)
             setattr(invalidp, 'trace', '')
@@ -83,21 +98,21 @@ class RESTUserWorkflow(RESTEntity):
 
     def _checkReleases(self, jobarch, jobsw):
         """ Check if the software needed by the user is available in the tag collector
-            Uses allScramArchsAndVersions from WMCore. If an IOError is raised report an error message.
+            Uses allScramArchsAndVersions from WMCore, through release_catalogue. If an IOError is raised report an error message.
             If the list of releases is empty (reason may be an ExpatError) then report an error message
             If the asked released is not there then report an error message
         """
 
         msg = False
+        goodReleases = {}
         try:
-            goodReleases = allScramArchsAndVersions()
+            goodReleases = release_catalogue.get()
         except IOError:
             msg = "Error connecting to %s and determine the list of available releases. You may need to contact an operator." % TAG_COLLECTOR_URL
-
-        if goodReleases == {}:
+        except EmptyReleaseCatalogue:
             msg = "The list of releases at %s is empty. You may need to contact an operator." % TAG_COLLECTOR_URL
 
-        if jobarch not in goodReleases or jobsw not in goodReleases[jobarch]:
+        if not msg and (jobarch not in goodReleases or jobsw not in goodReleases[jobarch]):
             msg = "ERROR: %s on %s is not among supported releases" % (jobsw, jobarch)
             msg += "\nUse config.JobType.allowNonProductionCMSSW = True if you are sure of what you are doing"
 
@@ -195,6 +210,8 @@ class RESTUserWorkflow(RESTEntity):
 
             # Used to determine how much information to return to the client for status
             validate_num("verbose", param, safe, optional=True)
+            # 'columnar' for a columnar representation of the jobs in the status
+            validate_str("jobsformat", param, safe, RX_JOBSFORMAT, optional=True)
 
             #used by get log, get data
             validate_num('limit', param, safe, optional=True)
@@ -290,7 +307,7 @@ class RESTUserWorkflow(RESTEntity):
                                         userdn=cherrypy.request.headers['Cms-Authn-Dn'])
 
     @restcall
-    def get(self, workflow, subresource, username, limit, shortformat, exitcode, jobids, verbose, timestamp):
+    def get(self, workflow, subresource, username, limit, shortformat, exitcode, jobids, verbose, jobsformat, timestamp):
         """Retrieves the workflow information, like a status summary, in case the workflow unique name is specified.
            Otherwise returns all workflows since (now - age) for which the user is the owner.
            The caller needs to be a valid CMS user.
@@ -299,6 +316,7 @@ class RESTUserWorkflow(RESTEntity):
            :arg str subresource: the specific workflow information to be accessed;
            :arg int limit: limit of return entries for some specific subresource;
            :arg int exitcode: exitcode for which the specific subresource is needed (eg log file of a job with that exitcode)
+           :arg str jobsformat: 'columnar' to get the jobs of the status in columnar format (see HTCondorTaskStatus.jobsToColumns)
            :retrun: workflow with the relative status summary in case of per user request; or
                     the requested subresource."""
         result = []
@@ -306,7 +324,7 @@ class RESTUserWorkflow(RESTEntity):
             userdn=cherrypy.request.headers['Cms-Authn-Dn']
             # if have the wf then retrieve the wf status summary
             if not subresource:
-                result = self.userworkflowmgr.status(workflow, verbose=verbose, userdn=userdn)
+                result = self.userworkflowmgr.status(workflow, verbose=verbose, userdn=userdn, jobsformat=jobsformat)
             # if have a subresource then it should be one of these
             elif subresource == 'logs':
                 result = self.userworkflowmgr.logs(workflow, limit, exitcode, jobids, userdn=userdn)
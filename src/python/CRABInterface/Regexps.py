@@ -51,8 +51,11 @@ RX_CERT = re.compile(r'^[-]{5}BEGIN CERTIFICATE[-]{5}[\w\W]+[-]{5}END CERTIFICAT
 #subresourced of DataUserWorkflow (/workflow) resource
 RX_SUBRESTAT = re.compile(r"^errors|report|logs|data$")
 
+#representation of the jobs in the status
+RX_JOBSFORMAT = re.compile(r"^(default|columnar)$")
+
 #subresources of the ServerInfo (/info) and Task (/task) resources
-RX_SUBRES_SI = re.compile(r"^delegatedn|backendurls|version|bannedoutdest|scheddaddress|ignlocalityblacklist|$")
+RX_SUBRES_SI = re.compile(r"^delegatedn|backendurls|version|bannedoutdest|scheddaddress|ignlocalityblacklist|statistics|$")
 RX_SUBRES_TASK = re.compile(r"^allinfo|allusers|summary|search|taskbystatus$")
 
 #worker workflow
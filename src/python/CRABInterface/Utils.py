@@ -1,5 +1,13 @@
 import logging
 import os
+import sys
+import time
+import calendar
+import bisect
+import subprocess
+import select
+import errno
+import types
 from collections import namedtuple
 from time import mktime, gmtime
 import re
@@ -23,7 +31,7 @@ from CRABInterface.Regexps import RX_CERT
 The module contains some utility functions used by the various modules of the CRAB REST interface
 """
 
-CMSSitesCache = namedtuple("CMSSitesCache", ["cachetime", "sites"])
+CMSSitesCache = namedtuple("CMSSitesCache", ["cachetime", "sites", "index"])
 ConfigCache = namedtuple("ConfigCache", ["cachetime", "centralconfig"])
 
 #These parameters are set in the globalinit (called in RESTBaseAPI)
@@ -31,6 +39,32 @@ serverCert = None
 serverKey = None
 serverDN = None
 credServerPath = None
+extConfigUrl = None
+extConfigMode = None
+
+#Longest wait of an operation for the throttle of its user, and most operations
+#of a user waiting at once (see UserThrottle)
+THROTTLE_MAX_WAIT = 5
+THROTTLE_MAX_QUEUE = 3
+
+#Refresh period of the SiteDB site list and of the central configuration, and
+#delay before retrying a failed refresh (see RefreshAheadCache)
+SITEDB_REFRESH = 1800
+CENTRALCONFIG_REFRESH = 1800
+REFRESH_RETRY = 60
+
+#Throttles and caches of this process, by name, whose counters are served by the
+#'statistics' subresource of RESTServerInfo (see monitored)
+monitored_objects = {}
+
+def monitored(name, obj):
+    """Register 'obj', with a statistics() method returning its counters, under 'name'; returns obj."""
+    monitored_objects[name] = obj
+    return obj
+
+def getStatistics():
+    """The counters of the monitored throttles and caches, by name."""
+    return dict([(name, obj.statistics()) for name, obj in monitored_objects.items()])
 
 def getDBinstance(config, namespace, name):
     if config.backend.lower() == 'mysql':
@@ -43,14 +77,27 @@ def getDBinstance(config, namespace, name):
 
     return factory.loadObject( name )
 
-def globalinit(serverkey, servercert, serverdn, credpath):
-    global serverCert, serverKey, serverDN, credServerPath
+def globalinit(serverkey, servercert, serverdn, credpath, extconfigurl=None, mode=None):
+    global serverCert, serverKey, serverDN, credServerPath, extConfigUrl, extConfigMode
     serverCert, serverKey, serverDN, credServerPath = servercert, serverkey, serverdn, credpath
+    extConfigUrl, extConfigMode = extconfigurl, mode
 
-def execute_command(command, logger, timeout):
+#Seconds execute_command waits for a command to exit after SIGTERM before
+#killing it, and bytes of its stdout and of its stderr it keeps
+KILL_GRACE = 5
+MAX_OUTPUT = 10 * 1024 * 1024
+
+def execute_command(command, logger, timeout, maxoutput=MAX_OUTPUT):
     """
     _execute_command_
     Funtion to manage commands.
+
+    The output pipes of the command are waited on with poll, so the call
+    returns as soon as the command is done. After 'timeout' seconds (if set)
+    the command is terminated, and killed if it is still running KILL_GRACE
+    seconds later; (None, 99999) is returned in that case. Only the first
+    'maxoutput' bytes of stdout and of stderr are kept; the rest is read and
+    discarded so that the command never blocks on a full pipe.
     """
 
     stdout, stderr, rc = None, None, 99999
@@ -59,29 +106,96 @@ def execute_command(command, logger, timeout):
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             stdin=subprocess.PIPE,
+            close_fds=True,
     )
-
-    t_beginning = time.time()
-    seconds_passed = 0
-    while True:
-        if proc.poll() is not None:
-            break
-        seconds_passed = time.time() - t_beginning
-        if timeout and seconds_passed > timeout:
-            proc.terminate()
-            logger.error('Timeout in %s execution.' % command )
-            return stdout, rc
-
-        time.sleep(0.1)
-
-    stdout, stderr = proc.communicate()
+    proc.stdin.close()
+
+    deadline = None
+    if timeout:
+        deadline = time.time() + timeout
+    outfd, errfd = proc.stdout.fileno(), proc.stderr.fileno()
+    outputs = {outfd: [], errfd: []}
+    sizes = {outfd: 0, errfd: 0}
+    poller = select.poll()
+    for fd in outputs:
+        poller.register(fd, select.POLLIN)
+    timedout = False
+    try:
+        open_fds = len(outputs)
+        while open_fds:
+            wait = None
+            if deadline is not None:
+                wait = max(0, int((deadline - time.time()) * 1000))
+            try:
+                events = poller.poll(wait)
+            except select.error, se:
+                if se.args[0] == errno.EINTR:
+                    continue
+                raise
+            if deadline is not None and time.time() >= deadline:
+                timedout = True
+                break
+            for fd, _ in events:
+                data = os.read(fd, 65536)
+                if not data:
+                    poller.unregister(fd)
+                    open_fds -= 1
+                    continue
+                if sizes[fd] < maxoutput:
+                    outputs[fd].append(data[:maxoutput - sizes[fd]])
+                sizes[fd] += len(data)
+        # The pipes are closed, so the command is exiting; unless it closed
+        # them itself and goes on running, which still honours the timeout.
+        pause = 0.001
+        while not timedout and proc.poll() is None:
+            if deadline is not None and time.time() >= deadline:
+                timedout = True
+                break
+            time.sleep(pause)
+            pause = min(pause * 2, 0.1)
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+
+    if timedout:
+        killProcess(proc, KILL_GRACE)
+        logger.error('Timeout in %s execution.' % command )
+        return stdout, rc
+
+    stdout, stderr = ''.join(outputs[outfd]), ''.join(outputs[errfd])
     rc = proc.returncode
+    for name, fd in [('stdout', outfd), ('stderr', errfd)]:
+        if sizes[fd] > maxoutput:
+            logger.warning('The %s of %s was truncated from %d to %d bytes.' % (name, command, sizes[fd], maxoutput))
 
     logger.debug('Executing : \n command : %s\n output : %s\n error: %s\n retcode : %s' % (command, stdout, stderr, rc))
 
     return stdout, rc
 
 
+def killProcess(proc, grace):
+    """
+    Terminate the process 'proc', and kill it if it did not exit after
+    'grace' seconds.
+    """
+    try:
+        proc.terminate()
+    except OSError:
+        return
+    end = time.time() + grace
+    pause = 0.001
+    while proc.poll() is None:
+        if time.time() >= end:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+            proc.wait()
+            return
+        time.sleep(pause)
+        pause = min(pause * 2, 0.1)
+
+
 def getCentralConfig(extconfigurl, mode):
     """Utility to retrieve the central configuration to be used for dynamic variables
 
@@ -118,14 +232,14 @@ def conn_handler(services):
     """
     def wrap(func):
         def wrapped_func(*args, **kwargs):
-            if 'sitedb' in services and (not args[0].allCMSNames.sites or (args[0].allCMSNames.cachetime+1800 < mktime(gmtime()))):
-                args[0].allCMSNames = CMSSitesCache(sites=SiteDBJSON(config={'cert': serverCert, 'key': serverKey}).getAllCMSNames(), cachetime=mktime(gmtime()))
+            if 'sitedb' in services:
+                args[0].allCMSNames = cms_sites_cache.get()
             if 'phedex' in services and not args[0].phedex:
                 phdict = args[0].phedexargs
                 phdict.update({'cert': serverCert, 'key': serverKey})
                 args[0].phedex = PhEDEx(responseType='xml', dict=phdict)
-            if 'centralconfig' in services and (not args[0].centralcfg.centralconfig or (args[0].centralcfg.cachetime+1800 < mktime(gmtime()))):
-                args[0].centralcfg = ConfigCache(centralconfig=getCentralConfig(extconfigurl=args[0].config.extconfigurl, mode=args[0].config.mode), cachetime=mktime(gmtime()))
+            if 'centralconfig' in services:
+                args[0].centralcfg = central_config_cache.get()
             if 'servercert' in services:
                 args[0].serverCert = serverCert
                 args[0].serverKey = serverKey
@@ -133,71 +247,441 @@ def conn_handler(services):
         return wrapped_func
     return wrap
 
+class ThrottleError(ExecutionError):
+    """
+    A request exceeded the throttle of its user; 'retryAfter' is the number of
+    seconds after which the request should be retried.
+    """
+    http_code = 503
+
+    def __init__(self, message, retryAfter):
+        ExecutionError.__init__(self, message)
+        self.retryAfter = retryAfter
+
 class _ThrottleCounter(object):
 
-    def __init__(self, throttle, user):
+    def __init__(self, throttle, user, weight=1, endpoint=None):
         self.throttle = throttle
         self.user = user
+        self.weight = weight
+        self.endpoint = endpoint
 
     def __enter__(self):
-        ctr = self.throttle._incUser(self.user)
-        #self.throttle.logger.debug("Entering throttled function with counter %d for user %s" % (ctr, self.user))
-        if ctr >= self.throttle.getLimit():
-            self.throttle._decUser(self.user)
-            raise ExecutionError("The current number of active operations for this resource exceeds the limit of %d for user %s" % (self.throttle.getLimit(), self.user))
+        self.throttle._incUser(self.user, self.weight, self.endpoint)
 
     def __exit__(self, type, value, traceback):
-        ctr = self.throttle._decUser(self.user)
-        #self.throttle.logger.debug("Exiting throttled function with counter %d for user %s" % (ctr, self.user))
+        self.throttle._decUser(self.user, self.weight, self.endpoint)
 
 class UserThrottle(object):
+    """
+    Limits the operations run concurrently by each user: an operation takes
+    'weight' of the 'limit' units of its user (an operation heavier than the
+    limit takes the whole limit). When the user has no units left, the
+    operation waits up to 'maxwait' seconds for other operations of the user
+    to finish; at most 'maxqueue' operations of a user wait at once. The
+    waiting operations of a user start in their order of arrival, and a new
+    operation does not start while others of its user wait. An
+    operation that cannot start raises ThrottleError, with a retry delay
+    estimated from the average duration of the operations of its endpoint.
+    Nested throttled calls in one thread only count once. The generators
+    returned by throttled functions are consumed into lists before the
+    throttle is released, so their work is limited (and timed) as well.
+
+    The counters admitted, queued, rejected and waittime (seconds spent
+    waiting, in total) describe the activity of the throttle; statistics()
+    returns them with the units in use and the operations waiting.
+    """
 
-    def __init__(self, limit=3):
+    def __init__(self, limit=3, maxwait=THROTTLE_MAX_WAIT, maxqueue=THROTTLE_MAX_QUEUE):
         self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
         self.tls = threading.local()
         self.users = {}
+        self.waiting = {}
+        self.durations = {}
         self.limit = limit
+        self.maxwait = maxwait
+        self.maxqueue = maxqueue
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.waittime = 0
         self.logger = logging.getLogger("CRABLogger.Utils.UserThrottle")
 
     def getLimit(self):
         return self.limit
 
-    def throttleContext(self, user):
-        self.users.setdefault(user, 0)
-        return _ThrottleCounter(self, user)
+    def throttleContext(self, user, weight=1, endpoint=None):
+        return _ThrottleCounter(self, user, weight, endpoint)
 
-    def make_throttled(self):
+    def make_throttled(self, weight=1):
         def throttled_decorator(fn):
             def throttled_wrapped_function(*args, **kw):
                 username = cherrypy.request.user['login']
-                with self.throttleContext(username):
-                    return fn(*args, **kw)
+                try:
+                    with self.throttleContext(username, weight, fn.__name__):
+                        result = fn(*args, **kw)
+                        if isinstance(result, types.GeneratorType):
+                            # A generator only does its work when iterated: do it under the throttle.
+                            result = list(result)
+                        return result
+                except ThrottleError, te:
+                    cherrypy.response.headers['Retry-After'] = str(te.retryAfter)
+                    raise
             return throttled_wrapped_function
         return throttled_decorator
 
-    def _incUser(self, user):
-        retval = 0
+    def retryAfter(self, endpoint):
+        """Seconds after which an operation of 'endpoint' should be retried; the lock must be held."""
+        return max(1, int(self.durations.get(endpoint, 1) + 0.5))
+
+    def _incUser(self, user, weight=1, endpoint=None):
+        weight = min(weight, self.limit)
         with self.lock:
-            retval = self.users[user]
             if getattr(self.tls, 'count', None) == None:
                 self.tls.count = 0
-            self.tls.count += 1
-            if self.tls.count == 1:
-                self.users[user] = retval + 1
-        return retval
-
-    def _decUser(self, user):
-        retval = 0
+            if self.tls.count:
+                self.tls.count += 1
+                return
+            # Nobody overtakes the operations already waiting, even if its weight fits.
+            if self.waiting.get(user) or self.users.get(user, 0) + weight > self.limit:
+                if len(self.waiting.get(user, [])) >= self.maxqueue or not self.maxwait:
+                    self._reject(user, endpoint)
+                self._wait(user, weight, endpoint)
+            self.users[user] = self.users.get(user, 0) + weight
+            self.admitted += 1
+            self.tls.count = 1
+            self.tls.start = time.time()
+
+    def _wait(self, user, weight, endpoint):
+        """
+        Wait in the queue of the user until the operation is first in line and
+        its weight fits, raising ThrottleError after maxwait seconds; the lock
+        must be held.
+        """
+        ticket = object()
+        queue = self.waiting.setdefault(user, [])
+        queue.append(ticket)
+        self.queued += 1
+        start = time.time()
+        end = start + self.maxwait
+        try:
+            while queue[0] is not ticket or self.users.get(user, 0) + weight > self.limit:
+                if time.time() >= end:
+                    self._reject(user, endpoint)
+                self.released.wait(end - time.time())
+        finally:
+            queue.remove(ticket)
+            if not queue:
+                del self.waiting[user]
+            self.waittime += time.time() - start
+            # The next operation in line may fit now.
+            self.released.notify_all()
+
+    def _reject(self, user, endpoint):
+        """Raise the ThrottleError of an operation that cannot start; the lock must be held."""
+        self.rejected += 1
+        raise ThrottleError("The current number of active operations for this resource exceeds the limit of %d for user %s" % (self.limit, user),
+                            self.retryAfter(endpoint))
+
+    def _decUser(self, user, weight=1, endpoint=None):
+        weight = min(weight, self.limit)
         with self.lock:
-            retval = self.users[user]
             self.tls.count -= 1
-            if self.tls.count == 0:
-                self.users[user] = retval - 1
-        return retval
+            if self.tls.count:
+                return
+            self.users[user] -= weight
+            if not self.users[user]:
+                del self.users[user]
+            # Moving average of the duration of the operations of the endpoint.
+            duration = time.time() - self.tls.start
+            self.durations[endpoint] = 0.8 * self.durations.get(endpoint, duration) + 0.2 * duration
+            self.released.notify_all()
+
+    def statistics(self):
+        with self.lock:
+            return {'admitted': self.admitted, 'queued': self.queued, 'rejected': self.rejected,
+                    'waittime': self.waittime, 'running': sum(self.users.values()),
+                    'waiting': sum([len(queue) for queue in self.waiting.values()])}
+
+global_user_throttle = monitored("user throttle", UserThrottle())
+
+
+class _Flight(object):
+    """One computation in progress in a SingleFlightCache."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.excinfo = None
+        self.invalidated = False
+
+class SingleFlightCache(object):
+    """
+    Thread-safe cache of computed values, each kept for a given time to live
+    (or for ttl(value) seconds if ttl is callable). Only one thread computes a
+    missing or expired key at a time: concurrent requests for the same key
+    wait for that computation and share its result (or its exception).
+    Exceptions are not cached. invalidate(key) also applies to a computation
+    of the key in progress: its result is not stored, and later requests
+    compute the key again instead of waiting for it.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flights = {}
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, ttl):
+        with self.lock:
+            entry = self.values.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            flight = self.flights.get(key)
+            owner = flight is None
+            if owner:
+                self.misses += 1
+                flight = _Flight()
+                self.flights[key] = flight
+        if not owner:
+            flight.event.wait()
+            if flight.excinfo:
+                raise flight.excinfo[0], flight.excinfo[1], flight.excinfo[2]
+            return flight.value
+        try:
+            try:
+                flight.value = compute()
+            except:
+                flight.excinfo = sys.exc_info()
+                raise
+            if callable(ttl):
+                ttl = ttl(flight.value)
+            with self.lock:
+                if not flight.invalidated:
+                    self._prune()
+                    self.values[key] = (time.time() + ttl, flight.value)
+            return flight.value
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.event.set()
+
+    def invalidate(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+            flight = self.flights.pop(key, None)
+            if flight:
+                flight.invalidated = True
 
-global_user_throttle = UserThrottle()
+    def statistics(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.values)}
+
+    def _prune(self):
+        """Drop the expired entries once the cache is full; the lock must be held."""
+        if len(self.values) < self.maxsize:
+            return
+        now = time.time()
+        for key, entry in self.values.items():
+            if entry[0] <= now:
+                del self.values[key]
+        if len(self.values) >= self.maxsize:
+            self.values.clear()
+
+class RefreshAheadCache(object):
+    """
+    Process-wide copy of a value fetched from an upstream service, shared by
+    all the REST entities and request threads.
+
+    get() returns the current value without waiting for the upstream. Once the
+    value is older than 'refresh' seconds, the first get() starts a background
+    thread to fetch it again; there is only one such fetch at a time. If the
+    fetch fails, the old value keeps being returned and the fetch is retried
+    'retry' seconds later. Only the callers arriving before the first value
+    was ever fetched wait for it (and get its exception if it fails); use
+    prefetch() at startup to fetch it in the background beforehand.
+    """
+
+    def __init__(self, name, fetch, refresh, retry=REFRESH_RETRY):
+        self.name = name
+        self.fetch = fetch
+        self.refresh = refresh
+        self.retry = retry
+        self.lock = threading.Lock()
+        self.value = None
+        self.fetched = None
+        self.nextFetch = 0
+        self.flight = None
+        self.fetches = 0
+        self.failures = 0
+
+    def get(self):
+        with self.lock:
+            flight = self._startFetch()
+            if self.fetched is not None:
+                return self.value
+            if flight is None:
+                flight = self.flight
+        flight.event.wait()
+        if flight.excinfo:
+            raise flight.excinfo[0], flight.excinfo[1], flight.excinfo[2]
+        return flight.value
+
+    def prefetch(self):
+        with self.lock:
+            self._startFetch()
+
+    def statistics(self):
+        with self.lock:
+            age = None
+            if self.fetched is not None:
+                age = time.time() - self.fetched
+            return {'fetches': self.fetches, 'failures': self.failures, 'age': age}
+
+    def _startFetch(self):
+        """
+        Start the background fetch if it is due (always if there is no value
+        yet) and not already running; the lock must be held. Returns the new
+        flight, if any.
+        """
+        if self.flight is not None:
+            return None
+        if self.fetched is not None and time.time() < self.nextFetch:
+            return None
+        self.flight = _Flight()
+        thread = threading.Thread(target=self._fetch, args=(self.flight,), name="refresh %s" % self.name)
+        thread.setDaemon(True)
+        thread.start()
+        return self.flight
+
+    def _fetch(self, flight):
+        try:
+            try:
+                flight.value = self.fetch()
+            except:
+                flight.excinfo = sys.exc_info()
+                logging.getLogger("CRABLogger.Utils").exception("Failed to refresh the %s" % self.name)
+                with self.lock:
+                    self.failures += 1
+                    self.nextFetch = time.time() + self.retry
+            else:
+                with self.lock:
+                    self.fetches += 1
+                    self.value = flight.value
+                    self.fetched = time.time()
+                    self.nextFetch = self.fetched + self.refresh
+        finally:
+            with self.lock:
+                self.flight = None
+            flight.event.set()
+
+
+#Site wildcards made of literal characters and '*' only
+RX_SITE_PATTERN = re.compile(r'^[A-Za-z0-9_*-]*$')
+
+class SiteIndex(object):
+    """
+    Index of the CMS site names for the validation of the site white and black
+    lists, built once per refresh of the site list: membership is a set lookup,
+    and the sites matching a wildcard are found by bisecting the sorted names
+    on the part of the wildcard before the first '*'. For the T2_US_* form
+    accepted by RX_CMSSITE no regular expression is evaluated at all.
+
+    expand(pattern) returns the sites matched from their beginning by the
+    regular expression pattern.replace('*', '.*'), i.e. as re.match; the
+    expansions are kept (up to MAX_EXPANSIONS) for the lifetime of the index.
+    """
+
+    MAX_EXPANSIONS = 1000
+
+    def __init__(self, sites):
+        self.names = sorted(set(map(str, sites)))
+        self.members = set(self.names)
+        self.expansions = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, site):
+        return site in self.members
+
+    def expand(self, pattern):
+        with self.lock:
+            expanded = self.expansions.get(pattern)
+        if expanded is None:
+            prefix = pattern.split('*')[0]
+            if not RX_SITE_PATTERN.match(pattern):
+                # Other regular expression syntax: no usable literal prefix.
+                expanded = filter(re.compile(pattern.replace('*', '.*')).match, self.names)
+            elif pattern == prefix + '*':
+                expanded = self._withPrefix(prefix)
+            else:
+                expanded = filter(re.compile(pattern.replace('*', '.*')).match, self._withPrefix(prefix))
+            with self.lock:
+                if len(self.expansions) >= self.MAX_EXPANSIONS:
+                    self.expansions.clear()
+                self.expansions[pattern] = expanded
+        return list(expanded)
+
+    def _withPrefix(self, prefix):
+        return self.names[bisect.bisect_left(self.names, prefix):bisect.bisect_left(self.names, prefix + '\xff')]
+
+def fetchCMSSites():
+    sites = SiteDBJSON(config={'cert': serverCert, 'key': serverKey}).getAllCMSNames()
+    return CMSSitesCache(sites=sites, index=SiteIndex(sites), cachetime=mktime(gmtime()))
+
+def fetchCentralConfig():
+    return ConfigCache(centralconfig=getCentralConfig(extconfigurl=extConfigUrl, mode=extConfigMode), cachetime=mktime(gmtime()))
+
+cms_sites_cache = monitored("SiteDB site list", RefreshAheadCache("SiteDB site list", fetchCMSSites, SITEDB_REFRESH))
+central_config_cache = monitored("central configuration", RefreshAheadCache("central configuration", fetchCentralConfig, CENTRALCONFIG_REFRESH))
+
+# Proxies retrieved from MyProxy, by user DN, kept until USER_PROXY_MIN_TIME_LEFT
+# seconds before they expire (at most USER_PROXY_CACHE_TIME seconds); see retrieveUserCert.
+USER_PROXY_CACHE_TIME = 12 * 3600
+USER_PROXY_MIN_TIME_LEFT = 3600
+user_proxy_cache = monitored("user proxies", SingleFlightCache())
+
+def proxyTimeLeft(proxy):
+    """
+    Seconds before the proxy certificate (the first certificate of the PEM
+    string 'proxy') expires, or None if it cannot be read.
+    """
+    try:
+        proc = subprocess.Popen(['openssl', 'x509', '-noout', '-enddate'], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = proc.communicate(proxy)
+        if proc.returncode != 0 or not stdout.startswith('notAfter='):
+            return None
+        notafter = calendar.timegm(time.strptime(stdout.strip()[len('notAfter='):], '%b %d %H:%M:%S %Y %Z'))
+    except (OSError, ValueError):
+        return None
+    return notafter - time.time()
+
+def userProxyCacheTime(proxy):
+    """
+    How long a retrieved proxy can be reused: until USER_PROXY_MIN_TIME_LEFT
+    seconds before it expires, and at most USER_PROXY_CACHE_TIME seconds. A
+    proxy whose lifetime cannot be read is not reused.
+    """
+    timeleft = proxyTimeLeft(proxy)
+    if timeleft is None:
+        logging.getLogger("CRABLogger.Utils").warning("Cannot read the lifetime of a retrieved proxy; not caching it")
+        return 0
+    return max(0, min(USER_PROXY_CACHE_TIME, timeleft - USER_PROXY_MIN_TIME_LEFT))
 
 def retrieveUserCert(func):
+    """
+    Pass the proxy of the user 'userdn' to 'func' as 'userproxy', retrieved
+    from MyProxy. The proxy is kept in memory only (it is never written to
+    disk) and reused for the following requests of the user while it has
+    enough lifetime left (see userProxyCacheTime); concurrent requests of a
+    user share one MyProxy logon. The user_proxy_cache hits and misses count
+    the reused proxies and the logons.
+    """
     def wrapped_func(*args, **kwargs):
         logger = logging.getLogger("CRABLogger.Utils")
         myproxyserver = "myproxy.cern.ch"
@@ -207,27 +691,30 @@ def retrieveUserCert(func):
                              'min_time_left' : 36000,
                              'server_key': serverKey,
                              'server_cert': serverCert,}
-        timeleftthreshold = 60 * 60 * 24
-        mypclient = SimpleMyProxy(defaultDelegation)
         userproxy = None
         userhash  = sha1(kwargs['userdn']).hexdigest()
         if serverDN:
-            try:
-                userproxy = mypclient.logonRenewMyProxy(username=userhash, myproxyserver=myproxyserver, myproxyport=7512)
-            except MyProxyException, me:
-                # Unsure if this works in standalone mode...
-                cherrypy.log(str(me))
-                cherrypy.log(str(serverKey))
-                cherrypy.log(str(serverCert))
-                invalidp = InvalidParameter("Impossible to retrieve proxy from %s for %s and hash %s" %
-                                                (myproxyserver, kwargs['userdn'], userhash))
-                setattr(invalidp, 'trace', str(me))
-                raise invalidp
-
-            else:
-                if not re.match(RX_CERT, userproxy):
-                    raise InvalidParameter("Retrieved malformed proxy from %s for %s and hash %s" %
-                                                (myproxyserver, kwargs['userdn'], userhash))
+            def logon():
+                mypclient = SimpleMyProxy(defaultDelegation)
+                start = time.time()
+                try:
+                    userproxy = mypclient.logonRenewMyProxy(username=userhash, myproxyserver=myproxyserver, myproxyport=7512)
+                except MyProxyException, me:
+                    # Unsure if this works in standalone mode...
+                    cherrypy.log(str(me))
+                    cherrypy.log(str(serverKey))
+                    cherrypy.log(str(serverCert))
+                    invalidp = InvalidParameter("Impossible to retrieve proxy from %s for %s and hash %s" %
+                                                    (myproxyserver, kwargs['userdn'], userhash))
+                    setattr(invalidp, 'trace', str(me))
+                    raise invalidp
+                else:
+                    if not re.match(RX_CERT, userproxy):
+                        raise InvalidParameter("Retrieved malformed proxy from %s for %s and hash %s" %
+                                                    (myproxyserver, kwargs['userdn'], userhash))
+                logger.debug("Retrieved the proxy of %s from %s in %.2f seconds" % (userdn, myproxyserver, time.time() - start))
+                return userproxy
+            userproxy = user_proxy_cache.get(userdn, logon, userProxyCacheTime)
         else:
             proxy = Proxy(defaultDelegation)
             userproxy = proxy.getProxyFilename()
@@ -47,7 +47,15 @@ class Create(DBCreator):
               fmd_creation_time TIMESTAMP NOT NULL,
               fmd_filestate VARCHAR(20),
               fmd_direct_stageout VARCHAR(1),
+              fmd_lumis LONGTEXT,
               CONSTRAINT pk_tasklfn PRIMARY KEY(tm_taskname, fmd_lfn),
               CONSTRAINT fk_tm_taskname FOREIGN KEY (tm_taskname) REFERENCES tasks (tm_taskname)
             )ENGINE=InnoDB
         """
+        # Used by the file listings of a task, by job id and by creation time
+        self.create['c_filemetadata_jobid_idx'] = """
+            CREATE INDEX fmd_taskname_jobid_idx ON filemetadata (tm_taskname, panda_job_id)
+        """
+        self.create['c_filemetadata_time_idx'] = """
+            CREATE INDEX fmd_taskname_time_idx ON filemetadata (tm_taskname, fmd_creation_time)
+        """
@@ -5,7 +5,7 @@ import logging
 class GetFromTaskAndType():
     """ Used for indexing columns retrieved by the GetFromTaskAndType_sql query
     """
-    PANDAID, OUTDS, ACQERA, SWVER, INEVENTS, GLOBALTAG, PUBLISHNAME, LOCATION, TMPLOCATION, RUNLUMI, ADLER32, CKSUM, MD5, LFN, SIZE, PARENTS, STATE = range(17)
+    PANDAID, OUTDS, ACQERA, SWVER, INEVENTS, GLOBALTAG, PUBLISHNAME, LOCATION, TMPLOCATION, RUNLUMI, ADLER32, CKSUM, MD5, LFN, SIZE, PARENTS, STATE, CREATED, LUMIS = range(19)
 
 class FileMetaData(object):
     """
@@ -31,20 +31,81 @@ class FileMetaData(object):
                            fmd_size AS filesize, \
                            fmd_parent AS parents, \
                            fmd_filestate AS state, \
-                           fmd_creation_time AS created \
+                           fmd_creation_time AS created, \
+                           fmd_lumis AS lumis \
                     FROM filemetadata \
                     WHERE tm_taskname = :taskname \
                     AND fmd_type IN (SELECT REGEXP_SUBSTR(:filetype, '[^,]+', 1, LEVEL) FROM DUAL CONNECT BY LEVEL <= REGEXP_COUNT(:filetype, ',') + 1) \
                     ORDER BY fmd_creation_time DESC
              """
 
+    # Same as GetFromTaskAndType_sql, for the jobs in :jobids (comma separated,
+    # at most 4000 characters); uses the (tm_taskname, panda_job_id) index.
+    GetFromTaskAndTypeJobs_sql = """SELECT panda_job_id AS pandajobid, \
+                           fmd_outdataset AS outdataset, \
+                           fmd_acq_era AS acquisitionera, \
+                           fmd_sw_ver AS swversion, \
+                           fmd_in_events AS inevents, \
+                           fmd_global_tag AS globaltag, \
+                           fmd_publish_name AS publishname, \
+                           fmd_location AS location, \
+                           fmd_tmp_location AS tmplocation, \
+                           fmd_runlumi AS runlumi, \
+                           fmd_adler32 AS adler32, \
+                           fmd_cksum AS cksum, \
+                           fmd_md5 AS md5, \
+                           fmd_lfn AS lfn, \
+                           fmd_size AS filesize, \
+                           fmd_parent AS parents, \
+                           fmd_filestate AS state, \
+                           fmd_creation_time AS created, \
+                           fmd_lumis AS lumis \
+                    FROM filemetadata \
+                    WHERE tm_taskname = :taskname \
+                    AND panda_job_id IN (SELECT TO_NUMBER(REGEXP_SUBSTR(:jobids, '[^,]+', 1, LEVEL)) FROM DUAL CONNECT BY LEVEL <= REGEXP_COUNT(:jobids, ',') + 1) \
+                    AND fmd_type IN (SELECT REGEXP_SUBSTR(:filetype, '[^,]+', 1, LEVEL) FROM DUAL CONNECT BY LEVEL <= REGEXP_COUNT(:filetype, ',') + 1) \
+                    ORDER BY fmd_creation_time DESC, fmd_lfn
+             """
+
+    # One page of GetFromTaskAndType_sql: the next :limit files after the one
+    # created at :lasttime ('YYYY-MM-DD HH24:MI:SS.FF') with LFN :lastlfn, in
+    # (creation time descending, LFN) order; uses the (tm_taskname,
+    # fmd_creation_time) index.
+    GetFromTaskAndTypePage_sql = """SELECT * FROM (SELECT panda_job_id AS pandajobid, \
+                           fmd_outdataset AS outdataset, \
+                           fmd_acq_era AS acquisitionera, \
+                           fmd_sw_ver AS swversion, \
+                           fmd_in_events AS inevents, \
+                           fmd_global_tag AS globaltag, \
+                           fmd_publish_name AS publishname, \
+                           fmd_location AS location, \
+                           fmd_tmp_location AS tmplocation, \
+                           fmd_runlumi AS runlumi, \
+                           fmd_adler32 AS adler32, \
+                           fmd_cksum AS cksum, \
+                           fmd_md5 AS md5, \
+                           fmd_lfn AS lfn, \
+                           fmd_size AS filesize, \
+                           fmd_parent AS parents, \
+                           fmd_filestate AS state, \
+                           fmd_creation_time AS created, \
+                           fmd_lumis AS lumis \
+                    FROM filemetadata \
+                    WHERE tm_taskname = :taskname \
+                    AND fmd_type IN (SELECT REGEXP_SUBSTR(:filetype, '[^,]+', 1, LEVEL) FROM DUAL CONNECT BY LEVEL <= REGEXP_COUNT(:filetype, ',') + 1) \
+                    AND (fmd_creation_time < TO_TIMESTAMP(:lasttime, 'YYYY-MM-DD HH24:MI:SS.FF') \
+                         OR (fmd_creation_time = TO_TIMESTAMP(:lasttime, 'YYYY-MM-DD HH24:MI:SS.FF') AND fmd_lfn > :lastlfn)) \
+                    ORDER BY fmd_creation_time DESC, fmd_lfn) \
+                    WHERE ROWNUM <= :limit
+             """
+
     New_sql = "INSERT INTO filemetadata ( \
                tm_taskname, panda_job_id, fmd_outdataset, fmd_acq_era, fmd_sw_ver, fmd_in_events, fmd_global_tag,\
                fmd_publish_name, fmd_location, fmd_tmp_location, fmd_runlumi, fmd_adler32, fmd_cksum, fmd_md5, fmd_lfn, fmd_size,\
-               fmd_type, fmd_parent, fmd_creation_time, fmd_filestate, fmd_direct_stageout) \
+               fmd_type, fmd_parent, fmd_creation_time, fmd_filestate, fmd_direct_stageout, fmd_lumis) \
                VALUES (:taskname, :pandajobid, :outdatasetname, :acquisitionera, :appver, :events, :globalTag,\
                        :publishdataname, :outlocation, :outtmplocation, :runlumi, :checksumadler32, :checksumcksum, :checksummd5, :outlfn, :outsize,\
-                       :outtype, :inparentlfns, SYS_EXTRACT_UTC(SYSTIMESTAMP), :filestate, :directstageout)"
+                       :outtype, :inparentlfns, SYS_EXTRACT_UTC(SYSTIMESTAMP), :filestate, :directstageout, :lumis)"
 
     DeleteTaskFiles_sql = "DELETE FROM filemetadata WHERE tm_taskname = :taskname"
     DeleteFilesByTime_sql = "DELETE FROM filemetadata WHERE fmd_creation_time < sysdate - (:hours/24)"
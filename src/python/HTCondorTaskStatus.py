@@ -0,0 +1,561 @@
+"""
+Parsers of the files HTCondor and DAGMan keep for a task on the schedd: the
+job log, the node state file and the site ad.
+
+They turn the files into the per-node information (state, retries, sites,
+times, ...) reported by the status command. They are shared by the REST
+interface, which parses the copies of the files published in the task web
+directory, and by the schedd, which keeps a summary of the task status (see
+TaskWorker.Actions.TaskSummary).
+
+The module also has the columnar representation of the per-node information
+(see jobsToColumns), used by the status command on request, and the run
+representation of the node states (see statesToRuns), used by the default
+status.
+"""
+
+import re
+import time
+
+import classad
+
+import HTCondorUtils
+
+
+def copyNodeInfo(info):
+    """Copy of the information of one node, with its own copy of every list."""
+    result = {}
+    for key, value in info.items():
+        if isinstance(value, list):
+            value = list(value)
+        result[key] = value
+    return result
+
+
+# Per-node values with a special columnar representation (see jobsToColumns).
+CODED_VALUES = {'State': 'states'}
+CODED_LISTS = {'SiteHistory': 'sites', 'AvailableSites': 'sites'}
+TIME_LISTS = ['SubmitTimes', 'StartTimes', 'EndTimes']
+
+
+def compactNumber(value):
+    """Integral floats (most times and durations) as integers."""
+    if isinstance(value, float) and value == int(value):
+        return int(value)
+    return value
+
+
+def jobsToColumns(jobs):
+    """
+    Columnar representation of the per-node information of a task ('jobs',
+    from node id to the information of the node), much smaller and faster to
+    encode and decode than one object per node:
+
+      {"ids": [1, 2],
+       "names": {"states": ["finished", "running"], "sites": ["T2_US_Nebraska"]},
+       "timeBase": 1413790000,
+       "columns": {"State": [0, 1],
+                   "Retries": [1, 0],
+                   "SiteHistory": [[0, 0], [0]],
+                   "SubmitTimes": [[0, 4000], [120]],
+                   "WallDurations": [[3500, 3600], [300]], ...}}
+
+    Every column has one entry per node of 'ids', null if the node has no
+    such value. States and sites are indexes into 'names'. Times are
+    differences: the first one from 'timeBase', the next ones from the
+    previous time of the same list; an unknown time (-1) is null.
+    See columnsToJobs for the inverse.
+    """
+    ids = sorted(jobs, key=int)
+    infos = [jobs[nodeid] for nodeid in ids]
+    keys = set()
+    base = None
+    for info in infos:
+        keys.update(info)
+        for key in TIME_LISTS:
+            for value in info.get(key, ()):
+                if value >= 0 and (base is None or value < base):
+                    base = value
+    base = compactNumber(base or 0)
+    codes = {}
+    for name in CODED_VALUES.values() + CODED_LISTS.values():
+        codes[name] = {}
+
+    def deltas(times):
+        result = []
+        previous = base
+        for value in times:
+            if value < 0:
+                result.append(None)
+            else:
+                result.append(compactNumber(value - previous))
+                previous = value
+        return result
+
+    columns = {}
+    for key in keys:
+        column = []
+        if key in CODED_VALUES:
+            table = codes[CODED_VALUES[key]]
+            for info in infos:
+                value = info.get(key)
+                if value is not None:
+                    value = table.setdefault(value, len(table))
+                column.append(value)
+        elif key in CODED_LISTS:
+            table = codes[CODED_LISTS[key]]
+            for info in infos:
+                value = info.get(key)
+                if value is not None:
+                    value = [table.setdefault(i, len(table)) for i in value]
+                column.append(value)
+        elif key in TIME_LISTS:
+            for info in infos:
+                value = info.get(key)
+                if value is not None:
+                    value = deltas(value)
+                column.append(value)
+        else:
+            column = [info.get(key) for info in infos]
+        columns[key] = column
+    names = {}
+    for name, table in codes.items():
+        names[name] = [None] * len(table)
+        for value, index in table.items():
+            names[name][index] = value
+    return {'ids': [int(nodeid) for nodeid in ids],
+            'names': names,
+            'timeBase': base,
+            'columns': columns,
+           }
+
+
+def columnsToJobs(doc):
+    """
+    The per-node information from its columnar representation (the inverse
+    of jobsToColumns; integral times and durations come back as integers).
+    """
+    jobs = {}
+    for nodeid in doc['ids']:
+        jobs[str(nodeid)] = {}
+    names = doc['names']
+    base = doc['timeBase']
+    for key, column in doc['columns'].items():
+        for nodeid, value in zip(doc['ids'], column):
+            if value is None:
+                continue
+            if key in CODED_VALUES:
+                value = names[CODED_VALUES[key]][value]
+            elif key in CODED_LISTS:
+                value = [names[CODED_LISTS[key]][i] for i in value]
+            elif key in TIME_LISTS:
+                previous = base
+                times = []
+                for i in value:
+                    if i is None:
+                        times.append(-1)
+                    else:
+                        previous += i
+                        times.append(previous)
+                value = times
+            jobs[str(nodeid)][key] = value
+    return jobs
+
+
+def statesToRuns(states):
+    """
+    Run representation of the state of each node ('states', from node id to
+    state): the states of consecutive node ids are mostly the same, so the
+    size of the representation depends on how the states are spread rather
+    than on the number of nodes:
+
+      {"stateNames": ["finished", "running"],
+       "runs": [[1, 4000, 0], [4001, 1000, 1], [5001, 1, 0]]}
+
+    Each run is [first node id, number of nodes, index into stateNames].
+    See runsToStates for the inverse.
+    """
+    codes = {}
+    runs = []
+    for nodeid in sorted(states, key=int):
+        code = codes.setdefault(states[nodeid], len(codes))
+        nodeid = int(nodeid)
+        if runs and runs[-1][2] == code and runs[-1][0] + runs[-1][1] == nodeid:
+            runs[-1][1] += 1
+        else:
+            runs.append([nodeid, 1, code])
+    names = [None] * len(codes)
+    for name, code in codes.items():
+        names[code] = name
+    return {'stateNames': names, 'runs': runs}
+
+
+def runsToStates(doc):
+    """The per-node information, {node id: {'State': state}}, of the runs of statesToRuns."""
+    names = doc['stateNames']
+    nodes = {}
+    for first, count, code in doc['runs']:
+        state = names[code]
+        for nodeid in xrange(first, first + count):
+            nodes[str(nodeid)] = {'State': state}
+    return nodes
+
+
+class TaskStatusParser(object):
+    """
+    Mixin with the parsers of the task files; the class using it provides
+    a 'logger'.
+    """
+
+    cpu_re = re.compile(r"Usr \d+ (\d+):(\d+):(\d+), Sys \d+ (\d+):(\d+):(\d+)")
+    def insertCpu(self, event, info):
+        if 'TotalRemoteUsage' in event:
+            m = self.cpu_re.match(event['TotalRemoteUsage'])
+            if m:
+                g = [int(i) for i in m.groups()]
+                user = g[0]*3600 + g[1]*60 + g[2]
+                sys = g[3]*3600 + g[4]*60 + g[5]
+                info['TotalUserCpuTimeHistory'][-1] = user
+                info['TotalSysCpuTimeHistory'][-1] = sys
+        else:
+            if 'RemoteSysCpu' in event:
+                info['TotalSysCpuTimeHistory'][-1] = float(event['RemoteSysCpu'])
+            if 'RemoteUserCpu' in event:
+                info['TotalUserCpuTimeHistory'][-1] = float(event['RemoteUserCpu'])
+
+
+    def completeEventsLength(self, fp):
+        """
+        Return the length of the part of 'fp' made of complete job log events,
+        each of which ends with a '...' line.
+        """
+        fp.seek(0, 2)
+        size = fp.tell()
+        tail_size = 65536
+        while True:
+            start = max(size - tail_size, 0)
+            fp.seek(start)
+            tail = fp.read()
+            pos = tail.rfind("\n...\n")
+            if pos != -1:
+                return start + pos + 5
+            if start == 0:
+                return 0
+            tail_size *= 4
+
+
+    def parseJobLog(self, fp, nodes):
+        self.parseJobEvents(fp, nodes, {})
+        self.completeJobLog(nodes)
+
+
+    node_name_re = re.compile("DAG Node: Job(\d+)")
+    node_name2_re = re.compile("Job(\d+)")
+    def parseJobEvents(self, fp, nodes, node_map, skipBadEvents=False):
+        """
+        Update 'nodes' (the per-node information) and 'node_map' (from HTCondor
+        job id to node) with the events read from 'fp'.
+
+        An event that does not fit the events before it (e.g. an event of a
+        job whose SubmitEvent is missing) raises an exception, unless
+        'skipBadEvents' is set: it is then logged and skipped.
+        """
+        count = 0
+        for event in HTCondorUtils.readEvents(fp):
+            count += 1
+            try:
+                self.parseJobEvent(event, nodes, node_map)
+            except (KeyError, IndexError, ValueError, TypeError), ex:
+                if not skipBadEvents:
+                    raise
+                self.logger.warning("Skipping the %s of %s in the job log: %s: %s" % (event.get('MyType'),
+                                    event.get('EventTime'), ex.__class__.__name__, str(ex)))
+
+        self.logger.debug("There were %d events in the job log." % count)
+
+
+    def parseJobEvent(self, event, nodes, node_map):
+        """
+        Update 'nodes' and 'node_map' with one event of the job log.
+        """
+        eventtime = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
+        if event['MyType'] == 'SubmitEvent':
+            m = self.node_name_re.match(event['LogNotes'])
+            if m:
+                node = m.groups()[0]
+                proc = event['Cluster'], event['Proc']
+                info = nodes.setdefault(node, {'Retries': 0, 'Restarts': 0, 'SiteHistory': [], 'ResidentSetSize': [], 'SubmitTimes': [], 'StartTimes': [], 'EndTimes': [], 'TotalUserCpuTimeHistory': [], 'TotalSysCpuTimeHistory': [], 'WallDurations': [], 'JobIds': []})
+                info['State'] = 'idle'
+                info['JobIds'].append("%d.%d" % proc)
+                info['RecordedSite'] = False
+                info['SubmitTimes'].append(eventtime)
+                info['TotalUserCpuTimeHistory'].append(0)
+                info['TotalSysCpuTimeHistory'].append(0)
+                info['WallDurations'].append(0)
+                info['ResidentSetSize'].append(0)
+                info['Retries'] = len(info['SubmitTimes'])-1
+                node_map[proc] = node
+        elif event['MyType'] == 'ExecuteEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            nodes[node]['StartTimes'].append(eventtime)
+            nodes[node]['State'] = 'running'
+            nodes[node]['RecordedSite'] = False
+        elif event['MyType'] == 'JobTerminatedEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            nodes[node]['EndTimes'].append(eventtime)
+            nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
+            self.insertCpu(event, nodes[node])
+            if event['TerminatedNormally']:
+                if event['ReturnValue'] == 0:
+                        nodes[node]['State'] = 'transferring'
+                else:
+                        nodes[node]['State'] = 'cooloff'
+            else:
+                nodes[node]['State']  = 'cooloff'
+        elif event['MyType'] == 'PostScriptTerminatedEvent':
+            m = self.node_name2_re.match(event['DAGNodeName'])
+            if m:
+                node = m.groups()[0]
+                if event['TerminatedNormally']:
+                    if event['ReturnValue'] == 0:
+                        nodes[node]['State'] = 'finished'
+                    elif event['ReturnValue'] == 2:
+                        nodes[node]['State'] = 'failed'
+                    else:
+                        nodes[node]['State'] = 'cooloff'
+                else:
+                    nodes[node]['State']  = 'cooloff'
+        elif event['MyType'] == 'ShadowExceptionEvent' or event["MyType"] == "JobReconnectFailedEvent" or event['MyType'] == 'JobEvictedEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            if nodes[node]['State'] != 'idle':
+                nodes[node]['EndTimes'].append(eventtime)
+                if nodes[node]['WallDurations'] and nodes[node]['EndTimes'] and nodes[node]['StartTimes']:
+                    nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
+                nodes[node]['State'] = 'idle'
+                self.insertCpu(event, nodes[node])
+                nodes[node]['TotalUserCpuTimeHistory'].append(0)
+                nodes[node]['TotalSysCpuTimeHistory'].append(0)
+                nodes[node]['WallDurations'].append(0)
+                nodes[node]['ResidentSetSize'].append(0)
+                nodes[node]['SubmitTimes'].append(-1)
+                nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
+                nodes[node]['Restarts'] += 1
+        elif event['MyType'] == 'JobAbortedEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            if nodes[node]['State'] == "idle" or nodes[node]['State'] == "held":
+                nodes[node]['StartTimes'].append(-1)
+                if not nodes[node]['RecordedSite']:
+                    nodes[node]['SiteHistory'].append("Unknown")
+            nodes[node]['State'] = 'killed'
+            self.insertCpu(event, nodes[node])
+        elif event['MyType'] == 'JobHeldEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            if nodes[node]['State'] == 'running':
+                nodes[node]['EndTimes'].append(eventtime)
+                if nodes[node]['WallDurations'] and nodes[node]['EndTimes'] and nodes[node]['StartTimes']:
+                    nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
+                self.insertCpu(event, nodes[node])
+                nodes[node]['TotalUserCpuTimeHistory'].append(0)
+                nodes[node]['TotalSysCpuTimeHistory'].append(0)
+                nodes[node]['WallDurations'].append(0)
+                nodes[node]['ResidentSetSize'].append(0)
+                nodes[node]['SubmitTimes'].append(-1)
+                nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
+                nodes[node]['Restarts'] += 1
+            nodes[node]['State'] = 'held'
+        elif event['MyType'] == 'JobReleaseEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            nodes[node]['State'] = 'idle'
+        elif event['MyType'] == 'JobAdInformationEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            if (not nodes[node]['RecordedSite']) and ('JOBGLIDEIN_CMSSite' in event) and not event['JOBGLIDEIN_CMSSite'].startswith("$$"):
+                nodes[node]['SiteHistory'].append(event['JOBGLIDEIN_CMSSite'])
+                nodes[node]['RecordedSite'] = True
+            self.insertCpu(event, nodes[node])
+        elif event['MyType'] == 'JobImageSizeEvent':
+            node = node_map[event['Cluster'], event['Proc']]
+            nodes[node]['ResidentSetSize'][-1] = int(event['ResidentSetSize'])
+            if nodes[node]['StartTimes']:
+                nodes[node]['WallDurations'][-1] = eventtime - nodes[node]['StartTimes'][-1]
+            self.insertCpu(event, nodes[node])
+        elif event["MyType"] == "JobDisconnectedEvent" or event["MyType"] == "JobReconnectedEvent":
+            # These events don't really affect the node status
+            pass
+        else:
+            self.logger.warning("Unknown event type: %s" % event['MyType'])
+
+
+    def completeJobLog(self, nodes):
+        """
+        Account for the attempts still running (or never recorded) once all the
+        job log events have been parsed.
+        """
+        now = time.time()
+        for node, info in nodes.items():
+            last_start = now
+            if info['StartTimes']:
+                last_start = info['StartTimes'][-1]
+            while len(info['WallDurations']) < len(info['SiteHistory']):
+                info['WallDurations'].append(now - last_start)
+            while len(info['WallDurations']) > len(info['SiteHistory']):
+                info['SiteHistory'].append("Unknown")
+
+
+    job_re = re.compile(r"JOB Job(\d+)\s+([A-Z_]+)\s+\((.*)\)")
+    post_failure_re = re.compile(r"POST [Ss]cript failed with status (\d+)")
+    def parseNodeState(self, fp, nodes):
+        self.applyNodeState(self.readNodeState(fp), nodes)
+
+
+    def readNodeState(self, fp):
+        """
+        Read the DAGMan node state file. Returns the format version and the list
+        of (node id, status, retry count, status details) of the job nodes.
+        """
+        first_char = fp.read(1)
+        fp.seek(0)
+        if first_char == "[":
+            return 2, self.readNodeStateV2(fp)
+        records = []
+        for line in fp.readlines():
+            m = self.job_re.match(line)
+            if not m:
+                continue
+            nodeid, status, msg = m.groups()
+            records.append((nodeid, status, -1, msg))
+        return 1, records
+
+
+    def applyNodeState(self, node_state, nodes):
+        version, records = node_state
+        if version == 2:
+            return self.applyNodeStateV2(records, nodes)
+        for nodeid, status, _, msg in records:
+            if status == "STATUS_READY":
+                info = nodes.setdefault(nodeid, {})
+                if info.get("State") == "transferring":
+                    info["State"] = "cooloff"
+                elif info.get('State') != "cooloff":
+                    info['State'] = 'unsubmitted'
+            elif status == "STATUS_PRERUN":
+                info = nodes.setdefault(nodeid, {})
+                info['State'] = 'cooloff'
+            elif status == 'STATUS_SUBMITTED':
+                info = nodes.setdefault(nodeid, {})
+                if msg == 'not_idle':
+                    info.setdefault('State', 'running')
+                else:
+                    info.setdefault('State', 'idle')
+            elif status == 'STATUS_POSTRUN':
+                info = nodes.setdefault(nodeid, {})
+                if info.get("State") != "cooloff":
+                    info['State'] = 'transferring'
+            elif status == 'STATUS_DONE':
+                info = nodes.setdefault(nodeid, {})
+                info['State'] = 'finished'
+            elif status == "STATUS_ERROR":
+                info = nodes.setdefault(nodeid, {})
+                m = self.post_failure_re.match(msg)
+                if m:
+                    if m.groups()[0] == '2':
+                        info['State'] = 'failed'
+                    else:
+                        info['State'] = 'cooloff'
+                else:
+                    info['State'] = 'failed'
+
+
+    def parseNodeStateV2(self, fp, nodes):
+        """
+        HTCondor 8.1.6 updated the node state file to be classad-based.
+        This is a more flexible format that allows future extensions but, unfortunately,
+        also requires a separate parser.
+        """
+        self.applyNodeStateV2(self.readNodeStateV2(fp), nodes)
+
+
+    def readNodeStateV2(self, fp):
+        records = []
+        for ad in classad.parseAds(fp):
+            if ad['Type'] != "NodeStatus":
+                continue
+            node = ad.get("Node", "")
+            if not node.startswith("Job"):
+                continue
+            records.append((node[3:], ad.get('NodeStatus', -1), ad.get('RetryCount', -1), ad.get("StatusDetails", "")))
+        return records
+
+
+    def applyNodeStateV2(self, records, nodes):
+        for nodeid, status, retry, msg in records:
+            if status == 1: # STATUS_READY
+                info = nodes.setdefault(nodeid, {})
+                if info.get("State") == "transferring":
+                    info["State"] = "cooloff"
+                elif info.get('State') != "cooloff":
+                    info['State'] = 'unsubmitted'
+            elif status == 2: # STATUS_PRERUN
+                info = nodes.setdefault(nodeid, {})
+                if retry == 0:
+                    info['State'] = 'unsubmitted'
+                else:
+                    info['State'] = 'cooloff'
+            elif status == 3: # STATUS_SUBMITTED
+                info = nodes.setdefault(nodeid, {})
+                if msg == 'not_idle':
+                    info.setdefault('State', 'running')
+                else:
+                    info.setdefault('State', 'idle')
+            elif status == 4: # STATUS_POSTRUN 
+                info = nodes.setdefault(nodeid, {})
+                if info.get("State") != "cooloff":
+                    info['State'] = 'transferring'
+            elif status == 5: # STATUS_DONE
+                info = nodes.setdefault(nodeid, {})
+                info['State'] = 'finished'
+            elif status == 6: # STATUS_ERROR
+                info = nodes.setdefault(nodeid, {})
+                # Older versions of HTCondor would put jobs into STATUS_ERROR
+                # for a short time if the job was to be retried.  Hence, we had
+                # some status parsing logic to try and guess whether the job would
+                # be tried again in the near future.  This behavior is no longer
+                # observed; STATUS_ERROR is terminal.
+                info['State'] = 'failed'
+
+
+    job_name_re = re.compile(r"Job(\d+)")
+    def parseSiteAd(self, fp, task_ad, nodes):
+        self.applySiteAd(self.readSiteAd(fp), task_ad, nodes)
+
+
+    def readSiteAd(self, fp):
+        """
+        Read the site ad into a dictionary from node id to its set of sites.
+        """
+        site_ad = classad.parse(fp)
+        site_info = {}
+        for key, val in site_ad.items():
+            m = self.job_name_re.match(key)
+            if not m:
+                continue
+            site_info[m.groups()[0]] = set(val.eval())
+        return site_info
+
+
+    def applySiteAd(self, site_info, task_ad, nodes):
+        blacklist = set(task_ad['CRAB_SiteBlacklist'])
+        whitelist = set(task_ad['CRAB_SiteWhitelist'])
+        if 'CRAB_SiteResubmitWhitelist' in task_ad:
+            whitelist.update(task_ad['CRAB_SiteResubmitWhitelist'])
+        if 'CRAB_SiteResubmitBlacklist' in task_ad:
+            blacklist.update(task_ad['CRAB_SiteResubmitBlacklist'])
+
+        for nodeid, val in site_info.items():
+            sites = set(val)
+            if whitelist:
+                sites &= whitelist
+            # Never blacklist something on the whitelist
+            sites -= (blacklist-whitelist)
+
+            info = nodes.setdefault(nodeid, {})
+            info['AvailableSites'] = list([i.eval() for i in sites])
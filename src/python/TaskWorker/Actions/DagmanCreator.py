@@ -81,6 +81,7 @@ CRAB_HEADERS = \
 +CRAB_TaskWorker = %(worker_name)s
 +CRAB_RetryOnASOFailures = %(retry_aso)s
 +CRAB_ASOTimeout = %(aso_timeout)s
++CRAB_StageoutParallel = %(stageout_parallel)s
 """
 
 JOB_SUBMIT = CRAB_HEADERS + \
@@ -216,7 +217,7 @@ def transform_strings(input):
         else:
             info[var] = json.dumps(val)
 
-    for var in 'savelogsflag', 'blacklistT1', 'retry_aso', 'aso_timeout', 'publication', 'saveoutput':
+    for var in 'savelogsflag', 'blacklistT1', 'retry_aso', 'aso_timeout', 'stageout_parallel', 'publication', 'saveoutput':
         info[var] = int(input[var])
 
     for var in 'siteblacklist', 'sitewhitelist', 'addoutputfiles', \
@@ -404,6 +405,7 @@ class DagmanCreator(TaskAction.TaskAction):
         info['worker_name'] = getattr(self.config.TaskWorker, 'name', 'unknown')
         info['retry_aso'] = 1 if getattr(self.config.TaskWorker, 'retryOnASOFailures', True) else 0
         info['aso_timeout'] = getattr(self.config.TaskWorker, 'ASOTimeout', 0)
+        info['stageout_parallel'] = getattr(self.config.TaskWorker, 'stageoutParallel', 1)
 
         self.populateGlideinMatching(info)
 
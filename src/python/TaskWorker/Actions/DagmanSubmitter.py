@@ -114,7 +114,8 @@ SUBMIT_INFO = [ \
             ("CRAB_MaxPost", "maxpost"),
             ("CRAB_TaskWorker", "worker_name"),
             ("CRAB_RetryOnASOFailures", "retry_aso"),
-            ("CRAB_ASOTimeout", "aso_timeout")]
+            ("CRAB_ASOTimeout", "aso_timeout"),
+            ("CRAB_StageoutParallel", "stageout_parallel")]
 
 def addCRABInfoToClassAd(ad, info):
     """
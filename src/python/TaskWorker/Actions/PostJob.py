@@ -67,6 +67,7 @@ from RESTInteractions import HTTPRequests
 from httplib import HTTPException
 import hashlib
 import TaskWorker.Actions.RetryJob as RetryJob
+import TaskWorker.Actions.TaskStatistics as TaskStatistics
 import pprint
 
 import DashboardAPI
@@ -1122,10 +1123,9 @@ class PostJob():
 
     def check_abort_dag(self, rval):
         """
-        Each fatal error is written into this file; we
-        count the number of failures and abort the DAG if necessary
+        Each fatal error is counted in the task statistics; we
+        check the number of failures and abort the DAG if necessary
         """
-        fname = "task_statistics.FATAL_ERROR"
         # Return code 3 is reserved to abort the entire DAG.  Don't let the
         # code otherwise use it.
         if rval == 3:
@@ -1134,10 +1134,7 @@ class PostJob():
             return rval
         try:
             limit = int(self.task_ad['CRAB_FailedNodeLimit'])
-            counter = 0
-            with open(fname, "r") as fd:
-                for line in fd.readlines():
-                    counter += 1
+            counter = TaskStatistics.get_count('FATAL_ERROR')
             if counter > limit:
                 logger.error("There are %d failed nodes, greater than the limit of %d. Will abort the whole DAG" % (counter, limit))
                 rval = 3
@@ -10,7 +10,11 @@ import re
 
 from ApmonIf import ApmonIf
 
-states = ['OK', 'FATAL_ERROR', 'RECOVERABLE_ERROR']
+import TaskWorker.Actions.TaskStatistics as TaskStatistics
+
+# Job deferral parameters used to implement the retry cooloff
+DEFERRAL_PREP_TIME = 60
+DEFERRAL_WINDOW = 14*24*60*60
 
 class PreJob:
 
@@ -105,31 +109,11 @@ class PreJob:
 
 
     def get_statistics(self):
-        results = {}
-        try:
-            for state in states:
-                count = 0
-                with open("task_statistics.%s" % state) as fd:
-                    for line in fd:
-                        count += 1
-                results[state] = count
-        except:
-            return {}
-        return results
+        return TaskStatistics.get_statistics()
 
 
     def get_site_statistics(self, site):
-        results = {}
-        try:
-            for state in states:
-                count = 0
-                with open("task_statistics.%s.%s" % (site, state)) as fd:
-                    for line in fd:
-                        count += 1
-                results[state] = count
-        except:
-            return {}
-        return results
+        return TaskStatistics.get_site_statistics(site)
 
 
     def calculate_blacklist(self):
@@ -138,8 +122,16 @@ class PreJob:
         return []
 
 
-    def alter_submit(self, retry, id):
+    def alter_submit(self, retry, id, cooloff=0):
         new_submit_text = '+CRAB_Retry = %d\n' % retry
+        if cooloff > 0:
+            # Rather than sleeping in the pre-job (which holds one of the DAGMan
+            # PRE script slots for the whole cooloff), let HTCondor defer the
+            # job start.  The job is not matched before the deferral time and
+            # must not go on hold if it stays idle for a while afterwards.
+            new_submit_text += 'deferral_time = %d\n' % (int(time.time()) + cooloff)
+            new_submit_text += 'deferral_prep_time = %d\n' % DEFERRAL_PREP_TIME
+            new_submit_text += 'deferral_window = %d\n' % DEFERRAL_WINDOW
         if 'JobPrio' in self.task_ad:
             if id <= 5:
                 self.task_ad['JobPrio'] += 10
@@ -154,18 +146,35 @@ class PreJob:
         if blacklist:
             self.task_ad['CRAB_SiteAutomaticBlacklist'] = blacklist
             new_submit_text += '+CRAB_SiteAutomaticBlacklist = %s\n' % str(self.task_ad.lookup('CRAB_SiteAutomaticBlacklist'))
-        with open("Job.submit", "r") as fd:
-            new_submit_text += fd.read()
 
         new_submit_text = self.redo_sites(new_submit_text, id, blacklist)
 
+        self.apply_submit_overlay(new_submit_text, id)
+
+
+    def apply_submit_overlay(self, overlay, id):
+        """
+        Write Job.<id>.submit as the per-job overlay (retry, sites, resource
+        overrides) followed by the shared Job.submit template.
+
+        AdjustSites hard links Job.<id>.submit to the template until the node is
+        submitted for the first time, so we must never write through the existing
+        file; write a temporary one and rename it into place instead.  The result
+        is a full copy of the template: condor_submit in the HTCondor versions we
+        support cannot include the template from the per-job file.
+        """
+        with open("Job.submit", "r") as fd:
+            base_submit_text = fd.read()
+
         asoauth = self.get_asoauth() #get the aso URL from the auth aso file if any
         if asoauth:
             #substitute the URL (matches everything preceeded bye 'CRAB_ASOURL = "' and followed by '"')
-            new_submit_text = re.sub(r'(?<=CRAB_ASOURL = ")(.*)(?=")', asoauth, new_submit_text)
+            base_submit_text = re.sub(r'(?<=CRAB_ASOURL = ")(.*)(?=")', asoauth, base_submit_text)
 
-        with open("Job.%d.submit" % id, "w") as fd:
-            fd.write(new_submit_text)
+        fname = "Job.%d.submit" % id
+        with open(fname + ".tmp", "w") as fd:
+            fd.write(overlay + base_submit_text)
+        os.rename(fname + ".tmp", fname)
 
 
     def redo_sites(self, new_submit_file, id, automatic_blacklist):
@@ -238,14 +247,14 @@ class PreJob:
         reqname = args[2]
         backend = args[3]
         self.get_task_ad()
-        self.alter_submit(retry_num, crab_id)
         old_time = self.touch_logs(retry_num, crab_id)
+        # Note the cooloff time is based on the number of times the post-job finished
+        # This way, we don't punish users for resubmitting.
         sleep_time = int(args[0])*60
         if old_time:
             sleep_time = int(max(1, sleep_time-old_time))
+        self.alter_submit(retry_num, crab_id, sleep_time)
         if retry_num != 0:
             self.update_dashboard(retry_num, crab_id, reqname, backend)
-        # Note the cooloff time is based on the number of times the post-job finished
-        # This way, we don't punish users for resubmitting.
-        os.execv("/bin/sleep", ["sleep", str(sleep_time)])
+        return 0
 
@@ -0,0 +1,95 @@
+"""
+Per-task job outcome counters, kept in the task directory on the schedd.
+
+RetryJob records the outcome of every job attempt, both for the whole task
+and for the site where the attempt ran; PreJob and PostJob read the counters
+(automatic blacklisting, failed node limit).  Previously each outcome was a
+line appended to a task_statistics.<site>.<state> file and readers counted
+lines, so the cost of every read grew with the history of the task.
+
+All the counters live in a single small JSON document:
+
+  {"total": {"OK": 10, "RECOVERABLE_ERROR": 2},
+   "sites": {"T2_US_Nebraska": {"OK": 6, "RECOVERABLE_ERROR": 2}, ...}}
+
+Writers serialize on a lock file and atomically rename the updated document
+into place; readers never lock and always see a complete document.
+Note AdjustSites clears the statistics by removing task_statistics.*; the
+lock file and the temporary files of the writers are named outside of that
+pattern, since a lock file removed while held would let two writers in at
+once, and a temporary file removed before its rename would fail the update.
+"""
+
+import os
+import json
+import fcntl
+
+STATES = ['OK', 'FATAL_ERROR', 'RECOVERABLE_ERROR']
+
+STATISTICS_FILE = "task_statistics.json"
+LOCK_FILE = "task_statistics_lock"
+TMP_FILE = ".task_statistics.json.%d.tmp"
+
+
+def load():
+    """
+    Return the whole counter document; empty if nothing was recorded yet.
+    A corrupted document is reported and read as empty.
+    """
+    try:
+        with open(STATISTICS_FILE, "r") as fd:
+            return json.load(fd)
+    except IOError:
+        return {}
+    except ValueError, ve:
+        print "ERROR: Corrupted task statistics in %s, resetting them: %s" % (STATISTICS_FILE, str(ve))
+        return {}
+
+
+def record(site, state):
+    """
+    Increment the task-wide and per-site counters for one job outcome.
+    A corrupted document is replaced by one with only this outcome, so that
+    the outcomes are counted again from then on.
+    """
+    site = str(site)
+    lock_fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        statistics = load()
+        total = statistics.setdefault('total', {})
+        total[state] = total.get(state, 0) + 1
+        site_counts = statistics.setdefault('sites', {}).setdefault(site, {})
+        site_counts[state] = site_counts.get(state, 0) + 1
+        tmp_fname = TMP_FILE % os.getpid()
+        with open(tmp_fname, "w") as fd:
+            json.dump(statistics, fd)
+        os.rename(tmp_fname, STATISTICS_FILE)
+    finally:
+        # Closing the descriptor releases the lock.
+        os.close(lock_fd)
+
+
+def _complete(counts):
+    """
+    A state only shows up once it has been recorded; as with the old per-state
+    files, report nothing until every state has been seen at least once.
+    """
+    results = {}
+    for state in STATES:
+        if state not in counts:
+            return {}
+        results[state] = counts[state]
+    return results
+
+
+def get_statistics():
+    return _complete(load().get('total', {}))
+
+
+def get_site_statistics(site):
+    return _complete(load().get('sites', {}).get(str(site), {}))
+
+
+def get_count(state):
+    return load().get('total', {}).get(state, 0)
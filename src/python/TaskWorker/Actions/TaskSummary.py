@@ -0,0 +1,294 @@
+"""
+Compact summary of the task status, kept up to date on the schedd.
+
+Building the status of a task means parsing the whole job log and node state
+of the task; the cost grows with the number of jobs and with their history.
+Instead of doing this for every status request, an updater runs next to
+DAGMan for the lifetime of the DAG: every UPDATE_INTERVAL seconds (the period
+of the DAGMan node state file), if the job log or the node state changed,
+it parses what was appended to the job log since the previous update and
+rewrites status_summary.json, which is published in the task web directory:
+
+  {"version": 1, "updated": 1413801327,
+   "stateNames": ["finished", "running"],
+   "siteNames": ["T2_US_Nebraska", "T2_CH_CERN"],
+   "jobs": {"ids": [1, 2, 3],
+            "State": [0, 1, 1],
+            "Retries": [0, 1, 0],
+            "Restarts": [0, 0, 0],
+            "Site": [0, 1, -1],
+            "WallTime": [3600, 5400, 0],
+            "CpuTime": [3400, 4000, 0],
+            "MaxRSS": [800000, 1200000, 0],
+            "SubmitTime": [1413790000, 1413791000, 0]},
+   "jobsPerStatus": {"finished": 1, "running": 2},
+   "sites": {"T2_US_Nebraska": {"finished": 1}, "T2_CH_CERN": {"running": 1}},
+   "totals": {"WallTime": 9000, "CpuTime": 7400, "Retries": 1, "Restarts": 0}}
+
+The per-job information is stored by column, the states and sites as indexes
+into stateNames and siteNames (-1 for no site yet): the document is much
+smaller and faster to decode than one object per job. Per-job times and
+memory cover all the attempts of the job; the attempt still running counts
+up to the time of the update.
+
+Along with it, status_states.json has the state of every job as given by the
+node state alone, as the default (verbose 0) status reports it, in the run
+representation of HTCondorTaskStatus.statesToRuns:
+
+  {"version": 1, "updated": 1413801327,
+   "stateNames": ["finished", "running"],
+   "runs": [[1, 4000, 0], [4001, 1000, 1]]}
+
+Its size depends on how the states are spread over the jobs, not on the
+number of jobs. It is only written when the node state could be read.
+
+Both documents are rewritten at least every HEARTBEAT_INTERVAL seconds while
+the DAG runs, so readers can tell a stale document (the updater died) from a
+quiet task.
+
+The updater is started by dag_bootstrap_startup.sh with the process id of
+DAGMan and exits, after a last update, once DAGMan is gone.
+"""
+
+import os
+import json
+import time
+import errno
+import shutil
+import logging
+import tempfile
+
+from HTCondorTaskStatus import TaskStatusParser, copyNodeInfo, statesToRuns
+
+SUMMARY_FILE = "status_summary.json"
+STATES_FILE = "status_states.json"
+JOB_LOG = "job_log"
+NODE_STATE = "node_state"
+
+UPDATE_INTERVAL = 30
+HEARTBEAT_INTERVAL = 300
+
+
+COLUMNS = ['State', 'Site', 'Retries', 'Restarts', 'WallTime', 'CpuTime', 'MaxRSS', 'SubmitTime']
+
+
+def summarizeNode(info, now):
+    """
+    Per-job summary values of one node of the job log, accounting for the
+    attempts still running as completeJobLog does.
+    """
+    wall = sum(info['WallDurations'])
+    site = None
+    if info['SiteHistory']:
+        site = info['SiteHistory'][-1]
+    missing = len(info['SiteHistory']) - len(info['WallDurations'])
+    if missing > 0:
+        last_start = now
+        if info['StartTimes']:
+            last_start = info['StartTimes'][-1]
+        wall += missing * (now - last_start)
+    elif missing < 0:
+        site = "Unknown"
+    return {'Retries': info['Retries'],
+            'Restarts': info['Restarts'],
+            'Site': site,
+            'WallTime': int(wall),
+            'CpuTime': int(sum(info['TotalUserCpuTimeHistory']) + sum(info['TotalSysCpuTimeHistory'])),
+            'MaxRSS': max(info['ResidentSetSize'] or [0]),
+            'SubmitTime': int(info['SubmitTimes'][0]),
+           }
+
+
+def summarize(nodes, states, now):
+    """
+    Build the summary document of a task from the per-node information of the
+    job log ('nodes') and the state of every node ('states').
+    """
+    columns = {'ids': []}
+    for column in COLUMNS:
+        columns[column] = []
+    state_codes = {}
+    site_codes = {}
+    jobs_per_status = {}
+    sites = {}
+    totals = {'WallTime': 0, 'CpuTime': 0, 'Retries': 0, 'Restarts': 0}
+    empty = {'Retries': 0, 'Restarts': 0, 'Site': None, 'WallTime': 0, 'CpuTime': 0, 'MaxRSS': 0, 'SubmitTime': 0}
+    for nodeid in sorted(states, key=int):
+        state = states[nodeid]
+        summary = empty
+        if nodeid in nodes:
+            summary = summarizeNode(nodes[nodeid], now)
+        site = summary['Site']
+        if site is None:
+            site_code = -1
+        else:
+            site_code = site_codes.setdefault(site, len(site_codes))
+            site_counts = sites.setdefault(site, {})
+            site_counts[state] = site_counts.get(state, 0) + 1
+        columns['ids'].append(int(nodeid))
+        columns['State'].append(state_codes.setdefault(state, len(state_codes)))
+        columns['Site'].append(site_code)
+        for column in COLUMNS[2:]:
+            columns[column].append(summary[column])
+        jobs_per_status[state] = jobs_per_status.get(state, 0) + 1
+        for key in totals:
+            totals[key] += summary[key]
+    return {'version': 1,
+            'updated': int(now),
+            'stateNames': codeNames(state_codes),
+            'siteNames': codeNames(site_codes),
+            'jobs': columns,
+            'jobsPerStatus': jobs_per_status,
+            'sites': sites,
+            'totals': totals,
+           }
+
+
+def codeNames(codes):
+    names = [None] * len(codes)
+    for name, code in codes.items():
+        names[code] = name
+    return names
+
+
+class TaskSummary(TaskStatusParser):
+    """
+    Keeps the parse state of the job log between updates; only the events
+    appended since the previous update are parsed.
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger("TaskSummary")
+        self.offset = 0
+        self.nodes = {}
+        self.node_map = {}
+        self.inputs = None
+        self.written = 0
+
+
+    def fileInfo(self, fname):
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime
+
+
+    def updateJobLog(self):
+        """
+        Parse the events appended to the job log since the previous call.
+        """
+        try:
+            log_fd = open(JOB_LOG, "rb")
+        except IOError, ioe:
+            if ioe.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            log_fd.seek(0, 2)
+            if log_fd.tell() < self.offset:
+                self.logger.info("The job log got shorter; parsing it again")
+                self.offset = 0
+                self.nodes = {}
+                self.node_map = {}
+            log_fd.seek(self.offset)
+            # Only complete events are parsed; copy the new part of the log
+            # to find where the last one ends.
+            fp = tempfile.TemporaryFile()
+            shutil.copyfileobj(log_fd, fp)
+        finally:
+            log_fd.close()
+        complete = self.completeEventsLength(fp)
+        fp.truncate(complete)
+        fp.seek(0)
+        # The events are applied to copies, kept only with the new offset: if
+        # the parse fails, the same events are parsed again from the same
+        # state on the next update. Events which cannot be applied are logged
+        # and skipped, so that they do not block the summary.
+        nodes = dict([(node, copyNodeInfo(info)) for node, info in self.nodes.items()])
+        node_map = dict(self.node_map)
+        try:
+            self.parseJobEvents(fp, nodes, node_map, skipBadEvents=True)
+        finally:
+            fp.close()
+        self.nodes, self.node_map = nodes, node_map
+        self.offset += complete
+
+
+    def update(self, force=False):
+        """
+        Rewrite the summary if the job log or the node state changed since the
+        previous update (or if 'force' is set, or if the summary is due for
+        its heartbeat). Returns True if the summary was written.
+        """
+        inputs = [self.fileInfo(JOB_LOG), self.fileInfo(NODE_STATE)]
+        if not force and inputs == self.inputs and (time.time() - self.written) < HEARTBEAT_INTERVAL:
+            return False
+        if inputs != self.inputs:
+            self.updateJobLog()
+        # Only the state of the nodes is changed by the node state; the parse
+        # state of the job log must not be modified.
+        now = time.time()
+        node_state = None
+        try:
+            with open(NODE_STATE, "r") as fd:
+                node_state = self.readNodeState(fd)
+        except IOError, ioe:
+            if ioe.errno != errno.ENOENT:
+                raise
+        states = {}
+        for node, info in self.nodes.items():
+            states[node] = {'State': info['State']}
+        if node_state is not None:
+            self.applyNodeState(node_state, states)
+        for node, info in states.items():
+            states[node] = info.get('State', 'unsubmitted')
+        writeDocument(SUMMARY_FILE, summarize(self.nodes, states, now))
+        if node_state is not None:
+            node_states = {}
+            self.applyNodeState(node_state, node_states)
+            document = statesToRuns(dict([(node, info['State']) for node, info in node_states.items()]))
+            document.update({'version': 1, 'updated': int(now)})
+            writeDocument(STATES_FILE, document)
+        self.inputs = inputs
+        self.written = now
+        return True
+
+
+def writeDocument(fname, document):
+    """Atomically replace the JSON document 'fname'."""
+    tmp_fname = "%s.%d.tmp" % (fname, os.getpid())
+    with open(tmp_fname, "w") as fd:
+        json.dump(document, fd, separators=(',', ':'))
+    os.rename(tmp_fname, fname)
+
+
+def isRunning(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, ose:
+        return ose.errno == errno.EPERM
+    return True
+
+
+def run(dagman_pid):
+    """
+    Keep the summary up to date as long as the process 'dagman_pid' runs.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+    logger = logging.getLogger("TaskSummary")
+    dagman_pid = int(dagman_pid)
+    updater = TaskSummary(logger)
+    logger.info("Keeping %s up to date while process %d runs" % (SUMMARY_FILE, dagman_pid))
+    while True:
+        running = isRunning(dagman_pid)
+        try:
+            if updater.update(force=not running):
+                logger.info("Updated %s" % SUMMARY_FILE)
+        except Exception:
+            logger.exception("Failed to update %s" % SUMMARY_FILE)
+        if not running:
+            break
+        time.sleep(UPDATE_INTERVAL)
+    logger.info("Process %d is gone; exiting" % dagman_pid)
+    return 0
@@ -15,6 +15,7 @@ import TaskWorker.Actions.DagmanCreator as DagmanCreator
 import TaskWorker.Actions.PostJob as PostJob
 import TaskWorker.Actions.PreJob as PreJob
 import TaskWorker.Actions.Final as Final
+import TaskWorker.Actions.TaskSummary as TaskSummary
 import HTCondorUtils
 
 import WMCore.Configuration as Configuration
@@ -28,6 +29,8 @@ def bootstrap():
         return PreJob.PreJob().execute(*sys.argv[2:])
     elif command == "FINAL":
         return Final.Final().execute(*sys.argv[2:])
+    elif command == "SUMMARY":
+        return TaskSummary.run(*sys.argv[2:])
     elif command == "ASO":
         return ASO.async_stageout(*sys.argv[2:])
 
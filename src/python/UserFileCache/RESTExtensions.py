@@ -12,6 +12,11 @@ import tarfile
 import hashlib
 import cStringIO
 import cherrypy
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
 from os import fstat, walk, path, listdir
 
 # 100MB is the maximum allowed size of a single file
@@ -22,6 +27,11 @@ FILE_MEMORY_LIMIT = 512*1024
 QUOTA_USER_LIMIT = 1024*1024*600
 #these users have 10* basic user quota - overwritten in RESTBaseAPI if powerusers is set in the config
 POWER_USERS_LIST = []
+# the usage ledger of a user is checked against the files of the user after this many seconds
+# (files are also removed by the cache cleanup, outside of the server)
+LEDGER_RECONCILE_TIME = 3600
+# name of the usage ledger in the user directory; the lock and temporary files start with it too
+LEDGER_FILE = '.usage'
 
 ###### authz_login_valid is currently duplicatint CRABInterface.RESTExtension . A better solution
 ###### should be found for authz_*
@@ -52,7 +62,8 @@ def list_users(cachedir):
 def list_files(quotapath):
     for dirpath, dirnames, filenames in walk(quotapath):
         for f in filenames:
-            yield f
+            if not f.startswith(LEDGER_FILE):
+                yield f
 
 def get_size(quotapath):
     """Check the quotapath directory size; it doesn't include the 4096 bytes taken by each directory
@@ -62,18 +73,100 @@ def get_size(quotapath):
     totalsize = 0
     for dirpath, dirnames, filenames in walk(quotapath):
         for f in filenames:
+            if f.startswith(LEDGER_FILE):
+                continue
             fp = path.join(dirpath, f)
-            totalsize += path.getsize(fp)
+            try:
+                totalsize += path.getsize(fp)
+            except OSError:
+                # removed in the meantime, e.g. by the cache cleanup
+                pass
     return totalsize
 
-def quota_user_free(quotadir, infile):
+def _read_ledger(quotapath):
+    """Return the usage ledger of the user directory, or None if it is missing or unreadable"""
+    try:
+        with open(path.join(quotapath, LEDGER_FILE)) as fd:
+            ledger = json.load(fd)
+        int(ledger['size']), float(ledger['reconciled']), bool(ledger['dirty'])
+    except (IOError, ValueError, TypeError, KeyError):
+        return None
+    return ledger
+
+def _write_ledger(quotapath, ledger):
+    """Atomically replace the usage ledger of the user directory"""
+    tmpname = path.join(quotapath, '%s.%d.tmp' % (LEDGER_FILE, os.getpid()))
+    with open(tmpname, 'w') as fd:
+        json.dump(ledger, fd)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.rename(tmpname, path.join(quotapath, LEDGER_FILE))
+
+def _current_ledger(quotapath):
+    """Return the usage ledger, reconciled with the files of the user if it is missing,
+       unreadable, older than LEDGER_RECONCILE_TIME or left dirty by an interrupted update.
+       The ledger lock must be held."""
+    ledger = _read_ledger(quotapath)
+    if ledger is None or ledger['dirty'] or time.time() - ledger['reconciled'] > LEDGER_RECONCILE_TIME:
+        ledger = {'size': get_size(quotapath), 'reconciled': time.time(), 'dirty': False}
+        _write_ledger(quotapath, ledger)
+    return ledger
+
+@contextmanager
+def _ledger_lock(quotapath):
+    """Hold the lock of the usage ledger; it excludes the other threads and processes"""
+    lockfd = open(path.join(quotapath, LEDGER_FILE + '.lock'), 'a')
+    try:
+        fcntl.flock(lockfd, fcntl.LOCK_EX)
+        yield
+    finally:
+        lockfd.close()
+
+def get_usage(quotapath):
+    """Return the bytes used by the user from the usage ledger, instead of walking the
+       user directory like get_size (the ledger is reconciled with it when needed).
+
+    :arg str quotapath: the user directory
+    :return: bytes taken by the files of the user"""
+    if not path.isdir(quotapath):
+        return 0
+    with _ledger_lock(quotapath):
+        return _current_ledger(quotapath)['size']
+
+@contextmanager
+def usage_update(quotapath, check=None):
+    """Change the files of the user directory and account for it in the usage ledger.
+
+       The body of the with statement runs with the ledger lock held, gets the ledger
+       and adds the bytes it writes (or subtracts the bytes it removes) to ledger['size'].
+       The ledger is marked dirty until the body completes: if the body fails, or the
+       process dies, the next reader reconciles the ledger with the files.
+
+    :arg str quotapath: the user directory
+    :arg check: function called with the bytes used by the user before anything is
+                changed, e.g. to check the quota; the ledger is left clean if it raises"""
+    if not path.isdir(quotapath):
+        os.makedirs(quotapath)
+    with _ledger_lock(quotapath):
+        ledger = _current_ledger(quotapath)
+        if check:
+            check(ledger['size'])
+        ledger['dirty'] = True
+        _write_ledger(quotapath, ledger)
+        yield ledger
+        ledger['dirty'] = False
+        _write_ledger(quotapath, ledger)
+
+def quota_user_free(quotadir, infile, quota=None):
     """Raise an exception if the input file overflow the user quota
 
     :arg str quotadir: the user path where the file will be written
     :arg file|cStringIO.StringIO infile: file object handler or cStringIO.StringIO
+    :arg int quota: the bytes used by the user, if already known
     :return: Nothing"""
     filesize, realfile = file_size(infile.file)
-    quota = get_size(quotadir)
+    if quota is None:
+        quota = get_usage(quotadir)
     quotaLimit = QUOTA_USER_LIMIT*10 if cherrypy.request.user['login'] in POWER_USERS_LIST else QUOTA_USER_LIMIT
     if filesize + quota > quotaLimit:
          excquota = ValueError("User %s has reached quota of %dB: additional file of %dB cannot be uploaded." \
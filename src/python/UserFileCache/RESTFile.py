@@ -6,7 +6,7 @@ from WMCore.REST.Format import RawFormat
 
 # CRABServer dependecies here
 from UserFileCache.__init__ import __version__
-from UserFileCache.RESTExtensions import ChecksumFailed, validate_file, validate_tarfile, authz_login_valid, quota_user_free, get_size, list_files, list_users
+from UserFileCache.RESTExtensions import ChecksumFailed, validate_file, validate_tarfile, authz_login_valid, quota_user_free, get_usage, usage_update, list_files, list_users
 
 # external dependecies here
 import cherrypy
@@ -81,15 +81,17 @@ class RESTFile(RESTEntity):
            result['size'] = os.path.getsize(outfilename)
         else:
             # check that the user quota is still below limit
-            quota_user_free(filepath(self.cachedir), inputfile)
-
-            if not os.path.isdir(outfilepath):
-                os.makedirs(outfilepath)
-            handlefile = open(outfilename,'wb')
-            inputfile.file.seek(0)
-            shutil.copyfileobj(inputfile.file, handlefile)
-            handlefile.close()
-            result['size'] = os.path.getsize(outfilename)
+            quotacheck = lambda used: quota_user_free(filepath(self.cachedir), inputfile, used)
+            with usage_update(filepath(self.cachedir), quotacheck) as ledger:
+                oldsize = os.path.getsize(outfilename) if os.path.isfile(outfilename) else 0
+                if not os.path.isdir(outfilepath):
+                    os.makedirs(outfilepath)
+                handlefile = open(outfilename,'wb')
+                inputfile.file.seek(0)
+                shutil.copyfileobj(inputfile.file, handlefile)
+                handlefile.close()
+                result['size'] = os.path.getsize(outfilename)
+                ledger['size'] += result['size'] - oldsize
         return [result]
 
     @restcall(formats = [('application/octet-stream', RawFormat())])
@@ -212,10 +214,13 @@ class RESTInfo(RESTEntity):
         if not os.path.isfile(filename):
             raise MissingObject("Not such file")
 
-        try:
-            os.remove(filename)
-        except Exception, ex:
-            raise ExecutionError("Impossible to remove the file: %s" % str(ex))
+        with usage_update(infilepath) as ledger:
+            try:
+                size = os.path.getsize(filename)
+                os.remove(filename)
+            except Exception, ex:
+                raise ExecutionError("Impossible to remove the file: %s" % str(ex))
+            ledger['size'] -= size
 
     @restcall
     def userinfo(self, **kwargs):
@@ -235,7 +240,7 @@ class RESTInfo(RESTEntity):
                 files_dict[file_] = self.fileinfo(hashkey=file_,username=username)
 
         res["file_list"] = files_dict if kwargs['verbose'] else list(files)
-        res["used_space"] = [get_size(userpath)]
+        res["used_space"] = [get_usage(userpath)]
 
         yield res
 
@@ -245,7 +250,7 @@ class RESTInfo(RESTEntity):
         """Retrieves only the used space of the user"""
         username = kwargs["username"]
         userpath = filepath(self.cachedir, username)
-        yield get_size(userpath)
+        yield get_usage(userpath)
 
     @restcall
     def listusers(self, **kwargs):
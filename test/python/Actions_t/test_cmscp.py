@@ -0,0 +1,73 @@
+"""
+Tests of the stageouts of several files at once in scripts/cmscp.py, with a
+fake transferFile, against the one-by-one stageout.
+"""
+
+import os
+import imp
+import time
+import shutil
+import tempfile
+import unittest
+
+CMSCP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'scripts', 'cmscp.py')
+
+
+def fakeTransferFile(manager, stageout_policy, source_file, dest_temp_lfn, dest_pfn, dest_se):
+    """Takes 0.3 seconds; fails the files named 'fail*' and raises for 'crash*'."""
+    time.sleep(0.3)
+    if source_file.startswith('crash'):
+        raise RuntimeError("stageout plugin crashed")
+    result = 0
+    if source_file.startswith('fail'):
+        result = 60311
+    return {'result': result, 'SEName': 'T2_XX_Site', 'direct_stageout': False, 'attempts': [source_file]}
+
+
+def fakeRecordTransfer(outcome, dest_temp_lfn, dest_pfn, is_log, inject = True):
+    return outcome['result']
+
+
+class CmscpStageoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        # cmscp writes its sentry file in the current directory when loaded.
+        os.chdir(self.tmpdir)
+        self.cmscp = imp.load_source('cmscp', CMSCP)
+        self.cmscp.transferFile = fakeTransferFile
+        self.cmscp.recordTransfer = fakeRecordTransfer
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def transfers(self, names):
+        return [{'source_file': name, 'stageout_policy': ['local'], 'dest_temp_lfn': '/store/temp/' + name,
+                 'dest_pfn': 'srm://site/' + name, 'is_log': False, 'inject': True} for name in names]
+
+    def testStageoutParallelDefault(self):
+        self.assertEqual(self.cmscp.maxParallelStageouts, 1)
+        self.assertEqual(self.cmscp.getStageoutParallel('3'), 3)
+        for value in ['0', '-2', 'undefined', '"3"']:
+            self.assertEqual(self.cmscp.getStageoutParallel(value), 1)
+
+    def testParallelMatchesSerial(self):
+        transfers = self.transfers(['out1.root', 'fail2.root', 'out3.root', 'crash4.root', 'cmsRun.log.tar.gz'])
+        start = time.time()
+        serial = self.cmscp.performTransfers(None, transfers, 'T2_XX_Site', 1)
+        serialTime = time.time() - start
+        start = time.time()
+        parallel = self.cmscp.performTransfers(None, transfers, 'T2_XX_Site', 3)
+        parallelTime = time.time() - start
+        self.assertEqual(serial, [0, 60311, 0, 60318, 0])
+        self.assertEqual(parallel, serial)
+        self.assertTrue(serialTime >= 1.5)
+        self.assertTrue(parallelTime < 1.0)
+        # The logs of the children are removed once printed.
+        self.assertEqual([name for name in os.listdir('.') if name.startswith('cmscp_')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
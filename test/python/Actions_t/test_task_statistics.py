@@ -0,0 +1,108 @@
+"""
+Tests of TaskWorker.Actions.TaskStatistics: concurrent writers against the
+line files the counters replaced, corrupted documents and the clearing done
+by AdjustSites.
+"""
+
+import os
+import glob
+import random
+import shutil
+import tempfile
+import unittest
+
+import TaskWorker.Actions.TaskStatistics as TaskStatistics
+
+SITES = ['T2_US_Nebraska', 'T2_CH_CERN', 'T1_DE_KIT', 'T3_US_FNALLPC']
+
+
+def recordOldStyle(site, state, count):
+    """What RetryJob.record_site wrote before the counters."""
+    for fname in ["task_statistics.%s.%s" % (site, state), "task_statistics.%s" % state]:
+        with os.fdopen(os.open(fname, os.O_APPEND | os.O_CREAT | os.O_RDWR, 0644), "a") as fd:
+            fd.write("%s\n" % count)
+
+
+def countLines(fname):
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as fd:
+        return len(fd.readlines())
+
+
+def oldStatistics(prefix):
+    """What PreJob.get_statistics/get_site_statistics returned before the counters."""
+    results = {}
+    for state in TaskStatistics.STATES:
+        count = countLines("%s%s" % (prefix, state))
+        if count is None:
+            return {}
+        results[state] = count
+    return results
+
+
+class TaskStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def testConcurrentWritersMatchLineFiles(self):
+        pids = []
+        for writer in range(16):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    rnd = random.Random(writer)
+                    for count in range(200):
+                        site, state = rnd.choice(SITES), rnd.choice(TaskStatistics.STATES)
+                        TaskStatistics.record(site, state)
+                        recordOldStyle(site, state, count)
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        self.assertEqual(TaskStatistics.get_statistics(), oldStatistics("task_statistics."))
+        self.assertEqual(sum(TaskStatistics.get_statistics().values()), 16 * 200)
+        for site in SITES:
+            self.assertEqual(TaskStatistics.get_site_statistics(site), oldStatistics("task_statistics.%s." % site))
+        self.assertEqual(TaskStatistics.get_count('FATAL_ERROR'), countLines("task_statistics.FATAL_ERROR"))
+
+    def testIncompleteStatistics(self):
+        TaskStatistics.record('T2_CH_CERN', 'OK')
+        TaskStatistics.record('T2_CH_CERN', 'FATAL_ERROR')
+        self.assertEqual(TaskStatistics.get_statistics(), {})
+        self.assertEqual(TaskStatistics.get_count('OK'), 1)
+        self.assertEqual(TaskStatistics.get_count('RECOVERABLE_ERROR'), 0)
+
+    def testCorruptedDocument(self):
+        TaskStatistics.record('T2_CH_CERN', 'OK')
+        with open(TaskStatistics.STATISTICS_FILE, "w") as fd:
+            fd.write('{"total": {"OK": 1')
+        self.assertEqual(TaskStatistics.load(), {})
+        # The document is reset and the outcomes are counted again.
+        TaskStatistics.record('T2_CH_CERN', 'OK')
+        TaskStatistics.record('T1_DE_KIT', 'FATAL_ERROR')
+        self.assertEqual(TaskStatistics.get_count('OK'), 1)
+        self.assertEqual(TaskStatistics.load()['sites'], {'T2_CH_CERN': {'OK': 1}, 'T1_DE_KIT': {'FATAL_ERROR': 1}})
+
+    def testClearKeepsLockAndTemporaryFiles(self):
+        TaskStatistics.record('T2_CH_CERN', 'OK')
+        tmp_fname = TaskStatistics.TMP_FILE % os.getpid()
+        open(tmp_fname, "w").close()
+        # As AdjustSites.clear_automatic_blacklist does.
+        for fname in glob.glob("task_statistics.*"):
+            os.unlink(fname)
+        self.assertTrue(os.path.exists(TaskStatistics.LOCK_FILE))
+        self.assertTrue(os.path.exists(tmp_fname))
+        self.assertEqual(TaskStatistics.load(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests of the job states document of TaskWorker.Actions.TaskSummary: the
+states must be those the REST interface gets from the node state alone.
+"""
+
+import os
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+from HTCondorTaskStatus import TaskStatusParser, statesToRuns, runsToStates
+from TaskWorker.Actions import TaskSummary
+
+NODE_STATUSES = [('STATUS_DONE', 'STATUS_DONE ()'), ('STATUS_SUBMITTED', 'STATUS_SUBMITTED (not_idle)'),
+                 ('STATUS_SUBMITTED', 'STATUS_SUBMITTED (idle)'), ('STATUS_READY', 'STATUS_READY ()'),
+                 ('STATUS_POSTRUN', 'STATUS_POSTRUN ()'), ('STATUS_ERROR', 'STATUS_ERROR (failed with exit 2)')]
+
+
+def writeNodeState(rnd, count):
+    """A node state file (version 1 format) of 'count' jobs, in blocks of the same status."""
+    lines = []
+    nodeid = 1
+    while nodeid <= count:
+        _, text = rnd.choice(NODE_STATUSES)
+        for _ in range(rnd.randint(1, 50)):
+            lines.append("JOB Job%d %s\n" % (nodeid, text))
+            nodeid += 1
+    rnd.shuffle(lines)
+    with open(TaskSummary.NODE_STATE, "w") as fd:
+        fd.writelines(lines)
+
+
+class TaskSummaryStatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.rnd = random.Random(4242)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def testStatesOfNodeState(self):
+        for count in [1, 10, 1000]:
+            writeNodeState(self.rnd, count)
+            self.assertTrue(TaskSummary.TaskSummary().update(force=True))
+            with open(TaskSummary.STATES_FILE) as fd:
+                document = json.load(fd)
+            self.assertEqual(document['version'], 1)
+            # As HTCondorDataWorkflow.taskWebStatus builds the states from node_state.txt.
+            expected = {}
+            with open(TaskSummary.NODE_STATE) as fd:
+                TaskStatusParser().parseNodeState(fd, expected)
+            self.assertEqual(runsToStates(document), expected)
+            self.assertTrue(len(document['runs']) < count / 10 + 2)
+
+    def testNoNodeState(self):
+        TaskSummary.TaskSummary().update(force=True)
+        self.assertFalse(os.path.exists(TaskSummary.STATES_FILE))
+
+    def testRuns(self):
+        for _ in range(200):
+            states = {}
+            for nodeid in self.rnd.sample(range(1, 300), self.rnd.randint(0, 100)):
+                states[str(nodeid)] = self.rnd.choice(['finished', 'running', 'idle'])
+            document = json.loads(json.dumps(statesToRuns(states)))
+            self.assertEqual(runsToStates(document), dict([(nodeid, {'State': state}) for nodeid, state in states.items()]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Randomized comparison of the lumi arithmetic of CRABInterface.LumiRanges
+with the same operations on explicit sets of (run, lumi) pairs.
+"""
+
+import random
+import unittest
+from ast import literal_eval
+
+from CRABInterface.LumiRanges import toRanges, compactLumis, expandLumis, formatLumis, listLumis, \
+                                     mergeRanges, unionLumis
+
+
+def randomLumis(rnd):
+    """Lumi numbers of a few runs, with duplicates, gaps and unsorted."""
+    runlumis = {}
+    for run in rnd.sample(range(1, 8), rnd.randint(0, 4)):
+        lumis = []
+        for _ in range(rnd.randint(0, 6)):
+            first = rnd.randint(1, 60)
+            lumis.extend(range(first, first + rnd.randint(0, 10)))
+        rnd.shuffle(lumis)
+        runlumis[str(run)] = lumis
+    return runlumis
+
+
+def toCompact(runlumis):
+    compact = {}
+    for run, lumis in runlumis.items():
+        if lumis:
+            compact[run] = toRanges(lumis)
+    return compact
+
+
+def toPairs(runlumis):
+    """The (run, lumi) pairs of lumi numbers by run."""
+    pairs = set()
+    for run, lumis in runlumis.items():
+        pairs.update([(str(run), int(lumi)) for lumi in lumis])
+    return pairs
+
+
+def compactToPairs(compact):
+    """The (run, lumi) pairs of compact ranges, checking that they are sorted, disjoint and not adjacent."""
+    pairs = set()
+    for run, ranges in compact.items():
+        assert ranges, "run %s has no lumis" % run
+        for i, (first, last) in enumerate(ranges):
+            assert first <= last, "bad range %s" % [first, last]
+            assert i == 0 or ranges[i - 1][1] + 1 < first, "ranges %s not merged" % ranges
+            pairs.update([(str(run), lumi) for lumi in range(first, last + 1)])
+    return pairs
+
+
+class LumiRangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rnd = random.Random(4242)
+
+    def testToRanges(self):
+        for _ in range(500):
+            runlumis = randomLumis(self.rnd)
+            self.assertEqual(compactToPairs(toCompact(runlumis)), toPairs(runlumis))
+            self.assertEqual(listLumis(toCompact(runlumis)),
+                             dict([(run, sorted(set(lumis))) for run, lumis in runlumis.items() if lumis]))
+
+    def testMergeRanges(self):
+        for _ in range(500):
+            lumis = randomLumis(self.rnd).get('1', [])
+            ranges = [[lumi, lumi + self.rnd.randint(0, 3)] for lumi in lumis]
+            self.assertEqual(mergeRanges(ranges), toRanges(sum([range(a, b + 1) for a, b in ranges], [])))
+
+    def testUnion(self):
+        for _ in range(1000):
+            runlumis1, runlumis2 = randomLumis(self.rnd), randomLumis(self.rnd)
+            union = unionLumis(toCompact(runlumis1), toCompact(runlumis2))
+            self.assertEqual(compactToPairs(union), toPairs(runlumis1) | toPairs(runlumis2))
+
+    def testUnionOfMany(self):
+        for _ in range(200):
+            runlumis = [randomLumis(self.rnd) for _ in range(self.rnd.randint(1, 5))]
+            union = unionLumis(*[toCompact(x) for x in runlumis])
+            self.assertEqual(compactToPairs(union), set().union(*[toPairs(x) for x in runlumis]))
+
+    def testStoredFormat(self):
+        for _ in range(200):
+            runlumis = randomLumis(self.rnd)
+            runs = [run for run in runlumis if runlumis[run]]
+            compact = compactLumis(runs, [','.join(map(str, runlumis[run])) for run in runs])
+            self.assertEqual(compact, toCompact(runlumis))
+            expanded = expandLumis(compact)
+            self.assertEqual(literal_eval(formatLumis(compact)), expanded)
+            for run in runs:
+                self.assertEqual(expanded[run], map(str, sorted(set(runlumis[run]))))
+
+
+if __name__ == '__main__':
+    unittest.main()
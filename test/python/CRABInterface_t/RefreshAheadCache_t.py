@@ -0,0 +1,97 @@
+"""
+Tests of CRABInterface.Utils.RefreshAheadCache against a fake upstream that
+answers slowly and fails on demand.
+"""
+
+import time
+import threading
+import unittest
+
+from CRABInterface.Utils import RefreshAheadCache
+
+
+class SlowUpstream(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.fail = False
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(self.latency)
+        if self.fail:
+            raise IOError("upstream unavailable")
+        return call
+
+
+def waitFor(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+class RefreshAheadCacheTest(unittest.TestCase):
+
+    def testFirstFetchIsShared(self):
+        upstream = SlowUpstream(0.2)
+        cache = RefreshAheadCache("test", upstream.fetch, refresh=60)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 10)
+        self.assertEqual(upstream.calls, 1)
+
+    def testRefreshDoesNotBlock(self):
+        upstream = SlowUpstream(0.5)
+        cache = RefreshAheadCache("test", upstream.fetch, refresh=0.1)
+        self.assertEqual(cache.get(), 1)
+        time.sleep(0.2)
+        start = time.time()
+        for _ in range(100):
+            self.assertEqual(cache.get(), 1)
+        self.assertTrue(time.time() - start < 0.1)
+        self.assertTrue(waitFor(lambda: cache.get() == 2))
+        self.assertEqual(upstream.calls, 2)
+
+    def testStaleWhileUpstreamFails(self):
+        upstream = SlowUpstream(0.05)
+        cache = RefreshAheadCache("test", upstream.fetch, refresh=0.1, retry=0.2)
+        self.assertEqual(cache.get(), 1)
+        upstream.fail = True
+        time.sleep(0.15)
+        self.assertEqual(cache.get(), 1)
+        self.assertTrue(waitFor(lambda: cache.failures == 1))
+        # Served stale, and not retried before 'retry' seconds.
+        self.assertEqual(cache.get(), 1)
+        self.assertEqual(upstream.calls, 2)
+        upstream.fail = False
+        self.assertTrue(waitFor(lambda: cache.get() == 3))
+
+    def testFirstFetchFailure(self):
+        upstream = SlowUpstream(0.05)
+        upstream.fail = True
+        cache = RefreshAheadCache("test", upstream.fetch, refresh=60, retry=60)
+        self.assertRaises(IOError, cache.get)
+        upstream.fail = False
+        # Without a value, the next call fetches again right away.
+        self.assertEqual(cache.get(), 2)
+
+    def testPrefetch(self):
+        upstream = SlowUpstream(0.2)
+        cache = RefreshAheadCache("test", upstream.fetch, refresh=60)
+        cache.prefetch()
+        self.assertTrue(waitFor(lambda: cache.fetches == 1))
+        start = time.time()
+        self.assertEqual(cache.get(), 1)
+        self.assertTrue(time.time() - start < 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
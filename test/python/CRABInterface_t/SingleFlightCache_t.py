@@ -0,0 +1,91 @@
+"""
+Tests of CRABInterface.Utils.SingleFlightCache, in particular of the
+invalidation of a key while it is being computed (as when a task is killed
+while its status is computed).
+"""
+
+import time
+import threading
+import unittest
+
+from CRABInterface.Utils import SingleFlightCache
+
+
+class Computation(object):
+    """Returns 'before' until released, then the number of calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            self.started.set()
+            self.release.wait(5)
+            return 'before'
+        return 'after %d' % call
+
+
+class SingleFlightCacheTest(unittest.TestCase):
+
+    def getInThread(self, cache, compute, results):
+        thread = threading.Thread(target=lambda: results.append(cache.get('key', compute, 60)))
+        thread.start()
+        return thread
+
+    def testConcurrentCallsShared(self):
+        cache = SingleFlightCache()
+        compute = Computation()
+        results = []
+        threads = [self.getInThread(cache, compute, results) for _ in range(5)]
+        compute.started.wait(5)
+        time.sleep(0.1)
+        compute.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['before'] * 5)
+        self.assertEqual(compute.calls, 1)
+        self.assertEqual(cache.get('key', compute, 60), 'before')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def testInvalidateDuringComputation(self):
+        cache = SingleFlightCache()
+        compute = Computation()
+        results = []
+        first = self.getInThread(cache, compute, results)
+        compute.started.wait(5)
+        cache.invalidate('key')
+        # Not waiting for the computation started before the invalidation.
+        self.assertEqual(cache.get('key', compute, 60), 'after 2')
+        compute.release.set()
+        first.join()
+        self.assertEqual(results, ['before'])
+        # The result computed before the invalidation was not stored.
+        self.assertEqual(cache.get('key', compute, 60), 'after 2')
+        self.assertEqual(compute.calls, 2)
+        self.assertEqual(cache.flights, {})
+
+    def testInvalidateBeforeNextComputation(self):
+        cache = SingleFlightCache()
+        compute = Computation()
+        compute.release.set()
+        self.assertEqual(cache.get('key', compute, 60), 'before')
+        cache.invalidate('key')
+        self.assertEqual(cache.get('key', compute, 60), 'after 2')
+        self.assertEqual(cache.get('key', compute, 60), 'after 2')
+
+    def testExceptionsNotCached(self):
+        cache = SingleFlightCache()
+        def fail():
+            raise IOError("schedd unavailable")
+        self.assertRaises(IOError, cache.get, 'key', fail, 60)
+        self.assertEqual(cache.get('key', lambda: 'ok', 60), 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
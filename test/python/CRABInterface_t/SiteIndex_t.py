@@ -0,0 +1,86 @@
+"""
+Randomized comparison of the wildcard expansion of CRABInterface.Utils.SiteIndex
+with the regular expression matching it replaced.
+"""
+
+import re
+import random
+import unittest
+
+from CRABInterface.Utils import SiteIndex
+
+COUNTRIES = ['US', 'CH', 'IT', 'DE', 'FR', 'UK', 'ES', 'RU', 'IN', 'BR']
+NAMES = ['Site', 'CERN', 'Lab', 'Uni', 'Grid', 'Disk', 'MSS', 'Buffer']
+
+
+def randomSites(rnd):
+    sites = set()
+    for _ in range(rnd.randint(0, 400)):
+        site = 'T%d_%s_%s' % (rnd.randint(0, 3), rnd.choice(COUNTRIES), rnd.choice(NAMES))
+        if rnd.random() < 0.5:
+            site += str(rnd.randint(0, 20))
+        if rnd.random() < 0.2:
+            site += '_' + rnd.choice(NAMES)
+        sites.add(site)
+    return list(sites)
+
+
+def randomPattern(rnd, sites):
+    """A wildcard: mostly the T2_US_* form, but also '*' anywhere and a few regular expression characters."""
+    if sites and rnd.random() < 0.5:
+        base = rnd.choice(sites)
+    else:
+        base = 'T%s_%s_%s' % (rnd.choice('0123'), rnd.choice(COUNTRIES), rnd.choice(NAMES))
+    base = base[:rnd.randint(0, len(base))]
+    kind = rnd.random()
+    if kind < 0.5:
+        return base + '*'
+    chars = list(base)
+    for _ in range(rnd.randint(1, 3)):
+        chars.insert(rnd.randint(0, len(chars)), rnd.choice(['*', '*', '*', '.', '?', '[0-9]', '1+']))
+    return ''.join(chars)
+
+
+def regexExpand(pattern, sites):
+    """The expansion RESTUserWorkflow._expandSites did before SiteIndex."""
+    sitere = re.compile(pattern.replace('*', '.*'))
+    return sorted(map(str, filter(sitere.match, sites)))
+
+
+class SiteIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rnd = random.Random(4242)
+
+    def testExpandMatchesRegex(self):
+        for _ in range(200):
+            sites = randomSites(self.rnd)
+            index = SiteIndex(sites)
+            for _ in range(100):
+                pattern = randomPattern(self.rnd, sites)
+                try:
+                    re.compile(pattern.replace('*', '.*'))
+                except re.error:
+                    # Invalid regular expressions were rejected before, and still are.
+                    self.assertRaises(re.error, index.expand, pattern)
+                    continue
+                self.assertEqual(sorted(index.expand(pattern)), regexExpand(pattern, sites), pattern)
+                # Memoized expansions give the same result.
+                self.assertEqual(sorted(index.expand(pattern)), regexExpand(pattern, sites), pattern)
+
+    def testMembership(self):
+        sites = randomSites(self.rnd)
+        index = SiteIndex(sites)
+        for site in sites:
+            self.assertTrue(site in index)
+        self.assertFalse('T2_XX_Nowhere' in index)
+        self.assertFalse('T2_XX_Nowhere' in SiteIndex([]))
+
+    def testMemoizedResultsAreCopies(self):
+        index = SiteIndex(['T2_US_Nebraska', 'T2_US_Purdue'])
+        index.expand('T2_US_*').append('T2_XX_Bogus')
+        self.assertEqual(index.expand('T2_US_*'), ['T2_US_Nebraska', 'T2_US_Purdue'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Tests of the proxy cache of CRABInterface.Utils.retrieveUserCert with a fake
+MyProxy client.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+from CRABInterface import Utils
+
+
+def makeCertificate(days):
+    """A self-signed PEM certificate valid for 'days' days."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        certfile = os.path.join(tmpdir, 'cert.pem')
+        subprocess.check_call(['openssl', 'req', '-x509', '-nodes', '-newkey', 'rsa:1024', '-days', str(days),
+                               '-subj', '/CN=test', '-keyout', os.path.join(tmpdir, 'key.pem'), '-out', certfile],
+                              stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        return open(certfile).read()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class FakeMyProxy(object):
+    """Stands for SimpleMyProxy; counts the logons."""
+    proxy = None
+    latency = 0
+    logons = 0
+    lock = threading.Lock()
+
+    def __init__(self, delegation):
+        pass
+
+    def logonRenewMyProxy(self, username, myproxyserver, myproxyport):
+        with FakeMyProxy.lock:
+            FakeMyProxy.logons += 1
+        time.sleep(FakeMyProxy.latency)
+        return FakeMyProxy.proxy
+
+
+@Utils.retrieveUserCert
+def getProxy(userdn, userproxy):
+    return userproxy
+
+
+class UserProxyCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.longProxy = makeCertificate(2)
+
+    def setUp(self):
+        self.saved = Utils.SimpleMyProxy, Utils.serverDN, Utils.USER_PROXY_MIN_TIME_LEFT
+        Utils.SimpleMyProxy = FakeMyProxy
+        Utils.serverDN = '/CN=server'
+        Utils.user_proxy_cache = Utils.SingleFlightCache()
+        FakeMyProxy.proxy = self.longProxy
+        FakeMyProxy.latency = 0
+        FakeMyProxy.logons = 0
+
+    def tearDown(self):
+        Utils.SimpleMyProxy, Utils.serverDN, Utils.USER_PROXY_MIN_TIME_LEFT = self.saved
+        Utils.user_proxy_cache = Utils.SingleFlightCache()
+
+    def testProxyTimeLeft(self):
+        self.assertTrue(abs(Utils.proxyTimeLeft(self.longProxy) - 2 * 86400) < 600)
+        self.assertEqual(Utils.proxyTimeLeft('not a certificate'), None)
+
+    def testReusedWhileValid(self):
+        for _ in range(10):
+            self.assertEqual(getProxy(userdn='/CN=user1'), self.longProxy)
+        self.assertEqual(FakeMyProxy.logons, 1)
+        getProxy(userdn='/CN=user2')
+        self.assertEqual(FakeMyProxy.logons, 2)
+        self.assertEqual(Utils.user_proxy_cache.misses, 2)
+
+    def testExpiringProxyNotReused(self):
+        # The proxy has less than USER_PROXY_MIN_TIME_LEFT seconds left.
+        Utils.USER_PROXY_MIN_TIME_LEFT = 3 * 86400
+        getProxy(userdn='/CN=user1')
+        getProxy(userdn='/CN=user1')
+        self.assertEqual(FakeMyProxy.logons, 2)
+
+    def testConcurrentLogon(self):
+        FakeMyProxy.latency = 0.2
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(getProxy(userdn='/CN=user1'))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [self.longProxy] * 10)
+        self.assertEqual(FakeMyProxy.logons, 1)
+
+    def testMalformedProxyNotCached(self):
+        FakeMyProxy.proxy = 'garbage'
+        self.assertRaises(Utils.InvalidParameter, getProxy, userdn='/CN=user1')
+        FakeMyProxy.proxy = self.longProxy
+        self.assertEqual(getProxy(userdn='/CN=user1'), self.longProxy)
+        self.assertEqual(FakeMyProxy.logons, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
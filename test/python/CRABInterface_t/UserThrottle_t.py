@@ -0,0 +1,215 @@
+"""
+Tests of CRABInterface.Utils.UserThrottle under a multi-threaded synthetic
+client load.
+"""
+
+import time
+import threading
+import unittest
+
+from CRABInterface import Utils
+from CRABInterface.Utils import UserThrottle, ThrottleError
+
+
+class FakeCherrypy(object):
+    """Stands for cherrypy: one request and response per thread."""
+
+    def __init__(self):
+        self.tls = threading.local()
+
+    def setUser(self, login):
+        self.tls.request = type('Request', (), {'user': {'login': login}})()
+        self.tls.response = type('Response', (), {'headers': {}})()
+
+    request = property(lambda self: self.tls.request)
+    response = property(lambda self: self.tls.response)
+
+
+class Client(threading.Thread):
+    """Calls 'operation' 'calls' times as 'user' and records the outcomes."""
+
+    def __init__(self, fake, user, operation, calls):
+        threading.Thread.__init__(self)
+        self.fake = fake
+        self.user = user
+        self.operation = operation
+        self.calls = calls
+        self.done = 0
+        self.retryAfter = []
+
+    def run(self):
+        for _ in range(self.calls):
+            self.fake.setUser(self.user)
+            try:
+                self.operation()
+                self.done += 1
+            except ThrottleError:
+                self.retryAfter.append(self.fake.response.headers['Retry-After'])
+
+
+class UserThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = Utils.cherrypy
+        self.fake = FakeCherrypy()
+        Utils.cherrypy = self.fake
+        self.active = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        Utils.cherrypy = self.saved
+
+    def operation(self, duration, weight):
+        """A throttled operation taking 'duration' seconds that tracks the units in use."""
+        def run():
+            user = self.fake.request.user['login']
+            with self.lock:
+                self.active[user] = self.active.get(user, 0) + weight
+                self.peak[user] = max(self.peak.get(user, 0), self.active[user])
+            time.sleep(duration)
+            with self.lock:
+                self.active[user] -= weight
+        return run
+
+    def runClients(self, clients):
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+    def testQueueing(self):
+        throttle = UserThrottle(limit=3, maxwait=5, maxqueue=10)
+        status = throttle.make_throttled()(self.operation(0.05, 1))
+        clients = [Client(self.fake, 'user1', status, 5) for _ in range(8)]
+        self.runClients(clients)
+        self.assertEqual(sum([client.done for client in clients]), 40)
+        self.assertEqual(throttle.rejected, 0)
+        self.assertEqual(throttle.admitted, 40)
+        self.assertTrue(throttle.queued > 0 and throttle.waittime > 0)
+        self.assertEqual(self.peak['user1'], 3)
+        self.assertEqual(throttle.users, {})
+
+    def testBoundedQueue(self):
+        throttle = UserThrottle(limit=3, maxwait=5, maxqueue=2)
+        status = throttle.make_throttled()(self.operation(0.3, 1))
+        clients = [Client(self.fake, 'user1', status, 1) for _ in range(10)]
+        self.runClients(clients)
+        # 3 run, 2 wait for them, the others are rejected right away.
+        self.assertEqual(sum([client.done for client in clients]), 5)
+        self.assertEqual(throttle.rejected, 5)
+        self.assertEqual(throttle.queued, 2)
+        retries = sum([client.retryAfter for client in clients], [])
+        self.assertEqual(len(retries), 5)
+        self.assertTrue(all([int(retry) >= 1 for retry in retries]))
+
+    def testBoundedWait(self):
+        throttle = UserThrottle(limit=3, maxwait=0.1, maxqueue=10)
+        status = throttle.make_throttled()(self.operation(1, 1))
+        clients = [Client(self.fake, 'user1', status, 1) for _ in range(5)]
+        start = time.time()
+        self.runClients(clients)
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual(throttle.rejected, 2)
+        self.assertTrue(0.2 <= throttle.waittime < 0.5)
+
+    def testRetryAfterFromDuration(self):
+        throttle = UserThrottle(limit=1, maxwait=0, maxqueue=10)
+        report = throttle.make_throttled()(self.operation(0.5, 1))
+        self.runClients([Client(self.fake, 'user1', report, 2)])
+        self.assertEqual(throttle.retryAfter('run'), 1)
+        self.runClients([Client(self.fake, 'user1', report, 1) for _ in range(2)])
+        self.assertEqual(throttle.rejected, 1)
+
+    def testWeights(self):
+        throttle = UserThrottle(limit=3, maxwait=5, maxqueue=20)
+        status = throttle.make_throttled()(self.operation(0.02, 1))
+        report = throttle.make_throttled(weight=2)(self.operation(0.05, 2))
+        clients = [Client(self.fake, 'user1', status, 10) for _ in range(4)] + \
+                  [Client(self.fake, 'user1', report, 5) for _ in range(3)]
+        self.runClients(clients)
+        self.assertEqual(sum([client.done for client in clients]), 55)
+        self.assertEqual(self.peak['user1'], 3)
+
+    def testHeavyWaiterNotStarved(self):
+        # Light operations keep arriving while a weight-2 one waits: they must
+        # not keep taking the unit it needs.
+        throttle = UserThrottle(limit=2, maxwait=2, maxqueue=20)
+        status = throttle.make_throttled()(self.operation(0.05, 1))
+        report = throttle.make_throttled(weight=2)(self.operation(0, 2))
+        clients = [Client(self.fake, 'user1', status, 30) for _ in range(2)]
+        for client in clients:
+            client.start()
+        time.sleep(0.1)
+        heavy = Client(self.fake, 'user1', report, 1)
+        self.runClients([heavy])
+        for client in clients:
+            client.join()
+        self.assertEqual(heavy.done, 1)
+        self.assertEqual(throttle.rejected, 0)
+
+    def testArrivalOrder(self):
+        throttle = UserThrottle(limit=1, maxwait=5, maxqueue=10)
+        order = []
+        def run():
+            order.append(threading.currentThread().getName())
+            time.sleep(0.05)
+        status = throttle.make_throttled()(run)
+        clients = []
+        for i in range(6):
+            client = Client(self.fake, 'user1', status, 1)
+            client.setName('client%d' % i)
+            client.start()
+            clients.append(client)
+            time.sleep(0.01)
+        for client in clients:
+            client.join()
+        self.assertEqual(order, ['client%d' % i for i in range(6)])
+
+    def testStatistics(self):
+        throttle = UserThrottle(limit=1, maxwait=0, maxqueue=10)
+        status = throttle.make_throttled()(self.operation(0.2, 1))
+        self.runClients([Client(self.fake, 'user1', status, 1) for _ in range(2)])
+        statistics = throttle.statistics()
+        self.assertEqual((statistics['admitted'], statistics['rejected']), (1, 1))
+        self.assertEqual((statistics['running'], statistics['waiting']), (0, 0))
+        self.assertEqual(Utils.getStatistics()['user throttle'], Utils.global_user_throttle.statistics())
+
+    def testGenerators(self):
+        # As report (a generator function) and logs/output (returning the getFiles generator).
+        throttle = UserThrottle(limit=3, maxwait=0, maxqueue=10)
+        held = []
+        def rows():
+            for i in range(3):
+                time.sleep(0.05)
+                held.append(throttle.users.get('user1'))
+                yield i
+        report = throttle.make_throttled(weight=2)(rows)
+        output = throttle.make_throttled(weight=2)(lambda: rows())
+        self.fake.setUser('user1')
+        self.assertEqual(report(), [0, 1, 2])
+        self.assertEqual(output(), [0, 1, 2])
+        self.assertEqual(held, [2] * 6)
+        self.assertEqual(throttle.users, {})
+        self.assertEqual(throttle.retryAfter('rows'), 1)
+        self.assertTrue(throttle.durations['rows'] >= 0.15)
+
+    def testUsersIndependent(self):
+        throttle = UserThrottle(limit=1, maxwait=0, maxqueue=10)
+        status = throttle.make_throttled()(self.operation(0.2, 1))
+        clients = [Client(self.fake, 'user%d' % i, status, 1) for i in range(5)]
+        self.runClients(clients)
+        self.assertEqual(throttle.rejected, 0)
+
+    def testNested(self):
+        throttle = UserThrottle(limit=1, maxwait=0, maxqueue=10)
+        status = throttle.make_throttled()(self.operation(0, 1))
+        report = throttle.make_throttled(weight=2)(status)
+        client = Client(self.fake, 'user1', report, 3)
+        self.runClients([client])
+        self.assertEqual(client.done, 3)
+        self.assertEqual(throttle.admitted, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests of the usage ledger of UserFileCache.RESTExtensions: the ledger must
+agree with the files of the user after interrupted updates, process crashes,
+corrupted ledgers and files removed behind its back.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from UserFileCache import RESTExtensions
+from UserFileCache.RESTExtensions import get_size, get_usage, usage_update, list_files, LEDGER_FILE
+
+
+class UsageLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.userdir = os.path.join(tempfile.mkdtemp(), 'u', 'user')
+        self.saved = RESTExtensions.LEDGER_RECONCILE_TIME
+
+    def tearDown(self):
+        RESTExtensions.LEDGER_RECONCILE_TIME = self.saved
+        shutil.rmtree(self.userdir.rsplit('/', 2)[0])
+
+    def writeFile(self, name, size):
+        """Write a file of the user as RESTFile.put does, returning its size"""
+        dirname = os.path.join(self.userdir, name[0:2])
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, name), 'wb') as fd:
+            fd.write('x' * size)
+        return size
+
+    def upload(self, name, size):
+        with usage_update(self.userdir) as ledger:
+            ledger['size'] += self.writeFile(name, size)
+
+    def ledger(self):
+        with open(os.path.join(self.userdir, LEDGER_FILE)) as fd:
+            return json.load(fd)
+
+    def testAccounting(self):
+        self.assertEqual(get_usage(self.userdir), 0)
+        for i in range(20):
+            self.upload('%02dfile' % i, 100 * i)
+        with usage_update(self.userdir) as ledger:
+            filename = os.path.join(self.userdir, '05', '05file')
+            ledger['size'] -= os.path.getsize(filename)
+            os.remove(filename)
+        self.assertEqual(get_usage(self.userdir), get_size(self.userdir))
+        self.assertEqual(get_usage(self.userdir), 100 * (sum(range(20)) - 5))
+        self.assertFalse(self.ledger()['dirty'])
+        self.assertEqual(sorted(list_files(self.userdir)), ['%02dfile' % i for i in range(20) if i != 5])
+
+    def testInterruptedUpdate(self):
+        self.upload('aafile', 1000)
+
+        def failingUpload():
+            with usage_update(self.userdir) as ledger:
+                self.writeFile('bbfile', 500)
+                raise IOError("disk full")
+        self.assertRaises(IOError, failingUpload)
+        self.assertTrue(self.ledger()['dirty'])
+        self.assertEqual(get_usage(self.userdir), 1500)
+        self.assertFalse(self.ledger()['dirty'])
+
+    def testProcessCrash(self):
+        self.upload('aafile', 1000)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                with usage_update(self.userdir) as ledger:
+                    self.writeFile('bbfile', 700)
+                    os._exit(0)
+            finally:
+                os._exit(1)
+        os.waitpid(pid, 0)
+        # The lock died with the process and the dirty ledger is reconciled.
+        self.assertEqual(get_usage(self.userdir), 1700)
+        self.upload('ccfile', 300)
+        self.assertEqual(get_usage(self.userdir), 2000)
+
+    def testCorruptedLedger(self):
+        self.upload('aafile', 1000)
+        for content in ['', '{"size": 10', '[]', '{"size": "x", "reconciled": 0, "dirty": false}']:
+            with open(os.path.join(self.userdir, LEDGER_FILE), 'w') as fd:
+                fd.write(content)
+            self.assertEqual(get_usage(self.userdir), 1000)
+        # A temporary ledger left by a crash is not counted as a file of the user.
+        with open(os.path.join(self.userdir, LEDGER_FILE + '.123.tmp'), 'w') as fd:
+            fd.write('{"size": 12345}')
+        self.assertEqual(get_size(self.userdir), 1000)
+
+    def testReconciliation(self):
+        self.upload('aafile', 1000)
+        self.upload('bbfile', 500)
+        # Removed by the cache cleanup, outside of the ledger.
+        os.remove(os.path.join(self.userdir, 'aa', 'aafile'))
+        self.assertEqual(get_usage(self.userdir), 1500)
+        RESTExtensions.LEDGER_RECONCILE_TIME = 0
+        self.assertEqual(get_usage(self.userdir), 500)
+
+    def testFailedCheck(self):
+        self.upload('aafile', 1000)
+
+        def overQuota(used):
+            raise ValueError("quota reached with %d bytes" % used)
+        def upload():
+            with usage_update(self.userdir, overQuota) as ledger:
+                ledger['size'] += self.writeFile('bbfile', 10)
+        self.assertRaises(ValueError, upload)
+        self.assertFalse(os.path.exists(os.path.join(self.userdir, 'bb')))
+        self.assertFalse(self.ledger()['dirty'])
+        self.assertEqual(self.ledger()['size'], 1000)
+
+    def testConcurrentUpdates(self):
+        def uploads(thread):
+            for i in range(20):
+                self.upload('%02d%d' % (i, thread), i + thread)
+        threads = [threading.Thread(target=uploads, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.ledger()['size'], get_size(self.userdir))
+        self.assertEqual(get_size(self.userdir), sum([i + t for i in range(20) for t in range(8)]))
+
+
+if __name__ == '__main__':
+    unittest.main()